@@ -11,7 +11,7 @@ from inbox.models.folder import Folder
 from inbox.models.category import Category
 from imaplib import IMAP4
 from inbox.sendmail.base import generate_attachments
-from inbox.sendmail.message import create_email
+from inbox.sendmail.message import create_email, bcc_header
 
 log = get_logger()
 
@@ -27,9 +27,9 @@ __all__ = ['set_remote_starred', 'set_remote_unread', 'remote_move',
 # * should add support for rolling back message.categories() on failure.
 
 
-def uids_by_folder(message_id, db_session):
+def uids_by_folder(message_ids, db_session):
     results = db_session.query(ImapUid.msg_uid, Folder.name).join(Folder). \
-        filter(ImapUid.message_id == message_id).all()
+        filter(ImapUid.message_id.in_(message_ids)).all()
     mapping = defaultdict(list)
     for uid, folder_name in results:
         mapping[folder_name].append(uid)
@@ -56,10 +56,10 @@ def _create_email(account, message):
 
 
 @retry_crispin
-def _set_flag(account, message_id, flag_name, db_session, is_add):
-    uids_for_message = uids_by_folder(message_id, db_session)
+def _set_flag(account, message_ids, flag_name, db_session, is_add):
+    uids_for_message = uids_by_folder(message_ids, db_session)
     if not uids_for_message:
-        log.warning('No UIDs found for message', message_id=message_id)
+        log.warning('No UIDs found for messages', message_ids=message_ids)
         return
 
     with writable_connection_pool(account.id).get() as crispin_client:
@@ -71,19 +71,19 @@ def _set_flag(account, message_id, flag_name, db_session, is_add):
                 crispin_client.conn.remove_flags(uids, [flag_name])
 
 
-def set_remote_starred(account, message_id, db_session, starred):
-    _set_flag(account, message_id, '\\Flagged', db_session, starred)
+def set_remote_starred(account, message_ids, db_session, starred):
+    _set_flag(account, message_ids, '\\Flagged', db_session, starred)
 
 
-def set_remote_unread(account, message_id, db_session, unread):
-    _set_flag(account, message_id, '\\Seen', db_session, not unread)
+def set_remote_unread(account, message_ids, db_session, unread):
+    _set_flag(account, message_ids, '\\Seen', db_session, not unread)
 
 
 @retry_crispin
-def remote_move(account, message_id, db_session, destination):
-    uids_for_message = uids_by_folder(message_id, db_session)
+def remote_move(account, message_ids, db_session, destination):
+    uids_for_message = uids_by_folder(message_ids, db_session)
     if not uids_for_message:
-        log.warning('No UIDs found for message', message_id=message_id)
+        log.warning('No UIDs found for messages', message_ids=message_ids)
         return
 
     with writable_connection_pool(account.id).get() as crispin_client:
@@ -176,7 +176,13 @@ def remote_delete_draft(account, inbox_uid, message_id_header, db_session):
 
 @retry_crispin
 def remote_save_sent(account, message):
-    mimemsg = _create_email(account, message)
+    if message.full_body is not None:
+        # The message as it was sent, which doesn't have the Bcc header.
+        mimemsg = message.full_body.data
+        if message.bcc_addr:
+            mimemsg = bcc_header(message.bcc_addr) + mimemsg
+    else:
+        mimemsg = _create_email(account, message)
     with writable_connection_pool(account.id).get() as crispin_client:
         if 'sent' not in crispin_client.folder_names():
             log.info('Account has no detected sent folder; not saving message',
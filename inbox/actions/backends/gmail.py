@@ -19,9 +19,9 @@ __all__ = ['set_remote_starred', 'set_remote_unread', 'remote_save_draft',
            'remote_delete_label']
 
 
-def remote_change_labels(account, message_id, db_session, removed_labels,
+def remote_change_labels(account, message_ids, db_session, removed_labels,
                          added_labels):
-    uids_for_message = uids_by_folder(message_id, db_session)
+    uids_for_message = uids_by_folder(message_ids, db_session)
     with writable_connection_pool(account.id).get() as crispin_client:
         for folder_name, uids in uids_for_message.items():
             crispin_client.select_folder(folder_name, uidvalidity_cb)
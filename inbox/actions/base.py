@@ -22,6 +22,9 @@ not really a problem because of the limited ways mail messages can change.
 ACTIONS MUST BE IDEMPOTENT! We are going to have task workers guarantee
 at-least-once semantics.
 
+The message actions also run the actions scheduled on many messages at once
+with `schedule_bulk_action`: their ids are then in the `record_ids` argument.
+
 """
 from inbox.actions.backends import module_registry
 
@@ -32,36 +35,40 @@ log = get_logger()
 
 def mark_unread(account_id, message_id, db_session, args):
     unread = args['unread']
+    message_ids = args.get('record_ids', [message_id])
 
     account = db_session.query(Account).get(account_id)
     set_remote_unread = module_registry[account.provider]. \
         set_remote_unread
-    set_remote_unread(account, message_id, db_session, unread)
+    set_remote_unread(account, message_ids, db_session, unread)
 
 
 def mark_starred(account_id, message_id, db_session, args):
     starred = args['starred']
+    message_ids = args.get('record_ids', [message_id])
     account = db_session.query(Account).get(account_id)
     set_remote_starred = module_registry[account.provider]. \
         set_remote_starred
-    set_remote_starred(account, message_id, db_session, starred)
+    set_remote_starred(account, message_ids, db_session, starred)
 
 
 def move(account_id, message_id, db_session, args):
     destination = args['destination']
+    message_ids = args.get('record_ids', [message_id])
     account = db_session.query(Account).get(account_id)
     remote_move = module_registry[account.provider].remote_move
-    remote_move(account, message_id, db_session, destination)
+    remote_move(account, message_ids, db_session, destination)
 
 
 def change_labels(account_id, message_id, db_session, args):
     added_labels = args['added_labels']
     removed_labels = args['removed_labels']
+    message_ids = args.get('record_ids', [message_id])
     account = db_session.query(Account).get(account_id)
     assert account.provider == 'gmail'
     remote_change_labels = module_registry[account.provider]. \
         remote_change_labels
-    remote_change_labels(account, message_id, db_session, removed_labels,
+    remote_change_labels(account, message_ids, db_session, removed_labels,
                          added_labels)
 
 
@@ -0,0 +1,90 @@
+"""
+Accept-Encoding negotiated gzip/deflate compression of API responses.
+
+Regular responses are compressed in one go, unless they are smaller than the
+API_COMPRESSION_MIN_SIZE config option (in bytes). Streamed responses, like
+/delta/streaming, are compressed incrementally: each chunk the application
+yields is flushed to the client as soon as it's compressed, so compression
+doesn't delay it.
+
+"""
+import zlib
+
+from inbox.config import config
+
+# Responses smaller than this aren't worth compressing.
+DEFAULT_MIN_SIZE = 1024
+
+COMPRESSION_LEVEL = 6
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/event-stream',
+                          'text/plain', 'text/html'}
+
+# zlib window bits producing each content coding: gzip framing, or zlib
+# framing for 'deflate' (RFC 7230, section 4.2.2).
+WBITS = {'gzip': 16 + zlib.MAX_WBITS,
+         'deflate': zlib.MAX_WBITS}
+
+
+def negotiate_encoding(accept_encodings):
+    """
+    Return the content coding to use given the request's parsed
+    Accept-Encoding header (a werkzeug Accept object): 'gzip' or 'deflate',
+    whichever the client prefers (gzip on ties), or None.
+
+    """
+    best, best_quality = None, 0
+    for encoding in ('gzip', 'deflate'):
+        quality = accept_encodings.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress_response(response, accept_encodings):
+    if (response.direct_passthrough or
+            response.status_code in (204, 304) or
+            'Content-Encoding' in response.headers or
+            response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(accept_encodings)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < config.get('API_COMPRESSION_MIN_SIZE',
+                                  DEFAULT_MIN_SIZE):
+            return response
+        compressor = _compressor(encoding)
+        response.set_data(compressor.compress(data) + compressor.flush())
+
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def _compressor(encoding):
+    return zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, WBITS[encoding])
+
+
+def _compress_stream(body, encoding):
+    compressor = _compressor(encoding)
+    try:
+        for chunk in body:
+            if not chunk:
+                continue
+            if isinstance(chunk, unicode):
+                chunk = chunk.encode('utf-8')
+            # Sync-flush each chunk so it reaches the client right away, with
+            # the compression state kept across chunks.
+            yield (compressor.compress(chunk) +
+                   compressor.flush(zlib.Z_SYNC_FLUSH))
+        yield compressor.flush()
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
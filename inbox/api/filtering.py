@@ -1,18 +1,33 @@
-from sqlalchemy import and_, or_, desc, asc, func, bindparam
-from sqlalchemy.orm import subqueryload, contains_eager
+import arrow
+from itertools import islice
+from operator import attrgetter
+from sqlalchemy import (and_, or_, desc, asc, func, bindparam, null, true,
+                        union_all)
+from sqlalchemy.orm import subqueryload, contains_eager, defer
 from inbox.api.err import InputError
 from inbox.api.validation import valid_public_id
 from inbox.models import (Contact, Event, Calendar, Message,
                           MessageContactAssociation, Thread,
                           Block, Part, MessageCategory, Category)
-from inbox.models.event import RecurringEvent
+from inbox.models.event import (RecurringEvent, RecurringEventOverride,
+                                EventOccurrence, EventInterval, InflatedEvent)
+from inbox.events.occurrences import default_expansion_end
+from inbox.events.recurring import get_start_times
 from inbox.sqlalchemy_ext.util import bakery
+from inbox.util.itert import merge_sorted
+
+# Keys of the API representation of threads that are computed from their
+# messages. If none of them is requested, the messages aren't loaded.
+THREAD_MESSAGE_FIELDS = {'participants', 'last_message_received_timestamp',
+                         'unread', 'starred', 'has_attachments', 'tags',
+                         'folders', 'labels', 'message_ids', 'draft_ids',
+                         'messages', 'drafts'}
 
 
 def threads(namespace_id, subject, from_addr, to_addr, cc_addr, bcc_addr,
             any_email, thread_public_id, started_before, started_after,
             last_message_before, last_message_after, filename, in_, unread,
-            starred, limit, offset, view, db_session):
+            starred, limit, offset, view, db_session, fields=None):
 
     if view == 'count':
         query = db_session.query(func.count(Thread.id))
@@ -120,7 +135,7 @@ def threads(namespace_id, subject, from_addr, to_addr, cc_addr, bcc_addr,
 
     # Eager-load some objects in order to make constructing API
     # representations faster.
-    if view != 'ids':
+    if view != 'ids' and (fields is None or fields & THREAD_MESSAGE_FIELDS):
         expand = (view == 'expanded')
         query = query.options(*Thread.api_loading_options(expand))
 
@@ -140,7 +155,7 @@ def messages_or_drafts(namespace_id, drafts, subject, from_addr, to_addr,
                        started_before, started_after, last_message_before,
                        last_message_after, received_before, received_after,
                        filename, in_, unread, starred, limit, offset, view,
-                       db_session):
+                       db_session, fields=None):
     # Warning: complexities ahead. This function sets up the query that gets
     # results for the /messages API. It loads from several tables, supports a
     # variety of views and filters, and is performance-critical for the API. As
@@ -318,16 +333,47 @@ def messages_or_drafts(namespace_id, drafts, subject, from_addr, to_addr,
     # faster. Note that we don't use the options defined by
     # Message.api_loading_options() here because we already have a join to the
     # thread table. We should eventually try to simplify this.
-    query += lambda q: q.options(
-                contains_eager(Message.thread),
-                subqueryload(Message.messagecategories).joinedload('category'),
-                subqueryload(Message.parts).joinedload(Part.block),
-                subqueryload(Message.events))
+    if fields is None:
+        query += lambda q: q.options(
+                    contains_eager(Message.thread),
+                    subqueryload(Message.messagecategories).
+                    joinedload('category'),
+                    subqueryload(Message.parts).joinedload(Part.block),
+                    subqueryload(Message.events))
+    else:
+        # Only load what the requested fields need. In particular, don't load
+        # (and then decompress) the body unless it's requested. Each option
+        # is its own step, so that every combination is baked separately.
+        query += lambda q: q.options(contains_eager(Message.thread))
+        if 'body' not in fields:
+            query += lambda q: q.options(defer(Message._compacted_body))
+        if 'folder' in fields or 'labels' in fields:
+            query += lambda q: q.options(
+                subqueryload(Message.messagecategories).joinedload('category'))
+        if 'files' in fields:
+            query += lambda q: q.options(
+                subqueryload(Message.parts).joinedload(Part.block))
+        if 'events' in fields:
+            query += lambda q: q.options(subqueryload(Message.events))
 
     prepared = query(db_session).params(**param_dict)
     return prepared.all()
 
 
+def objects_by_public_id(cls, public_ids, namespace_id, expand, db_session):
+    """
+    Load the objects of model `cls` with the given public ids in the
+    namespace, in one query. Returns a dict mapping the public ids of the
+    objects found to them.
+
+    """
+    query = db_session.query(cls).filter(cls.namespace_id == namespace_id,
+                                         cls.public_id.in_(public_ids))
+    if hasattr(cls, 'api_loading_options'):
+        query = query.options(*cls.api_loading_options(expand))
+    return {obj.public_id: obj for obj in query}
+
+
 def files(namespace_id, message_public_id, filename, content_type,
           limit, offset, view, db_session):
 
@@ -440,10 +486,87 @@ def recurring_events(filters, starts_before, starts_after, ends_before,
             starts_before = ends_before - r.length
         if ends_after and not starts_after:
             starts_after = ends_after - r.length
-        instances = r.all_events(start=starts_after, end=starts_before)
-        recur_instances.extend(instances)
+        instances = r.iter_events(start=starts_after, end=starts_before)
+        recur_instances.append(instances)
+
+    # The instances are generated lazily in start order, so callers only pay
+    # for the ones they consume.
+    return merge_sorted(recur_instances, key=attrgetter('start'))
+
+
+def _recurring_event_ids(filters, db_session, show_cancelled):
+    query = db_session.query(RecurringEvent.id).select_from(RecurringEvent)
+    query = filter_event_query(query, RecurringEvent, *filters)
+    if show_cancelled is False:
+        query = query.filter(RecurringEvent.status != 'cancelled')
+    return query
+
 
-    return recur_instances
+def occurrences_materialized(filters, starts_before, ends_before, db_session,
+                             show_cancelled=False):
+    # Whether the occurrences of all matching recurring events have been
+    # materialized far enough to answer the query from the eventoccurrence
+    # table (see events/occurrences.py).
+    if starts_before is None and ends_before is None:
+        range_end = default_expansion_end()
+    else:
+        range_end = min(t for t in (starts_before, ends_before)
+                        if t is not None)
+    query = _recurring_event_ids(filters, db_session, show_cancelled)
+    query = query.filter(or_(RecurringEvent.occurrences_until == None,
+                             RecurringEvent.occurrences_until < range_end))
+    return query.first() is None
+
+
+def materialized_events(query, filters, starts_before, starts_after,
+                        ends_before, ends_after, db_session,
+                        show_cancelled=False):
+    # Returns a subquery of (event_id, master_event_id, start) rows for the
+    # non-recurring events matched by `query` and the materialized
+    # occurrences of matching recurring events. Inflated instances have a
+    # null event_id; overrides and non-recurring events have no master.
+    single_events = query.filter(Event.discriminator == 'event'). \
+        with_entities(Event.id.label('event_id'),
+                      null().label('master_event_id'),
+                      Event.start.label('start'))
+
+    master_ids = _recurring_event_ids(filters, db_session, show_cancelled)
+    # Bounds are inclusive for occurrences, like RRULE expansion is.
+    criteria = [EventOccurrence.namespace_id == filters[0],
+                EventOccurrence.master_event_id.in_(master_ids.statement)]
+    if starts_before is not None:
+        criteria.append(EventOccurrence.start <= starts_before)
+    if starts_after is not None:
+        criteria.append(EventOccurrence.start >= starts_after)
+    if ends_before is not None:
+        criteria.append(EventOccurrence.end <= ends_before)
+    if ends_after is not None:
+        criteria.append(EventOccurrence.end >= ends_after)
+    if starts_before is None and ends_before is None:
+        criteria.append(EventOccurrence.start <= default_expansion_end())
+    occurrences = db_session.query(
+        EventOccurrence.override_event_id.label('event_id'),
+        EventOccurrence.master_event_id.label('master_event_id'),
+        EventOccurrence.start.label('start')).filter(*criteria)
+
+    return union_all(single_events.statement, occurrences.statement).alias()
+
+
+def load_materialized_events(rows, db_session):
+    event_ids = {r.event_id for r in rows if r.event_id is not None}
+    master_ids = {r.master_event_id for r in rows if r.event_id is None}
+    events = {}
+    if event_ids:
+        events.update((e.id, e) for e in db_session.query(Event).filter(
+            Event.id.in_(event_ids)))
+    masters = {}
+    if master_ids:
+        masters.update((e.id, e) for e in db_session.query(
+            RecurringEvent).filter(RecurringEvent.id.in_(master_ids)))
+
+    return [events[r.event_id] if r.event_id is not None else
+            InflatedEvent(masters[r.master_event_id], r.start)
+            for r in rows]
 
 
 def events(namespace_id, event_public_id, calendar_public_id, title,
@@ -494,22 +617,45 @@ def events(namespace_id, event_public_id, calendar_public_id, title,
     event_predicate = and_(*event_criteria)
     query = query.filter(event_predicate)
 
-    if expand_recurring:
+    if expand_recurring and occurrences_materialized(
+            filters, starts_before, ends_before, db_session, show_cancelled):
+        expanded = materialized_events(query, filters, starts_before,
+                                       starts_after, ends_before, ends_after,
+                                       db_session,
+                                       show_cancelled=show_cancelled)
+        if view == 'count':
+            return {"count": db_session.query(func.count()).
+                    select_from(expanded).scalar()}
+
+        rows = db_session.query(expanded).order_by(
+            asc(expanded.c.start), asc(expanded.c.master_event_id),
+            asc(expanded.c.event_id))
+        if limit:
+            rows = rows.limit(limit).offset(offset or 0)
+        all_events = load_materialized_events(rows.all(), db_session)
+    elif expand_recurring:
+        # Some matching recurring events haven't been materialized far
+        # enough yet, expand them on the fly.
         expanded = recurring_events(filters, starts_before, starts_after,
                                     ends_before, ends_after, db_session,
                                     show_cancelled=show_cancelled)
-
-        # Combine non-recurring events with expanded recurring ones
-        all_events = query.filter(Event.discriminator == 'event').all() + \
-            expanded
+        single_events = query.filter(Event.discriminator == 'event')
 
         if view == 'count':
-            return {"count": len(all_events)}
+            return {"count": single_events.count() +
+                    sum(1 for _ in expanded)}
 
-        all_events = sorted(all_events, key=lambda e: e.start)
+        # Combine non-recurring events with expanded recurring ones, only
+        # expanding as many instances as the requested page needs.
+        single_events = single_events.order_by(asc(Event.start))
+        offset = offset or 0
         if limit:
-            offset = offset or 0
-            all_events = all_events[offset:offset + limit]
+            single_events = single_events.limit(offset + limit)
+        all_events = merge_sorted([single_events, expanded],
+                                  key=attrgetter('start'))
+        if limit:
+            all_events = islice(all_events, offset, offset + limit)
+        all_events = list(all_events)
     else:
         if view == 'count':
             return {"count": query.one()[0]}
@@ -526,7 +672,72 @@ def events(namespace_id, event_public_id, calendar_public_id, title,
         return all_events
 
 
-def messages_for_contact_scores(db_session, namespace_id, starts_after=None):
+def free_busy(calendar_ids, start, end, db_session):
+    """
+    Return the merged (start, end) intervals during which events on the
+    given calendars make their owners busy between `start` and `end`,
+    clipped to that range.
+
+    Intervals come from the eventinterval table (see events/occurrences.py);
+    recurring events that haven't been materialized up to `end` are expanded
+    on the fly instead.
+
+    """
+    start = arrow.get(start)
+    end = arrow.get(end)
+    if not calendar_ids:
+        return []
+
+    unmaterialized = db_session.query(RecurringEvent).filter(
+        RecurringEvent.calendar_id.in_(calendar_ids),
+        RecurringEvent.status != 'cancelled',
+        or_(RecurringEvent.occurrences_until == None,
+            RecurringEvent.occurrences_until < end)).all()
+    unmaterialized_ids = {master.id for master in unmaterialized}
+
+    rows = db_session.query(EventInterval.event_id, EventInterval.start,
+                            EventInterval.end).filter(
+        EventInterval.calendar_id.in_(calendar_ids),
+        EventInterval.busy == true(),
+        EventInterval.end > start,
+        EventInterval.start < end)
+    intervals = [(row.start, row.end) for row in rows
+                 if row.event_id not in unmaterialized_ids]
+    for master in unmaterialized:
+        intervals.extend(_busy_instances(master, start, end))
+
+    merged = []
+    for interval_start, interval_end in sorted(intervals):
+        interval_start = max(interval_start, start)
+        interval_end = min(interval_end, end)
+        if interval_end <= interval_start:
+            continue
+        if merged and interval_start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], interval_end))
+        else:
+            merged.append((interval_start, interval_end))
+    return merged
+
+
+def _busy_instances(master, start, end):
+    # Same override semantics as materialize_occurrences().
+    overrides = master.overrides.filter(
+        RecurringEventOverride.calendar_id == master.calendar_id).all()
+    overridden_starts = {o.original_start_time for o in overrides}
+    length = master.length
+    instances = []
+    if master.busy:
+        instances.extend(
+            (instance_start, instance_start + length) for instance_start in
+            get_start_times(master, start - length, end)
+            if instance_start not in overridden_starts)
+    instances.extend((o.start, o.end) for o in overrides
+                     if o.busy and not o.cancelled)
+    return instances
+
+
+def messages_for_contact_scores(db_session, namespace_id, starts_after=None,
+                                message_ids=None):
     query = (db_session.query(
                 Message.to_addr, Message.cc_addr, Message.bcc_addr,
                 Message.id, Message.received_date.label('date'))
@@ -538,5 +749,7 @@ def messages_for_contact_scores(db_session, namespace_id, starts_after=None):
 
     if starts_after:
         query = query.filter(Message.received_date > starts_after)
+    if message_ids is not None:
+        query = query.filter(Message.id.in_(message_ids))
 
     return query.all()
@@ -2,7 +2,7 @@ import arrow
 import datetime
 import calendar
 from json import JSONEncoder, dumps
-from flask import Response
+from flask import Response, request
 
 from inbox.models import (Message, Contact, Calendar, Event, When,
                           Thread, Namespace, Block, Category, Account)
@@ -36,10 +36,11 @@ def format_phone_numbers(phone_numbers):
     return formatted_phone_numbers
 
 
-def encode(obj, namespace_public_id=None, expand=False, legacy_nsid=False):
+def encode(obj, namespace_public_id=None, expand=False, legacy_nsid=False,
+           fields=None):
     try:
         return _encode(obj, namespace_public_id, expand,
-                       legacy_nsid=legacy_nsid)
+                       legacy_nsid=legacy_nsid, fields=fields)
     except Exception as e:
         error_context = {
             "id": getattr(obj, "id", None),
@@ -50,7 +51,8 @@ def encode(obj, namespace_public_id=None, expand=False, legacy_nsid=False):
         raise
 
 
-def _encode(obj, namespace_public_id=None, expand=False, legacy_nsid=False):
+def _encode(obj, namespace_public_id=None, expand=False, legacy_nsid=False,
+            fields=None):
     """
     Returns a dictionary representation of an Inbox model object obj, or
     None if there is no such representation defined. If the optional
@@ -63,6 +65,9 @@ def _encode(obj, namespace_public_id=None, expand=False, legacy_nsid=False):
     ----------
     namespace_public_id: string, optional
         public id of the namespace to which the object to serialize belongs.
+    fields: set, optional
+        keys to include in the representation of messages and threads (their
+        'id' and 'object' are always included). Only these are computed.
 
     Returns
     -------
@@ -72,6 +77,15 @@ def _encode(obj, namespace_public_id=None, expand=False, legacy_nsid=False):
     def _get_namespace_public_id(obj):
         return namespace_public_id or obj.namespace.public_id
 
+    def _wanted(key):
+        return fields is None or key in fields
+
+    def _select_fields(resp):
+        if fields is None:
+            return resp
+        return {key: value for key, value in resp.iteritems()
+                if key in fields or key in ('id', 'object')}
+
     def _format_participant_data(participant):
         """Event.participants is a JSON blob which may contain internal data.
         This function returns a dict with only the data we want to make
@@ -158,27 +172,35 @@ def _encode(obj, namespace_public_id=None, expand=False, legacy_nsid=False):
             'date': obj.received_date,
             'thread_id': obj.thread.public_id,
             'snippet': obj.snippet,
-            'body': obj.body,
             'unread': not obj.is_read,
-            'starred': obj.is_starred,
-            'files': obj.api_attachment_metadata,
-            'events': [encode(e, legacy_nsid=legacy_nsid) for e in obj.events]
+            'starred': obj.is_starred
         }
 
-        categories = format_categories(obj.categories)
-        if obj.namespace.account.category_type == 'folder':
-            resp['folder'] = categories[0] if categories else None
-        else:
-            resp['labels'] = categories
+        # These are expensive to compute, only do it if they're requested.
+        if _wanted('body'):
+            resp['body'] = obj.body
+        if _wanted('files'):
+            resp['files'] = obj.api_attachment_metadata
+        if _wanted('events'):
+            resp['events'] = [encode(e, legacy_nsid=legacy_nsid)
+                              for e in obj.events]
+
+        if _wanted('folder') or _wanted('labels'):
+            categories = format_categories(obj.categories)
+            if obj.namespace.account.category_type == 'folder':
+                resp['folder'] = categories[0] if categories else None
+            else:
+                resp['labels'] = categories
 
         # If the message is a draft (Inbox-created or otherwise):
         if obj.is_draft:
             resp['object'] = 'draft'
             resp['version'] = obj.version
-            if obj.reply_to_message is not None:
-                resp['reply_to_message_id'] = obj.reply_to_message.public_id
-            else:
-                resp['reply_to_message_id'] = None
+            if _wanted('reply_to_message_id'):
+                reply_to_message = obj.reply_to_message
+                resp['reply_to_message_id'] = (reply_to_message.public_id
+                                               if reply_to_message is not None
+                                               else None)
 
         if expand:
             resp['headers'] = {
@@ -187,7 +209,7 @@ def _encode(obj, namespace_public_id=None, expand=False, legacy_nsid=False):
                 'References': obj.references
             }
 
-        return resp
+        return _select_fields(resp)
 
     elif isinstance(obj, Thread):
         base = {
@@ -195,30 +217,45 @@ def _encode(obj, namespace_public_id=None, expand=False, legacy_nsid=False):
             'object': 'thread',
             public_id_key_name: _get_namespace_public_id(obj),
             'subject': obj.subject,
-            'participants': format_address_list(obj.participants),
             'last_message_timestamp': obj.recentdate,
-            'last_message_received_timestamp': obj.receivedrecentdate,
             'first_message_timestamp': obj.subjectdate,
             'snippet': obj.snippet,
-            'unread': obj.unread,
-            'starred': obj.starred,
-            'has_attachments': obj.has_attachments,
-            'version': obj.version,
+            'version': obj.version
+        }
+
+        # These are computed from the thread's messages, only do it if
+        # they're requested.
+        message_fields = {
+            'participants': lambda: format_address_list(obj.participants),
+            'last_message_received_timestamp':
+                lambda: obj.receivedrecentdate,
+            'unread': lambda: obj.unread,
+            'starred': lambda: obj.starred,
+            'has_attachments': lambda: obj.has_attachments,
             # For backwards-compatibility -- remove after deprecating tags API
-            'tags': obj.tags
+            'tags': lambda: obj.tags
         }
+        for key, value in message_fields.iteritems():
+            if _wanted(key):
+                base[key] = value()
 
-        categories = format_categories(obj.categories)
-        if obj.namespace.account.category_type == 'folder':
-            base['folders'] = categories
-        else:
-            base['labels'] = categories
+        if _wanted('folders') or _wanted('labels'):
+            categories = format_categories(obj.categories)
+            if obj.namespace.account.category_type == 'folder':
+                base['folders'] = categories
+            else:
+                base['labels'] = categories
 
         if not expand:
-            base['message_ids'] = \
-                [m.public_id for m in obj.messages if not m.is_draft]
-            base['draft_ids'] = [m.public_id for m in obj.drafts]
-            return base
+            if _wanted('message_ids'):
+                base['message_ids'] = \
+                    [m.public_id for m in obj.messages if not m.is_draft]
+            if _wanted('draft_ids'):
+                base['draft_ids'] = [m.public_id for m in obj.drafts]
+            return _select_fields(base)
+
+        if not (_wanted('messages') or _wanted('drafts')):
+            return _select_fields(base)
 
         # Expand messages within threads
         all_expanded_messages = []
@@ -261,7 +298,7 @@ def _encode(obj, namespace_public_id=None, expand=False, legacy_nsid=False):
 
         base['messages'] = all_expanded_messages
         base['drafts'] = all_expanded_drafts
-        return base
+        return _select_fields(base)
 
     elif isinstance(obj, Contact):
         return {
@@ -363,6 +400,15 @@ def _encode(obj, namespace_public_id=None, expand=False, legacy_nsid=False):
         return resp
 
 
+# Lists are streamed in chunks of about this many bytes.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def pretty_requested():
+    """ Whether the client asked for indented JSON with ?pretty=true. """
+    return request.args.get('pretty', '').lower() == 'true'
+
+
 class APIEncoder(object):
     """
     Provides methods for serializing Inbox objects. If the optional
@@ -376,20 +422,30 @@ class APIEncoder(object):
     ----------
     namespace_public_id: string, optional
         public id of the namespace to which the object to serialize belongs.
+    stream_lists: bool, optional
+        Whether `jsonify` streams lists, encoding their items as the response
+        is sent. The objects must stay usable until then, i.e. their session
+        must outlive the request handler.
+    fields: set, optional
+        If given, only these keys (plus 'id' and 'object') are included in the
+        representation of messages and threads.
 
     """
     def __init__(self, namespace_public_id=None, expand=False,
-                 legacy_nsid=False):
+                 legacy_nsid=False, stream_lists=False, fields=None):
         self.encoder_class = self._encoder_factory(namespace_public_id, expand,
-                                                   legacy_nsid)
+                                                   legacy_nsid, fields)
+        self.stream_lists = stream_lists
 
-    def _encoder_factory(self, namespace_public_id, expand, legacy_nsid):
+    def _encoder_factory(self, namespace_public_id, expand, legacy_nsid,
+                         fields):
         class InternalEncoder(JSONEncoder):
             def default(self, obj):
                 custom_representation = encode(obj,
                                                namespace_public_id,
                                                expand=expand,
-                                               legacy_nsid=legacy_nsid)
+                                               legacy_nsid=legacy_nsid,
+                                               fields=fields)
                 if custom_representation is not None:
                     return custom_representation
                 # Let the base class default method raise the TypeError
@@ -404,7 +460,8 @@ class APIEncoder(object):
         ----------
         obj: serializable object
         pretty: bool, optional
-            Whether to pretty-print the string (with 4-space indentation).
+            Whether to pretty-print the string (with 4-space indentation and
+            sorted keys). Otherwise the representation is compact.
 
         Raises
         ------
@@ -418,12 +475,36 @@ class APIEncoder(object):
                          indent=4,
                          separators=(',', ': '),
                          cls=self.encoder_class)
-        return dumps(obj, cls=self.encoder_class)
+        return dumps(obj, separators=(',', ':'), cls=self.encoder_class)
+
+    def iter_list(self, items):
+        """
+        Yields the compact JSON representation of the list `items` in
+        chunks, encoding one item at a time, so that the whole representation
+        is never held in memory.
+
+        """
+        encoder = self.encoder_class(separators=(',', ':'))
+        chunk = ['[']
+        size = 0
+        for i, item in enumerate(items):
+            if i:
+                chunk.append(',')
+            item_json = encoder.encode(item)
+            chunk.append(item_json)
+            size += len(item_json)
+            if size >= STREAM_CHUNK_SIZE:
+                yield ''.join(chunk)
+                chunk = []
+                size = 0
+        chunk.append(']')
+        yield ''.join(chunk)
 
     def jsonify(self, obj):
         """
         Returns a Flask Response object encapsulating the JSON
-        representation of obj.
+        representation of obj. The representation is compact unless the
+        client asked for ?pretty=true.
 
         Parameters
         ----------
@@ -435,5 +516,8 @@ class APIEncoder(object):
             If obj is not serializable.
 
         """
-        return Response(self.cereal(obj, pretty=True),
+        pretty = pretty_requested()
+        if self.stream_lists and isinstance(obj, list) and not pretty:
+            return Response(self.iter_list(obj), mimetype='application/json')
+        return Response(self.cereal(obj, pretty=pretty),
                         mimetype='application/json')
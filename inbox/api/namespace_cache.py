@@ -0,0 +1,107 @@
+"""
+Per-process cache of the namespace lookups done for every API request.
+
+The `auth` before_request hook and `ns_api.start` both resolve the
+namespace public id from the request, on the one session that `auth`
+creates for the request. They share this cache, so that authenticating a
+request doesn't query the database at all, and `start` loads the namespace
+(and its account) by primary key.
+
+Entries expire after NAMESPACE_CACHE_TTL seconds. They are invalidated
+right away when an account or namespace is deleted, or an account is
+updated (e.g. disabled), in this process; changes made by other processes
+are picked up when the entry expires. A deleted namespace is also detected
+by `ns_api.start`, which then invalidates its entry.
+
+"""
+import time
+from collections import namedtuple, OrderedDict
+
+from sqlalchemy import event
+
+from inbox.models import Account, Namespace
+from inbox.models.session import session_scope
+from inbox.util.stats import statsd_client
+
+NAMESPACE_CACHE_TTL = 30
+
+MAX_CACHED_NAMESPACES = 10000
+
+NamespaceInfo = namedtuple('NamespaceInfo', ['id', 'public_id', 'account_id',
+                                             'provider', 'sync_state'])
+
+# public id -> (NamespaceInfo, expiration timestamp), least recently used
+# first.
+_entries = OrderedDict()
+# account id -> namespace public id, to invalidate entries on account
+# changes.
+_public_ids_by_account = {}
+
+
+def get_namespace_info(public_id, db_session=None):
+    """
+    Return the NamespaceInfo for the namespace with the given public id, or
+    None if there's no such namespace. On cache misses, the namespace is
+    looked up with `db_session`, or a new session if none is given.
+
+    """
+    entry = _entries.pop(public_id, None)
+    if entry is not None and entry[1] > time.time():
+        _entries[public_id] = entry
+        statsd_client.incr('api.namespace_cache.hits')
+        return entry[0]
+    statsd_client.incr('api.namespace_cache.misses')
+
+    if db_session is None:
+        with session_scope() as db_session:
+            return _load(public_id, db_session)
+    return _load(public_id, db_session)
+
+
+def _load(public_id, db_session):
+    namespace = db_session.query(Namespace).filter(
+        Namespace.public_id == public_id).first()
+    if namespace is None:
+        return None
+    account = namespace.account
+    info = NamespaceInfo(
+        id=namespace.id, public_id=namespace.public_id,
+        account_id=namespace.account_id,
+        provider=account.provider if account is not None else None,
+        sync_state=account.sync_state if account is not None else None)
+    _set(info)
+    return info
+
+
+def _set(info):
+    _entries[info.public_id] = info, time.time() + NAMESPACE_CACHE_TTL
+    if info.account_id is not None:
+        _public_ids_by_account[info.account_id] = info.public_id
+    while len(_entries) > MAX_CACHED_NAMESPACES:
+        _, (evicted, _) = _entries.popitem(last=False)
+        _public_ids_by_account.pop(evicted.account_id, None)
+
+
+def invalidate_namespace(public_id=None, account_id=None):
+    if public_id is None:
+        public_id = _public_ids_by_account.get(account_id)
+    entry = _entries.pop(public_id, None)
+    if entry is not None:
+        _public_ids_by_account.pop(entry[0].account_id, None)
+
+
+# Any account update may disable it or change its sync state, and they're
+# rare in API processes, so drop the entry on all of them.
+@event.listens_for(Account, 'after_update', propagate=True)
+def _account_updated(mapper, connection, target):
+    invalidate_namespace(account_id=target.id)
+
+
+@event.listens_for(Account, 'after_delete', propagate=True)
+def _account_deleted(mapper, connection, target):
+    invalidate_namespace(account_id=target.id)
+
+
+@event.listens_for(Namespace, 'after_delete')
+def _namespace_deleted(mapper, connection, target):
+    invalidate_namespace(public_id=target.public_id)
@@ -2,6 +2,7 @@ import os
 import uuid
 import gevent
 import time
+import arrow
 from email.header import Header
 from datetime import datetime
 
@@ -17,8 +18,9 @@ from inbox.models import (Message, Block, Part, Thread, Namespace,
 from inbox.models.event import RecurringEvent, RecurringEventOverride
 from inbox.models.backends.generic import GenericAccount
 from inbox.api.sending import send_draft, send_raw_mime
-from inbox.api.update import update_message, update_thread
+from inbox.api.update import update_message, update_thread, bulk_update
 from inbox.api.kellogs import APIEncoder
+from inbox.api.namespace_cache import get_namespace_info, invalidate_namespace
 from inbox.api import filtering
 from inbox.api.validation import (get_attachments, get_calendar,
                                   get_recipients, get_draft, valid_public_id,
@@ -27,11 +29,9 @@ from inbox.api.validation import (get_attachments, get_calendar,
                                   limit, offset, ValidatableArgument,
                                   strict_bool, validate_draft_recipients,
                                   valid_delta_object_types, valid_display_name,
-                                  noop_event_update)
+                                  noop_event_update, fields, public_id_list)
 from inbox.config import config
-from inbox.contacts.algorithms import (calculate_contact_scores,
-                                       calculate_group_scores,
-                                       calculate_group_counts, is_stale)
+from inbox.contacts.algorithms import decay_scores
 import inbox.contacts.crud
 from inbox.contacts.search import ContactSearchClient
 from inbox.sendmail.base import (create_message_from_json, update_draft,
@@ -42,6 +42,7 @@ from inbox.models.action_log import schedule_action
 from inbox.models.session import new_session, session_scope
 from inbox.search.base import get_search_client, SearchBackendException
 from inbox.transactions import delta_sync
+from inbox.transactions.data_processing import update_contact_scores
 from inbox.api.err import err, APIException, NotFoundError, InputError
 from inbox.events.ical import (generate_icalendar_invite, send_invite,
                                generate_rsvp, send_rsvp)
@@ -55,6 +56,13 @@ DEFAULT_LIMIT = 100
 MAX_LIMIT = 1000
 LONG_POLL_REQUEST_TIMEOUT = 120
 
+# Object types that can be retrieved with /batch: the query argument listing
+# their ids, their model and their API object name.
+BATCH_OBJECT_TYPES = [('messages', Message, 'message'),
+                      ('threads', Thread, 'thread'),
+                      ('contacts', Contact, 'contact'),
+                      ('events', Event, 'event')]
+
 app = Blueprint(
     'namespace_api',
     __name__,
@@ -93,11 +101,22 @@ def pull_lang_code(endpoint, values):
 
 @app.before_request
 def start():
-    g.db_session = new_session(engine)
+    # Usually already created by the auth hook.
+    if not hasattr(g, 'db_session'):
+        g.db_session = new_session(engine)
     try:
         valid_public_id(g.namespace_public_id)
-        g.namespace = Namespace.from_public_id(g.namespace_public_id,
-                                               g.db_session)
+        # The namespace was usually just looked up by the auth hook, so this
+        # hits the cache, and the namespace and its account are then loaded
+        # by primary key.
+        namespace = get_namespace_info(g.namespace_public_id, g.db_session)
+        if namespace is None:
+            raise NoResultFound
+        g.namespace = g.db_session.query(Namespace).get(namespace.id)
+        if g.namespace is None:
+            # Deleted since it was cached.
+            invalidate_namespace(namespace.public_id)
+            raise NoResultFound
 
         g.encoder = APIEncoder(g.namespace.public_id,
                                legacy_nsid=g.legacy_nsid)
@@ -112,6 +131,8 @@ def start():
     g.parser.add_argument('limit', default=DEFAULT_LIMIT, type=limit,
                           location='args')
     g.parser.add_argument('offset', default=0, type=offset, location='args')
+    # Read by APIEncoder.jsonify.
+    g.parser.add_argument('pretty', type=strict_bool, location='args')
 
     if hasattr(g, 'namespace_public_id') and \
             not g.namespace_public_id == g.namespace.public_id:
@@ -120,6 +141,14 @@ def start():
 
 @app.after_request
 def finish(response):
+    if (hasattr(g, 'db_session') and response.is_streamed and
+            response.mimetype == 'application/json'):
+        # Streamed JSON lists (only returned by the read-only /threads and
+        # /messages endpoints) are encoded as they're sent, which needs their
+        # objects' session, so keep it open until the body has been sent.
+        response.response = _finish_after(response.response, g.db_session,
+                                          response.status_code)
+        return response
     if response.status_code == 200 and hasattr(g, 'db_session'):  # be cautions
         g.db_session.commit()
     if hasattr(g, 'db_session'):
@@ -127,6 +156,16 @@ def finish(response):
     return response
 
 
+def _finish_after(body, db_session, status_code):
+    try:
+        for chunk in body:
+            yield chunk
+        if status_code == 200:
+            db_session.commit()
+    finally:
+        db_session.close()
+
+
 @app.errorhandler(NotImplementedError)
 def handle_not_implemented_error(error):
     response = flask_jsonify(message="API endpoint not yet implemented.",
@@ -187,6 +226,7 @@ def thread_query_api():
     g.parser.add_argument('unread', type=strict_bool, location='args')
     g.parser.add_argument('starred', type=strict_bool, location='args')
     g.parser.add_argument('view', type=view, location='args')
+    g.parser.add_argument('fields', type=fields, location='args')
 
     # For backwards-compatibility -- remove after deprecating tags API.
     g.parser.add_argument('tag', type=bounded_str, location='args')
@@ -221,12 +261,14 @@ def thread_query_api():
         limit=args['limit'],
         offset=args['offset'],
         view=args['view'],
+        fields=args['fields'],
         db_session=g.db_session)
 
     # Use a new encoder object with the expand parameter set.
     encoder = APIEncoder(g.namespace.public_id,
                          args['view'] == 'expanded',
-                         legacy_nsid=g.legacy_nsid)
+                         legacy_nsid=g.legacy_nsid, stream_lists=True,
+                         fields=args['fields'])
     return encoder.jsonify(threads)
 
 
@@ -325,6 +367,7 @@ def message_query_api():
     g.parser.add_argument('unread', type=strict_bool, location='args')
     g.parser.add_argument('starred', type=strict_bool, location='args')
     g.parser.add_argument('view', type=view, location='args')
+    g.parser.add_argument('fields', type=fields, location='args')
 
     # For backwards-compatibility -- remove after deprecating tags API.
     g.parser.add_argument('tag', type=bounded_str, location='args')
@@ -356,11 +399,13 @@ def message_query_api():
         limit=args['limit'],
         offset=args['offset'],
         view=args['view'],
+        fields=args['fields'],
         db_session=g.db_session)
 
     # Use a new encoder object with the expand parameter set.
     encoder = APIEncoder(g.namespace.public_id, args['view'] == 'expanded',
-                         legacy_nsid=g.legacy_nsid)
+                         legacy_nsid=g.legacy_nsid, stream_lists=True,
+                         fields=args['fields'])
     return encoder.jsonify(messages)
 
 
@@ -1205,6 +1250,118 @@ def calendar_read_api(public_id):
     return g.encoder.jsonify(calendar)
 
 
+##
+# Free/busy
+##
+@app.route('/free-busy', methods=['GET'])
+def free_busy_api():
+    """
+    Merged busy intervals of the namespace's calendars (or of the calendars
+    given with `calendar_id`, which can be repeated) between `start` and
+    `end`.
+
+    """
+    g.parser.add_argument('start', type=timestamp, location='args')
+    g.parser.add_argument('end', type=timestamp, location='args')
+    g.parser.add_argument('calendar_id', type=valid_public_id,
+                          action='append', location='args')
+    args = strict_parse_args(g.parser, request.args)
+    start, end = args['start'], args['end']
+    if start is None or end is None:
+        raise InputError('start and end are required')
+    if end <= start:
+        raise InputError('end must be after start')
+
+    query = g.db_session.query(Calendar.id, Calendar.public_id).filter(
+        Calendar.namespace_id == g.namespace.id)
+    calendar_public_ids = args['calendar_id']
+    if calendar_public_ids:
+        query = query.filter(Calendar.public_id.in_(calendar_public_ids))
+    calendars = query.all()
+    missing = set(calendar_public_ids or []) - {c.public_id for c in
+                                                calendars}
+    if missing:
+        raise NotFoundError("Couldn't find calendar {0}".format(
+            missing.pop()))
+
+    intervals = filtering.free_busy([c.id for c in calendars], start, end,
+                                    g.db_session)
+    return g.encoder.jsonify({
+        'object': 'free_busy',
+        'calendar_ids': [c.public_id for c in calendars],
+        'start_time': arrow.get(start).timestamp,
+        'end_time': arrow.get(end).timestamp,
+        'time_slots': [{'object': 'time_slot',
+                        'status': 'busy',
+                        'start_time': slot_start.timestamp,
+                        'end_time': slot_end.timestamp}
+                       for slot_start, slot_end in intervals]})
+
+
+##
+# Batch retrieval
+##
+@app.route('/batch', methods=['GET'])
+def batch_read_api():
+    """
+    Get many messages, threads, contacts and events by id in one request,
+    e.g. GET /batch?messages=<id>,<id>&threads=<id>. Each requested type maps
+    to the list of its objects in the order requested, with an error in place
+    of the ids that don't match an object.
+
+    """
+    for collection, _, _ in BATCH_OBJECT_TYPES:
+        g.parser.add_argument(collection, type=public_id_list,
+                              location='args')
+    g.parser.add_argument('view', type=view, location='args')
+    args = strict_parse_args(g.parser, request.args)
+
+    requested = [(collection, cls, object_name, args[collection])
+                 for collection, cls, object_name in BATCH_OBJECT_TYPES
+                 if args[collection]]
+    if not requested:
+        raise InputError('Must request ids of at least one of {}'.format(
+            ', '.join(collection for collection, _, _ in BATCH_OBJECT_TYPES)))
+    if sum(len(public_ids) for _, _, _, public_ids in requested) > MAX_LIMIT:
+        raise InputError('Cannot request more than {} resources at once.'.
+                         format(MAX_LIMIT))
+
+    expand = args['view'] == 'expanded'
+    result = {}
+    for collection, cls, object_name, public_ids in requested:
+        objects = filtering.objects_by_public_id(
+            cls, public_ids, g.namespace.id, expand, g.db_session)
+        result[collection] = [
+            objects.get(public_id) or {
+                'id': public_id,
+                'object': object_name,
+                'error': {
+                    'type': 'invalid_request_error',
+                    'message': "Couldn't find {} {}".format(object_name,
+                                                            public_id)}}
+            for public_id in public_ids]
+
+    encoder = APIEncoder(g.namespace.public_id, expand,
+                         legacy_nsid=g.legacy_nsid)
+    return encoder.jsonify(result)
+
+
+@app.route('/batch', methods=['PUT'])
+def batch_update_api():
+    """
+    Change many threads and messages at once, e.g.
+    PUT /batch {"threads": [<id>, ...], "unread": false}. Takes the same
+    "unread" and "starred" flags as single updates, and "add_label_ids" and
+    "remove_label_ids" or "folder_id" to relabel or move them.
+
+    """
+    data = request.get_json(force=True)
+    if not isinstance(data, dict):
+        raise InputError('Invalid request body')
+    updated = bulk_update(g.namespace, data, g.db_session)
+    return g.encoder.jsonify({'updated_messages': updated})
+
+
 ##
 # Drafts
 ##
@@ -1534,44 +1691,32 @@ def stream_changes():
 # Groups and Contact Rankings
 ##
 
+def _get_contact_scores_cache(force_recalculate):
+    """
+    Contact rankings and groups are kept up to date in the background by the
+    DataProcessingService; only recompute them here if explicitly asked to.
+
+    """
+    if force_recalculate:
+        dpcache = update_contact_scores(g.db_session, g.namespace.id,
+                                        recompute=True)
+        g.db_session.commit()
+        return dpcache
+    return g.db_session.query(DataProcessingCache).filter(
+        DataProcessingCache.namespace_id == g.namespace.id).first()
+
+
 @app.route('/groups/intrinsic')
 def groups_intrinsic():
     g.parser.add_argument('force_recalculate', type=strict_bool,
                           location='args')
     args = strict_parse_args(g.parser, request.args)
-    try:
-        dpcache = g.db_session.query(DataProcessingCache).filter(
-            DataProcessingCache.namespace_id == g.namespace.id).one()
-    except NoResultFound:
-        dpcache = DataProcessingCache(namespace_id=g.namespace.id)
-
-    last_updated = dpcache.contact_groups_last_updated
-    cached_data = dpcache.contact_groups
-
-    use_cached_data = (not (is_stale(last_updated) or cached_data is None) and
-                       args['force_recalculate'] is not True)
-
-    if not use_cached_data:
-        last_updated = None
-
-    messages = filtering.messages_for_contact_scores(
-        g.db_session, g.namespace.id, last_updated)
+    dpcache = _get_contact_scores_cache(args['force_recalculate'])
 
-    from_email = g.namespace.email_address
-
-    if use_cached_data:
-        result = cached_data
-        new_guys = calculate_group_counts(messages, from_email)
-        for k, v in new_guys.items():
-            if k in result:
-                result[k] += v
-            else:
-                result[k] = v
-    else:
-        result = calculate_group_scores(messages, from_email)
-        dpcache.contact_groups = result
-        g.db_session.add(dpcache)
-        g.db_session.commit()
+    result = {}
+    if dpcache is not None and dpcache.contact_groups is not None:
+        result = decay_scores(dpcache.contact_groups,
+                              dpcache.contact_groups_last_updated)
 
     result = sorted(result.items(), key=lambda x: x[1], reverse=True)
     return g.encoder.jsonify(result)
@@ -1582,37 +1727,12 @@ def contact_rankings():
     g.parser.add_argument('force_recalculate', type=strict_bool,
                           location='args')
     args = strict_parse_args(g.parser, request.args)
-    try:
-        dpcache = g.db_session.query(DataProcessingCache).filter(
-            DataProcessingCache.namespace_id == g.namespace.id).one()
-    except NoResultFound:
-        dpcache = DataProcessingCache(namespace_id=g.namespace.id)
-
-    last_updated = dpcache.contact_rankings_last_updated
-    cached_data = dpcache.contact_rankings
+    dpcache = _get_contact_scores_cache(args['force_recalculate'])
 
-    use_cached_data = (not (is_stale(last_updated) or cached_data is None) and
-                       args['force_recalculate'] is not True)
-
-    if not use_cached_data:
-        last_updated = None
-
-    messages = filtering.messages_for_contact_scores(
-        g.db_session, g.namespace.id, last_updated)
-
-    if use_cached_data:
-        new_guys = calculate_contact_scores(messages, time_dependent=False)
-        result = cached_data
-        for k, v in new_guys.items():
-            if k in result:
-                result[k] += v
-            else:
-                result[k] = v
-    else:
-        result = calculate_contact_scores(messages)
-        dpcache.contact_rankings = result
-        g.db_session.add(dpcache)
-        g.db_session.commit()
+    result = {}
+    if dpcache is not None and dpcache.contact_rankings is not None:
+        result = decay_scores(dpcache.contact_rankings,
+                              dpcache.contact_rankings_last_updated)
 
     result = sorted(result.items(), key=lambda x: x[1], reverse=True)
     return g.encoder.jsonify(result)
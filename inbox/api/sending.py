@@ -2,6 +2,8 @@ from datetime import datetime
 from nylas.logging import get_logger
 from inbox.api.err import err
 from inbox.api.kellogs import APIEncoder
+from inbox.models import Block
+from inbox.models.backends.generic import GenericAccount
 from inbox.sendmail.base import get_sendmail_client, SendMailException
 log = get_logger()
 
@@ -16,7 +18,7 @@ def send_draft(account, draft, db_session):
     response_on_success = APIEncoder().jsonify(draft)
     try:
         sendmail_client = get_sendmail_client(account)
-        sendmail_client.send(draft)
+        sent_message = sendmail_client.send(draft)
     except SendMailException as exc:
         kwargs = {}
         if exc.failures:
@@ -25,9 +27,23 @@ def send_draft(account, draft, db_session):
             kwargs['server_error'] = exc.server_error
         return err(exc.http_code, exc.message, **kwargs)
 
+    if isinstance(account, GenericAccount) and sent_message is not None:
+        # Keep the message as it was sent, so that the copy the
+        # save_sent_email action uploads to the sent folder doesn't need to be
+        # generated again.
+        save_sent_message(draft, sent_message)
+
     return response_on_success
 
 
+def save_sent_message(draft, sent_message):
+    block = Block()
+    block.namespace_id = draft.namespace_id
+    block.content_type = 'text/plain'
+    block.set_data_from_file(sent_message.file())
+    draft.full_body = block
+
+
 def update_draft_on_send(account, draft, db_session):
     # Update message
     draft.is_sent = True
@@ -1,14 +1,15 @@
 from flask import Flask, request, jsonify, make_response, g
 from flask.ext.restful import reqparse
 from werkzeug.exceptions import default_exceptions, HTTPException
-from sqlalchemy.orm.exc import NoResultFound
 
 from inbox.api.kellogs import APIEncoder
+from inbox.api.compression import compress_response
+from inbox.api.namespace_cache import get_namespace_info
 from nylas.logging import get_logger
 from inbox.models import Namespace, Account
-from inbox.models.session import session_scope
+from inbox.models.session import new_session, session_scope
 from inbox.api.validation import (bounded_str, ValidatableArgument,
-                                  strict_parse_args, limit)
+                                  strict_parse_args, limit, strict_bool)
 from inbox.api.validation import valid_public_id
 from inbox.api.err import err
 
@@ -48,18 +49,19 @@ def auth():
                        or request.path.startswith('/w/'):
         return
 
+    # The request's session, which ns_api.start reuses. It only connects to
+    # the database if the namespace isn't cached.
+    g.db_session = new_session(engine)
+
     if request.path.startswith('/n/'):
         ns_parts = filter(None, request.path.split('/'))
         namespace_public_id = ns_parts[1]
         valid_public_id(namespace_public_id)
 
-        with session_scope() as db_session:
-            try:
-                namespace = db_session.query(Namespace) \
-                    .filter(Namespace.public_id == namespace_public_id).one()
-                g.namespace_public_id = namespace.public_id
-            except NoResultFound:
-                return err(404, "Unknown namespace ID")
+        namespace = get_namespace_info(namespace_public_id, g.db_session)
+        if namespace is None:
+            return err(404, "Unknown namespace ID")
+        g.namespace_public_id = namespace.public_id
 
     else:
         if not request.authorization or not request.authorization.username:
@@ -70,16 +72,12 @@ def auth():
 
         g.namespace_public_id = request.authorization.username
 
-        with session_scope() as db_session:
-            try:
-                valid_public_id(g.namespace_public_id)
-                namespace = db_session.query(Namespace) \
-                    .filter(Namespace.public_id == g.namespace_public_id).one()
-            except NoResultFound:
-                return make_response((
-                    "Could not verify access credential.", 401,
-                    {'WWW-Authenticate': 'Basic realm="API '
-                     'Access Token Required"'}))
+        valid_public_id(g.namespace_public_id)
+        if get_namespace_info(g.namespace_public_id, g.db_session) is None:
+            return make_response((
+                "Could not verify access credential.", 401,
+                {'WWW-Authenticate': 'Basic realm="API '
+                 'Access Token Required"'}))
 
 
 @app.after_request
@@ -91,7 +89,10 @@ def finish(response):
         response.headers['Access-Control-Allow-Methods'] = \
             'GET,PUT,POST,DELETE,OPTIONS'
         response.headers['Access-Control-Allow-Credentials'] = 'true'
-    return response
+    if request.blueprint != ns_api.name and hasattr(g, 'db_session'):
+        # ns_api closes the session of its own requests.
+        g.db_session.close()
+    return compress_response(response, request.accept_encodings)
 
 
 @app.route('/n/')
@@ -107,6 +108,7 @@ def ns_all():
                             location='args')
         parser.add_argument('offset', default=0, type=int, location='args')
         parser.add_argument('email_address', type=bounded_str, location='args')
+        parser.add_argument('pretty', type=strict_bool, location='args')
         args = strict_parse_args(parser, request.args)
 
         query = db_session.query(Namespace)
@@ -1,11 +1,23 @@
+from sqlalchemy import false
 from sqlalchemy.orm.exc import NoResultFound
 
-from inbox.models import Category
-from inbox.models.action_log import schedule_action
+from inbox.models import (Category, Message, MessageCategory, Thread,
+                          Transaction)
+from inbox.models.action_log import schedule_action, schedule_bulk_action
 from inbox.api.validation import valid_public_id
-from inbox.api.err import InputError
+from inbox.api.err import InputError, NotFoundError
 # STOPSHIP(emfree): better naming/structure for this module
 
+MAX_BULK_UPDATE_IDS = 1000
+
+SPECIAL_LABEL_MAP = {
+    'inbox': '\\Inbox',
+    'important': '\\Important',
+    'all': '\\All',  # STOPSHIP(emfree): verify
+    'trash': '\\Trash',
+    'spam': '\\Spam'
+}
+
 # TODO[k]: Instead of directly updating message.is_read, is_starred and
 # .categories, call message.update_metadata() /after/ action is
 # scheduled?
@@ -162,34 +174,24 @@ def update_message_flags(message, db_session, unread=None, starred=None):
                         db_session, starred=starred)
 
 
-def update_message_labels(message, db_session, added_categories,
-                          removed_categories):
-    special_label_map = {
-        'inbox': '\\Inbox',
-        'important': '\\Important',
-        'all': '\\All',  # STOPSHIP(emfree): verify
-        'trash': '\\Trash',
-        'spam': '\\Spam'
-    }
-    added_labels = []
-    removed_labels = []
-    for category in added_categories:
-        if category.name in special_label_map:
-            added_labels.append(special_label_map[category.name])
+def label_names(categories):
+    """Return the Gmail names of the labels to add or remove."""
+    names = []
+    for category in categories:
+        if category.name in SPECIAL_LABEL_MAP:
+            names.append(SPECIAL_LABEL_MAP[category.name])
         elif category.name in ('drafts', 'sent'):
             raise InputError('The "{}" label cannot be changed'.
                              format(category.name))
         else:
-            added_labels.append(category.display_name)
+            names.append(category.display_name)
+    return names
 
-    for category in removed_categories:
-        if category.name in special_label_map:
-            removed_labels.append(special_label_map[category.name])
-        elif category.name in ('drafts', 'sent'):
-            raise InputError('The "{}" label cannot be changed'.
-                             format(category.name))
-        else:
-            removed_labels.append(category.display_name)
+
+def update_message_labels(message, db_session, added_categories,
+                          removed_categories):
+    added_labels = label_names(added_categories)
+    removed_labels = label_names(removed_categories)
 
     # Optimistically update message state.
     for cat in added_categories:
@@ -211,3 +213,246 @@ def update_message_folder(message, db_session, category):
         message.categories_changes = True
         schedule_action('move', message, message.namespace_id, db_session,
                         destination=category.display_name)
+
+
+def bulk_update(namespace, request_data, db_session):
+    """
+    Apply one change (flags, labels or folder) to many threads and messages
+    at once. Rather than going through each message object, the changes are
+    made with a handful of set-based statements, and the syncback actions are
+    logged in compact entries covering many messages. Returns the number of
+    messages changed.
+
+    """
+    thread_public_ids = parse_public_ids(request_data, 'threads')
+    message_public_ids = parse_public_ids(request_data, 'messages')
+    if not thread_public_ids and not message_public_ids:
+        raise InputError('Must give the ids of "threads" or "messages" to '
+                         'update')
+    if len(thread_public_ids) + len(message_public_ids) > MAX_BULK_UPDATE_IDS:
+        raise InputError('Cannot update more than {} threads and messages at '
+                         'once.'.format(MAX_BULK_UPDATE_IDS))
+
+    accept_labels = namespace.account.provider == 'gmail'
+    unread, starred = parse_flags(request_data)
+    added_labels = removed_labels = folder = None
+    if accept_labels:
+        added_labels = parse_label_ids(request_data, 'add_label_ids',
+                                       db_session, namespace.id)
+        removed_labels = parse_label_ids(request_data, 'remove_label_ids',
+                                         db_session, namespace.id)
+    else:
+        folder = parse_folder(request_data, db_session, namespace.id)
+    if request_data:
+        raise InputError(u'Unexpected attribute: {}'.
+                         format(request_data.keys()[0]))
+
+    # Like with single thread updates, drafts are left out of thread-level
+    # changes, and sent messages out of thread-level moves.
+    thread_message_ids = _thread_message_ids(thread_public_ids, namespace.id,
+                                             db_session)
+    message_ids = _message_ids(message_public_ids, namespace.id, db_session)
+    all_message_ids = thread_message_ids | message_ids
+
+    changed = set()
+    if unread is not None:
+        changed |= _bulk_update_flag(Message.is_read, not unread,
+                                     all_message_ids, 'bulk_mark_unread',
+                                     namespace.id, db_session, unread=unread)
+    if starred is not None:
+        changed |= _bulk_update_flag(Message.is_starred, starred,
+                                     all_message_ids, 'bulk_mark_starred',
+                                     namespace.id, db_session,
+                                     starred=starred)
+    if added_labels or removed_labels:
+        changed |= _bulk_change_labels(added_labels or set(),
+                                       removed_labels or set(),
+                                       all_message_ids, namespace.id,
+                                       db_session)
+    if folder is not None:
+        movable_ids = message_ids | (thread_message_ids -
+                                     _sent_message_ids(thread_message_ids,
+                                                       db_session))
+        changed |= _bulk_move(folder, movable_ids, namespace.id, db_session)
+
+    _record_bulk_changes(changed, namespace.id, db_session)
+    return len(changed)
+
+
+def parse_public_ids(request_data, key):
+    public_ids = request_data.pop(key, None) or []
+    if not isinstance(public_ids, list):
+        raise InputError('"{}" must be a list of ids'.format(key))
+    for id_ in public_ids:
+        valid_public_id(id_)
+    return set(public_ids)
+
+
+def parse_label_ids(request_data, key, db_session, namespace_id):
+    label_public_ids = parse_public_ids(request_data, key)
+    if not label_public_ids:
+        return
+    labels = set(db_session.query(Category).filter(
+        Category.namespace_id == namespace_id,
+        Category.public_id.in_(label_public_ids)))
+    missing = label_public_ids - {label.public_id for label in labels}
+    if missing:
+        raise InputError(u'The label {} does not exist'.format(missing.pop()))
+    return labels
+
+
+def _thread_message_ids(thread_public_ids, namespace_id, db_session):
+    if not thread_public_ids:
+        return set()
+    threads = db_session.query(Thread.id, Thread.public_id).filter(
+        Thread.namespace_id == namespace_id,
+        Thread.public_id.in_(thread_public_ids)).all()
+    missing = thread_public_ids - {public_id for _, public_id in threads}
+    if missing:
+        raise NotFoundError(u"Couldn't find threads {}".format(
+            ', '.join(sorted(missing))))
+    return {id_ for id_, in db_session.query(Message.id).filter(
+        Message.namespace_id == namespace_id,
+        Message.thread_id.in_([id_ for id_, _ in threads]),
+        Message.is_draft == false())}
+
+
+def _message_ids(message_public_ids, namespace_id, db_session):
+    if not message_public_ids:
+        return set()
+    messages = db_session.query(Message.id, Message.public_id).filter(
+        Message.namespace_id == namespace_id,
+        Message.public_id.in_(message_public_ids)).all()
+    missing = message_public_ids - {public_id for _, public_id in messages}
+    if missing:
+        raise NotFoundError(u"Couldn't find messages {}".format(
+            ', '.join(sorted(missing))))
+    return {id_ for id_, _ in messages}
+
+
+def _sent_message_ids(message_ids, db_session):
+    if not message_ids:
+        return set()
+    sent_ids = {id_ for id_, in db_session.query(Message.id).filter(
+        Message.id.in_(message_ids), Message.is_sent)}
+    sent_ids.update(id_ for id_, in db_session.query(
+        MessageCategory.message_id).join(Category).filter(
+            MessageCategory.message_id.in_(message_ids),
+            Category.name == 'sent'))
+    return sent_ids
+
+
+def _bulk_update_flag(column, value, message_ids, action, namespace_id,
+                      db_session, **action_args):
+    if not message_ids:
+        return set()
+    changed = {id_ for id_, in db_session.query(Message.id).filter(
+        Message.id.in_(message_ids), column != value)}
+    if changed:
+        db_session.query(Message).filter(Message.id.in_(changed)).update(
+            {column: value}, synchronize_session=False)
+        schedule_bulk_action(action, 'message', changed, namespace_id,
+                             db_session, **action_args)
+    return changed
+
+
+def _bulk_change_labels(added_categories, removed_categories, message_ids,
+                        namespace_id, db_session):
+    added_labels = label_names(added_categories)
+    removed_labels = label_names(removed_categories)
+    if not message_ids:
+        return set()
+
+    added_ids = {category.id for category in added_categories}
+    removed_ids = {category.id for category in removed_categories}
+    existing = set(db_session.query(MessageCategory.message_id,
+                                    MessageCategory.category_id).filter(
+        MessageCategory.message_id.in_(message_ids),
+        MessageCategory.category_id.in_(added_ids | removed_ids)))
+
+    new_rows = [{'message_id': message_id, 'category_id': category_id}
+                for message_id in message_ids for category_id in added_ids
+                if (message_id, category_id) not in existing]
+    removed_rows = [(message_id, category_id)
+                    for message_id, category_id in existing
+                    if category_id in removed_ids]
+    if new_rows:
+        db_session.execute(MessageCategory.__table__.insert(), new_rows)
+    if removed_rows:
+        db_session.query(MessageCategory).filter(
+            MessageCategory.message_id.in_(
+                {message_id for message_id, _ in removed_rows}),
+            MessageCategory.category_id.in_(removed_ids)).delete(
+                synchronize_session=False)
+
+    changed = ({row['message_id'] for row in new_rows} |
+               {message_id for message_id, _ in removed_rows})
+    if changed:
+        _mark_categories_changed(changed, db_session)
+        schedule_bulk_action('bulk_change_labels', 'message', changed,
+                             namespace_id, db_session,
+                             added_labels=added_labels,
+                             removed_labels=removed_labels)
+    return changed
+
+
+def _bulk_move(category, message_ids, namespace_id, db_session):
+    if not message_ids:
+        return set()
+    # As for single messages, only messages that aren't in the folder yet
+    # are moved.
+    in_folder = {id_ for id_, in db_session.query(
+        MessageCategory.message_id).filter(
+            MessageCategory.message_id.in_(message_ids),
+            MessageCategory.category_id == category.id)}
+    changed = message_ids - in_folder
+    if changed:
+        db_session.query(MessageCategory).filter(
+            MessageCategory.message_id.in_(changed)).delete(
+                synchronize_session=False)
+        db_session.execute(MessageCategory.__table__.insert(), [
+            {'message_id': message_id, 'category_id': category.id}
+            for message_id in changed])
+        _mark_categories_changed(changed, db_session)
+        schedule_bulk_action('bulk_move', 'message', changed, namespace_id,
+                             db_session, destination=category.display_name)
+    return changed
+
+
+def _mark_categories_changed(message_ids, db_session):
+    # The equivalent of setting `message.categories_changes`.
+    db_session.query(Message).filter(Message.id.in_(message_ids)).update(
+        {'state': 'actions_pending'}, synchronize_session=False)
+
+
+def _record_bulk_changes(message_ids, namespace_id, db_session):
+    """
+    Do what flushing the changes to message objects would: bump the versions
+    of their threads and create the update transactions of the messages and
+    threads, for the delta API.
+
+    """
+    if not message_ids:
+        return
+    messages = db_session.query(Message.id, Message.public_id,
+                                Message.is_draft, Message.thread_id).filter(
+        Message.id.in_(message_ids)).all()
+    thread_ids = {thread_id for _, _, _, thread_id in messages}
+    db_session.query(Thread).filter(Thread.id.in_(thread_ids)).update(
+        {'version': Thread.version + 1}, synchronize_session=False)
+    threads = db_session.query(Thread.id, Thread.public_id).filter(
+        Thread.id.in_(thread_ids)).all()
+
+    rows = [{'namespace_id': namespace_id,
+             'object_type': 'draft' if is_draft else 'message',
+             'record_id': id_,
+             'object_public_id': public_id,
+             'command': 'update'}
+            for id_, public_id, is_draft, _ in messages]
+    rows.extend({'namespace_id': namespace_id,
+                 'object_type': Thread.API_OBJECT_NAME,
+                 'record_id': id_,
+                 'object_public_id': public_id,
+                 'command': 'update'}
+                for id_, public_id in threads)
+    db_session.execute(Transaction.__table__.insert(), rows)
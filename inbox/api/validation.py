@@ -41,6 +41,13 @@ def view(value, key):
     return value
 
 
+def fields(value, key):
+    selected = {field.strip() for field in value.split(',') if field.strip()}
+    if not selected:
+        raise ValueError('No fields given for {}.'.format(key))
+    return selected
+
+
 def limit(value):
     try:
         value = int(value)
@@ -74,6 +81,17 @@ def valid_public_id(value):
     return value
 
 
+def public_id_list(value, key):
+    public_ids = [public_id.strip() for public_id in value.split(',')
+                  if public_id.strip()]
+    for public_id in public_ids:
+        try:
+            valid_public_id(public_id)
+        except InputError:
+            raise ValueError('Invalid id {} for {}'.format(public_id, key))
+    return public_ids
+
+
 def timestamp(value, key):
     try:
         return arrow.get(value).datetime
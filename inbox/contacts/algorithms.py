@@ -1,5 +1,6 @@
 import datetime
-from collections import defaultdict
+from bisect import bisect_left
+from collections import defaultdict, Counter
 
 '''
 This file currently contains algorithms for the contacts/rankings endpoint
@@ -16,8 +17,16 @@ MIN_MESSAGE_COUNT = 2.5  # Might want to tune this param. (1.5, 2.5?)
 SELF_IDENTITY_THRESHOLD = 0.3  # Also tunable
 JACCARD_THRESHOLD = .35  # probably shouldn't tune this
 
-SOCIAL_MOLECULE_EXPANSION_LIMIT = 1000  # Don't add too many molecules!
-SOCIAL_MOLECULE_LIMIT = 5000  # Give up if there are too many messages
+# The molecule pool is expanded and combined using inverted indexes over
+# bitsets, which grows roughly linearly with the number of distinct recipient
+# sets (see bin/benchmark-contact-groups), so these limits only guard against
+# pathological accounts.
+SOCIAL_MOLECULE_EXPANSION_LIMIT = 30000  # Don't add too many molecules!
+SOCIAL_MOLECULE_LIMIT = 50000  # Give up if there are too many messages
+
+# For incrementally accumulated scores: a message's weight halves every
+# DECAY_HALF_LIFE seconds, which matches _get_message_weight at one year.
+DECAY_HALF_LIFE = LOOKBACK_TIME / 2
 
 
 ##
@@ -31,8 +40,25 @@ def _get_message_weight(now, message_date):
     return max(weight, MIN_MESSAGE_WEIGHT)
 
 
-def _jaccard_similarity(set1, set2):
-    return len(set1.intersection(set2)) / float(len(set1.union(set2)))
+def _get_decay_factor(then, now):
+    elapsed = max((now - then).total_seconds(), 0)
+    return 0.5 ** (elapsed / DECAY_HALF_LIFE)
+
+
+def _popcount(bits):
+    return bin(bits).count('1')
+
+
+def _iter_bits(bits):
+    """Yields the indices of the set bits of the (long) integer bits."""
+    while bits:
+        lowest = bits & -bits
+        yield lowest.bit_length() - 1
+        bits ^= lowest
+
+
+def _jaccard_similarity(bits1, bits2):
+    return _popcount(bits1 & bits2) / float(_popcount(bits1 | bits2))
 
 
 def _get_participants(msg, excluded_emails=[]):
@@ -73,6 +99,50 @@ def calculate_contact_scores(messages, time_dependent=True):
     return res
 
 
+def decay_scores(scores, last_updated):
+    """ Decay accumulated scores from last_updated (a naive local
+        datetime.datetime, as stored by DataProcessingCache) to now.
+    """
+    factor = _get_decay_factor(last_updated, datetime.datetime.now())
+    return {k: v * factor for k, v in scores.iteritems()}
+
+
+def accumulate_contact_scores(scores, last_updated, messages):
+    """ Incremental version of calculate_contact_scores: decay the previously
+        accumulated scores and add the weights of newly sent messages, so
+        that the result is the exponentially decayed message count per
+        recipient.
+    """
+    now = datetime.datetime.utcnow()
+    res = defaultdict(float)
+    if scores:
+        res.update(decay_scores(scores, last_updated))
+    for message in messages:
+        weight = _get_decay_factor(message.date, now)
+        recipients = message.to_addr + message.cc_addr + message.bcc_addr
+        for (name, email) in recipients:
+            res[email] += weight
+    return res
+
+
+def accumulate_group_molecules(molecules, last_updated, messages,
+                               user_email):
+    """ Like accumulate_contact_scores, but accumulates the decayed weight of
+        messages sent to each distinct set of participants. The result is the
+        input to calculate_group_scores_from_molecules, keyed by the
+        comma-separated, sorted participant emails.
+    """
+    now = datetime.datetime.utcnow()
+    res = defaultdict(float)
+    if molecules:
+        res.update(decay_scores(molecules, last_updated))
+    for msg in messages:
+        participants = _get_participants(msg, [user_email])
+        if len(participants) >= MIN_GROUP_SIZE:
+            res[', '.join(participants)] += _get_decay_factor(msg.date, now)
+    return res
+
+
 def calculate_group_counts(messages, user_email):
     """Strips out most of the logic from calculate_group_scores
     algorithm and just returns raw counts for each group.
@@ -96,73 +166,135 @@ def calculate_group_scores(messages, user_email):
         date - datetime.datetime object
     """
     now = datetime.datetime.now()
-    message_ids_to_scores = {}
-    molecules_dict = defaultdict(set)  # (emails, ...) -> {message ids, ...}
-
-    def get_message_list_weight(message_ids):
-        return sum([message_ids_to_scores[m_id] for m_id in message_ids])
+    molecule_weights = defaultdict(float)  # (emails, ...) -> weight
 
     # Gather initial candidate social molecules
     for msg in messages:
         participants = _get_participants(msg, [user_email])
         if len(participants) >= MIN_GROUP_SIZE:
-            molecules_dict[tuple(participants)].add(msg.id)
-            message_ids_to_scores[msg.id] = \
+            molecule_weights[tuple(participants)] += \
                 _get_message_weight(now, msg.date)
 
-    if len(molecules_dict) > SOCIAL_MOLECULE_LIMIT:
+    return calculate_group_scores_from_molecules(molecule_weights)
+
+
+def calculate_group_scores_from_molecules(molecule_weights):
+    """Run the social molecule algorithm given the total message weight
+    for each initial candidate molecule, i.e. each distinct set of
+    participants. Keys are either tuples of emails or the comma-separated
+    strings produced by accumulate_group_molecules.
+
+    Every message belongs to exactly one initial molecule, so sets of
+    initial molecules stand in for the sets of messages in the paper.
+
+    Emails are encoded as integer ids, and both groups of emails and sets of
+    initial molecules are represented as bitsets (Python longs), so that
+    intersections, unions and subset tests are single integer operations.
+    """
+    if len(molecule_weights) > SOCIAL_MOLECULE_LIMIT:
         return {}  # Not worth the calculation
 
+    molecule_weights = {
+        (tuple(k.split(', ')) if isinstance(k, basestring) else k): v
+        for k, v in molecule_weights.iteritems()}
+
+    # Number emails alphabetically, so that ordering groups by their
+    # email ids orders them by their sorted emails.
+    emails = sorted({email for key in molecule_weights for email in key})
+    email_ids = {email: i for i, email in enumerate(emails)}
+    weights = []
+    molecules_dict = {}  # email bitset -> initial molecule bitset
+    for key, weight in molecule_weights.iteritems():
+        group = 0
+        for email in key:
+            group |= 1 << email_ids[email]
+        molecules_dict[group] = 1 << len(weights)
+        weights.append(weight)
+
+    def get_message_list_weight(molecule_bits):
+        return sum([weights[i] for i in _iter_bits(molecule_bits)])
+
     # Expand pool of social molecules by taking pairwise intersections.
     # If there are already too many molecules, skip this step.
     if len(molecules_dict) < SOCIAL_MOLECULE_EXPANSION_LIMIT:
         _expand_molecule_pool(molecules_dict)
 
     # Filter out infrequent molecules
-    molecules_list = [(set(emails), set(msgs))
-                      for (emails, msgs) in molecules_dict.iteritems()
-                      if get_message_list_weight(msgs) >= MIN_MESSAGE_COUNT]
+    molecules_list = []
+    for group, msgs in molecules_dict.iteritems():
+        weight = get_message_list_weight(msgs)
+        if weight >= MIN_MESSAGE_COUNT:
+            molecules_list.append((group, msgs, weight))
 
     # Subsets get absorbed by supersets (if minimal info lost)
-    molecules_list = _subsume_molecules(
-        molecules_list, get_message_list_weight)
+    molecules_list = _subsume_molecules(molecules_list)
 
-    molecules_list = _combine_similar_molecules(molecules_list)
+    molecules_list = _combine_similar_molecules(
+        [(group, msgs) for (group, msgs, _) in molecules_list])
 
     # Give a score to each group.
-    return {', '.join(sorted(g)): get_message_list_weight(m)
-            for (g, m) in molecules_list}
+    return {', '.join(sorted(emails[i] for i in _iter_bits(group))):
+            get_message_list_weight(msgs)
+            for (group, msgs) in molecules_list}
 
 
-# Helper functions for calculating group scores
-def _expand_molecule_pool(molecules_dict):
-    mditems = [(set(g), msgs) for (g, msgs) in molecules_dict.items()]
-    for i in xrange(len(mditems)):
-        g1, m1 = mditems[i]
-        for j in xrange(i, len(mditems)):
-            g2, m2 = mditems[j]
-            new_molecule = tuple(sorted(list(g1.intersection(g2))))
-            if len(new_molecule) >= MIN_GROUP_SIZE:
-                molecules_dict[new_molecule] = \
-                        molecules_dict[new_molecule].union(m1).union(m2)
+# Helper functions for calculating group scores. Molecules are
+# (email bitset, initial molecule bitset) pairs; see
+# calculate_group_scores_from_molecules.
+def _inverted_index(groups):
+    """Returns a dict mapping email id -> ascending list of the indices of
+    the groups that contain it."""
+    postings = defaultdict(list)
+    for idx, group in enumerate(groups):
+        for email_id in _iter_bits(group):
+            postings[email_id].append(idx)
+    return postings
 
 
-def _subsume_molecules(molecules_list, get_message_list_weight):
-    molecules_list.sort(key=lambda x: len(x[0]), reverse=True)
+def _expand_molecule_pool(molecules_dict):
+    """Adds the pairwise intersections of all molecules. Only pairs sharing
+    at least MIN_GROUP_SIZE emails yield a molecule, so candidate pairs are
+    read off an inverted index rather than enumerating every pair."""
+    mditems = molecules_dict.items()
+    postings = _inverted_index([group for group, _ in mditems])
+    for i, (g1, m1) in enumerate(mditems):
+        shared_counts = Counter()
+        for email_id in _iter_bits(g1):
+            posting = postings[email_id]
+            shared_counts.update(posting[bisect_left(posting, i + 1):])
+        for j, shared in shared_counts.iteritems():
+            if shared >= MIN_GROUP_SIZE:
+                g2, m2 = mditems[j]
+                new_molecule = g1 & g2
+                molecules_dict[new_molecule] = \
+                    molecules_dict.get(new_molecule, 0) | m1 | m2
+
+
+def _subsume_molecules(molecules_list):
+    """Takes (group, msgs, weight) triples and drops groups that are subsets
+    of a bigger, not-yet-subsumed group with similar weight. Any superset of
+    a group must contain the group's rarest email, so only the groups in
+    that email's posting list are checked."""
+    # Biggest groups first; ties are broken by the groups' emails so that the
+    # (order-dependent) greedy combination step is deterministic.
+    molecules_list.sort(key=lambda x: (-_popcount(x[0]),
+                                       tuple(_iter_bits(x[0]))))
     is_subsumed = [False] * len(molecules_list)
-    mol_weights = [get_message_list_weight(m) for (_, m) in molecules_list]
+    sizes = [_popcount(g) for (g, _, _) in molecules_list]
+    postings = _inverted_index([g for (g, _, _) in molecules_list])
 
     for i in xrange(1, len(molecules_list)):
-        g1, m1 = molecules_list[i]  # Smaller group
-        m1_size = mol_weights[i]
-        for j in xrange(i):
+        g1, _, m1_size = molecules_list[i]  # Smaller group
+        rarest = min(_iter_bits(g1), key=lambda e: len(postings[e]))
+        for j in postings[rarest]:
+            if j >= i:
+                break
             if is_subsumed[j]:
                 continue
-            g2, m2 = molecules_list[j]  # Bigger group
-            m2_size = mol_weights[j]
-            if g1.issubset(g2):
-                sharing_error = ((len(g2) - len(g1)) * (m1_size - m2_size) /
-                                 (1.0 * (len(g2) * m1_size)))
+            g2, _, m2_size = molecules_list[j]  # Bigger group
+            if g1 & g2 == g1:
+                sharing_error = ((sizes[j] - sizes[i]) * (m1_size - m2_size) /
+                                 (1.0 * (sizes[j] * m1_size)))
                 if sharing_error < SELF_IDENTITY_THRESHOLD:
                     is_subsumed[i] = True
                     break
@@ -171,19 +303,28 @@ def _subsume_molecules(molecules_list, get_message_list_weight):
 
 
 def _combine_similar_molecules(molecules_list):
-    """Using a greedy approach here for speed"""
+    """Using a greedy approach here for speed. Each molecule is merged with
+    the earliest uncombined molecule it is similar enough to; since similar
+    molecules must share an email, candidates come from an inverted
+    index."""
     new_guys_start_idx = 0
     while new_guys_start_idx < len(molecules_list):
         combined = [False] * len(molecules_list)
         new_guys = []
+        postings = _inverted_index([g for (g, _) in molecules_list])
         for j in xrange(new_guys_start_idx, len(molecules_list)):
-            for i in xrange(0, j):
+            g2, m2 = molecules_list[j]
+            candidates = set()
+            for email_id in _iter_bits(g2):
+                posting = postings[email_id]
+                candidates.update(posting[:bisect_left(posting, j)])
+            for i in sorted(candidates):
                 if combined[i]:
                     continue
-                (g1, m1), (g2, m2) = molecules_list[i], molecules_list[j]
+                g1, m1 = molecules_list[i]
                 js = _jaccard_similarity(g1, g2)
                 if js > JACCARD_THRESHOLD:
-                    new_guys.append((g1.union(g2), m1.union(m2)))
+                    new_guys.append((g1 | g2, m1 | m2))
                     combined[i], combined[j] = True, True
                     break
 
@@ -2,9 +2,11 @@
 This is a Python module for working with the iCloud CardDav implementation
 based on .
 
-Note that this will only download up to 5000 contacts+groups. To download more,
-this implementation should be changed to WebDAV Sync
-).
+Address books are synced with WebDAV Sync (RFC 6578): a sync-collection
+REPORT lists the hrefs and ETags of the cards changed since a sync token, and
+the changed cards are then fetched with addressbook-multiget REPORTs.
+Multistatus responses are streamed and parsed incrementally, so that memory
+use doesn't grow with the size of the address book.
 
 References:
 - CardDav: https://tools.ietf.org/html/rfc6352
@@ -15,11 +17,13 @@ References:
 
 TODOs
 
-- Implement WebDavSync
 - Support manipulating groups: http://stackoverflow.com/q/24202551
 
 """
 
+from collections import namedtuple
+from xml.sax.saxutils import escape
+
 import requests
 import lxml.etree as ET
 
@@ -29,6 +33,26 @@ USER_AGENT = "User-Agent: DAVKit/4.0.1 (730); CalendarStore/4.0.1 " + \
     "(973); iCal/4.0.1 (1374); Mac OS X/10.6.2 (10C540)"
 
 
+DAV_RESPONSE = '{DAV:}response'
+DAV_HREF = '{DAV:}href'
+DAV_STATUS = '{DAV:}status'
+DAV_PROPSTAT = '{DAV:}propstat'
+DAV_GETETAG = '{DAV:}getetag'
+DAV_SYNC_TOKEN = '{DAV:}sync-token'
+CARDDAV_ADDRESS_DATA = '{urn:ietf:params:xml:ns:carddav}address-data'
+
+# A single DAV:response of a multistatus body. `etag` and `address_data` are
+# None unless the server returned them.
+DavResponse = namedtuple('DavResponse', ['href', 'status', 'etag',
+                                         'address_data'])
+
+
+class InvalidSyncToken(Exception):
+    """ The server no longer accepts the sync token (RFC 6578 3.2); the
+        collection has to be synced from scratch. """
+    pass
+
+
 def supports_carddav(url):
     """ Basic verification that the endpoint supports CardDav
     """
@@ -112,24 +136,114 @@ class CardDav(object):
     #     response.raise_for_status()
     #     return response.content
 
-    def get_cards(self, url):
+    def sync_collection(self, url, sync_token=None):
+        """ Use the sync-collection REPORT to list the members of the address
+            book at `url` that changed since `sync_token`, or all of its
+            members if no token is given.
+
+            Returns a `MultiStatus`. Removed members have status 404. If the
+            server truncated the results, a response for `url` itself with
+            status 507 is included, and the next request should be made with
+            the returned sync token. """
         payload = """
-       <C:addressbook-query xmlns:D="DAV:"
-                         xmlns:C="urn:ietf:params:xml:ns:carddav">
-         <D:prop>
-           <D:getetag/>
-           <C:address-data content-type="application/vcard+xml" version="4.0"/>
-         </D:prop>
-         <C:filter/>
-       </C:addressbook-query>
-        """
+        <D:sync-collection xmlns:D="DAV:">
+          <D:sync-token>{}</D:sync-token>
+          <D:sync-level>1</D:sync-level>
+          <D:prop>
+            <D:getetag/>
+          </D:prop>
+        </D:sync-collection>
+        """.format(escape(sync_token or ''))
 
+        # sync-collection is only defined for Depth: 0.
         response = self.session.request('REPORT',
                                         url,
-                                        data=payload,)
+                                        data=payload,
+                                        headers={'Depth': '0'},
+                                        stream=True)
+        if (sync_token and response.status_code in (403, 409) and
+                'valid-sync-token' in response.content):
+            raise InvalidSyncToken(sync_token)
+        response.raise_for_status()
+        return MultiStatus(response)
 
+    def get_cards_by_href(self, url, hrefs):
+        """ Fetch the vCards at `hrefs` in the address book at `url` with an
+            addressbook-multiget REPORT. Returns a `MultiStatus`. """
+        payload = """
+        <C:addressbook-multiget xmlns:D="DAV:"
+                                xmlns:C="urn:ietf:params:xml:ns:carddav">
+          <D:prop>
+            <D:getetag/>
+            <C:address-data/>
+          </D:prop>
+          {}
+        </C:addressbook-multiget>
+        """.format(''.join('<D:href>{}</D:href>'.format(escape(href))
+                           for href in hrefs))
+
+        response = self.session.request('REPORT',
+                                        url,
+                                        data=payload,
+                                        stream=True)
         response.raise_for_status()
-        return response.content
+        return MultiStatus(response)
+
+
+class MultiStatus(object):
+    """ Incrementally parsed DAV:multistatus response.
+
+        Iterating yields a `DavResponse` per DAV:response element, clearing
+        each element once it's been read so that only one response is held in
+        memory at a time. Once iteration is done, `sync_token` holds the
+        response's DAV:sync-token, if any. """
+
+    def __init__(self, response):
+        self.response = response
+        self.sync_token = None
+
+    def __iter__(self):
+        raw = self.response.raw
+        # Let urllib3 undo any Content-Encoding.
+        raw.decode_content = True
+        try:
+            for _, element in ET.iterparse(raw, events=('end',),
+                                           tag=(DAV_RESPONSE,
+                                                DAV_SYNC_TOKEN)):
+                if element.tag == DAV_SYNC_TOKEN:
+                    self.sync_token = element.text
+                    continue
+                yield _parse_response(element)
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+        finally:
+            self.response.close()
+
+
+def _parse_response(element):
+    href = element.findtext(DAV_HREF)
+    status = _parse_status(element.findtext(DAV_STATUS))
+    etag = address_data = None
+    for propstat in element.iterchildren(DAV_PROPSTAT):
+        propstat_status = _parse_status(propstat.findtext(DAV_STATUS))
+        if propstat_status != 200:
+            continue
+        status = status or propstat_status
+        etag = propstat.findtext('.//' + DAV_GETETAG) or etag
+        address_data = propstat.findtext('.//' + CARDDAV_ADDRESS_DATA) or \
+            address_data
+    return DavResponse(href, status, etag, address_data)
+
+
+def _parse_status(status_line):
+    # e.g. 'HTTP/1.1 404 Not Found'
+    if not status_line:
+        return None
+    try:
+        return int(status_line.split()[1])
+    except (IndexError, ValueError):
+        return None
 
 
 #####################################################
@@ -3,6 +3,9 @@ import posixpath
 import random
 import gevent
 from datetime import datetime
+from itertools import chain, islice
+
+import arrow
 
 import gdata.auth
 import gdata.client
@@ -19,6 +22,9 @@ from inbox.models.backends.gmail import GmailAuthCredentials
 
 SOURCE_APP_NAME = 'Nilas Sync Engine'
 
+# Number of contact entries requested per page of the contacts feed.
+CONTACTS_PAGE_SIZE = 500
+
 
 class GoogleContactsProvider(object):
     """
@@ -161,22 +167,72 @@ class GoogleContactsProvider(object):
             If no data could be fetched because of invalid credentials or
             insufficient permissions, respectively.
 
+        """
+        pages = self.get_pages(sync_from_dt)
+        return islice(chain.from_iterable(contacts for contacts, _ in pages),
+                      max_results)
+
+    def get_pages(self, sync_from_dt=None, page_size=CONTACTS_PAGE_SIZE):
+        """
+        Fetches and parses fresh contact data a page of the contacts feed at
+        a time, so that the feed is never held in memory as a whole.
+
+        The feed is requested in ascending order of update time, so a sync
+        that is interrupted can be resumed from the update time of the last
+        page that was persisted rather than from scratch.
+
+        Parameters
+        ----------
+        sync_from_dt: datetime, optional
+            If given, fetch contacts that have been updated since this time.
+            Otherwise fetch all contacts
+        page_size: int, optional
+            The number of contact entries to request per page.
+
+        Yields
+        ------
+        (list, datetime) tuples
+            The Contacts in the page, and the (naive UTC) update time of the
+            last one, or None if it isn't known.
+
+        Raises
+        ------
+        ValidationError
+            If no data could be fetched because of invalid credentials or
+            insufficient permissions, respectively.
+
         """
         query = gdata.contacts.client.ContactsQuery()
-        # TODO(emfree): Implement batch fetching
         # Note: The Google contacts API will only return 25 results if
-        # query.max_results is not explicitly set, so have to set it to a large
-        # number by default.
-        query.max_results = max_results
+        # query.max_results is not explicitly set.
+        query.max_results = page_size
         if sync_from_dt:
             query.updated_min = datetime.isoformat(sync_from_dt) + 'Z'
         query.showdeleted = True
+        query.orderby = 'lastmodified'
+        query.sortorder = 'ascending'
+
+        feed = self._get_feed(q=query)
+        while True:
+            contacts = [self._parse_contact_result(result) for result in
+                        feed.entry]
+            checkpoint = None
+            if feed.entry and feed.entry[-1].updated is not None:
+                checkpoint = arrow.get(feed.entry[-1].updated.text). \
+                    to('utc').naive
+            yield contacts, checkpoint
+
+            next_link = feed.GetNextLink()
+            if next_link is None:
+                return
+            feed = self._get_feed(uri=next_link.href)
+
+    def _get_feed(self, **kwargs):
+        """Fetch a page of the contacts feed, retrying on request failures."""
         while True:
             try:
                 google_client = self._get_google_client()
-                results = google_client.GetContacts(q=query).entry
-                return [self._parse_contact_result(result) for result in
-                        results]
+                return google_client.GetContacts(**kwargs)
             except gdata.client.RequestError as e:
                 self.log.info('contact sync request failure; retrying',
                               message=e)
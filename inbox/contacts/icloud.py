@@ -3,22 +3,35 @@
 from nylas.logging import get_logger
 logger = get_logger()
 
-from carddav import CardDav
-import lxml.etree as ET
+from requests.exceptions import HTTPError
+
+from inbox.contacts.carddav import CardDav, InvalidSyncToken, supports_carddav
 from inbox.contacts.vcard import vcard_from_string
-from inbox.contacts.carddav import supports_carddav
+from inbox.util.itert import chunk
 
 from inbox.models.session import session_scope
 from inbox.models import Contact
 from inbox.models.backends.generic import GenericAccount
+from inbox.models.carddav import CardDavAddressBook, CardDavCard
 
 
 ICLOUD_CONTACTS_URL = 'https://contacts.icloud.com/'
 
+# Number of cards fetched per addressbook-multiget REPORT.
+MULTIGET_BATCH_SIZE = 100
+
+# Number of card rows loaded or written at a time when saving sync state.
+CARD_STATE_BATCH_SIZE = 500
+
 
 class ICloudContactsProvider(object):
     """
     Base class to fetch and parse iCloud contacts
+
+    The address book is synced incrementally with WebDAV Sync: only the cards
+    that changed since the sync token saved by the last sync (and whose ETag
+    differs from the one we last saw) are fetched.
+
     """
 
     PROVIDER_NAME = 'icloud'
@@ -29,6 +42,7 @@ class ICloudContactsProvider(object):
         self.namespace_id = namespace_id
         self.log = logger.new(account_id=account_id, component='contacts sync',
                               provider=self.PROVIDER_NAME)
+        self._pending_state = None
 
     def _vCard_raw_to_contact(self, cardstring):
         card = vcard_from_string(cardstring)
@@ -60,6 +74,16 @@ class ICloudContactsProvider(object):
                        raw_data=cardstring)
 
     def get_items(self, sync_from_dt=None, max_results=100000):
+        """
+        Yield the contacts that were created, changed or deleted since the
+        last sync. `sync_from_dt` is ignored in favor of the address book's
+        sync token.
+
+        The new sync token and card ETags are only saved by
+        `commit_sync_state`, once the yielded contacts have been persisted.
+
+        """
+        self._pending_state = None
         with session_scope() as db_session:
             account = db_session.query(GenericAccount).get(self.account_id)
             email_address = account.email_address
@@ -68,41 +92,163 @@ class ICloudContactsProvider(object):
                 self.log.error("Can't sync contacts for non iCloud provider",
                                account_id=account.id,
                                provider=account.provider)
-                return []
+                return
+
+            address_book = account.carddav_address_book
+            if address_book is None:
+                address_book = CardDavAddressBook(account=account)
+                db_session.add(address_book)
+                db_session.flush()
+            address_book_id = address_book.id
+            home_url = address_book.home_url
+            sync_token = address_book.sync_token
+            # href -> (uid, etag)
+            known_cards = {href: (uid, etag) for href, uid, etag in
+                           db_session.query(CardDavCard.href, CardDavCard.uid,
+                                            CardDavCard.etag).filter(
+                               CardDavCard.address_book_id ==
+                               address_book_id)}
 
         c = CardDav(email_address, password, ICLOUD_CONTACTS_URL)
 
+        if home_url is None:
+            home_url = self._discover_home_url(c, address_book_id)
+        try:
+            changed, removed, sync_token = self._list_changes(
+                c, home_url + 'card/', sync_token, known_cards)
+        except HTTPError as exc:
+            # The cached URL is stale, e.g. because the account was moved to
+            # a different iCloud shard.
+            if exc.response.status_code not in (301, 302, 404):
+                raise
+            self.log.info('Cached address book URL is stale, rediscovering',
+                          home_url=home_url)
+            home_url = self._discover_home_url(c, address_book_id)
+            changed, removed, sync_token = self._list_changes(
+                c, home_url + 'card/', None, known_cards)
+
+        # href -> (uid, etag) of the cards fetched in this sync.
+        fetched_cards = {}
+        for hrefs in chunk(changed, MULTIGET_BATCH_SIZE):
+            for response in c.get_cards_by_href(home_url + 'card/', hrefs):
+                if response.status != 200 or response.address_data is None:
+                    # Removed since it was listed; the next sync will see
+                    # the removal.
+                    continue
+                contact = self._vCard_raw_to_contact(response.address_data)
+                uid = contact.uid if contact is not None else None
+                fetched_cards[response.href] = (uid, response.etag)
+                if contact is not None:
+                    yield contact
+
+        for href in removed:
+            uid = known_cards.get(href, (None, None))[0]
+            if uid is not None:
+                yield Contact(namespace_id=self.namespace_id,
+                              provider_name=self.PROVIDER_NAME,
+                              uid=uid,
+                              deleted=True)
+
+        self.log.info('Listed iCloud contact changes',
+                      listed=len(changed), fetched=len(fetched_cards),
+                      removed=len(removed))
+        self._pending_state = (address_book_id, sync_token, fetched_cards,
+                               removed)
+
+    def _discover_home_url(self, c, address_book_id):
         # Get the `principal` URL for the users's CardDav endpont
         principal = c.get_principal_url()
 
         # Get addressbook home URL on user's specific iCloud shard/subdomain
         home_url = c.get_address_book_home(ICLOUD_CONTACTS_URL + principal)
         self.log.info("Home URL for user's contacts: {}".format(home_url))
-        self.log.debug("Requesting cards for user")
-
-        # This request is limited to returning 5000 items
-        returned_cards = c.get_cards(home_url + 'card/')
-
-        root = ET.XML(returned_cards)
-
-        all_contacts = []
-        for refprop in root.iterchildren():
-
-            try:
-                cardstring = refprop[1][0][1].text
-            except IndexError:
-                # This can happen when there are errors or other responses.
-                # Currently if there are over 5000 contacts, it trigger the
-                # response number-of-matches-within-limits
-                # TODO add paging for requesting all
-                self.log.error("Error parsing CardDav response into contact: "
-                               "{}".format(ET.tostring(refprop)))
-                continue
-
-            new_contact = self._vCard_raw_to_contact(cardstring)
-            if new_contact:
-                all_contacts.append(new_contact)
-
-        self.log.info("Saving {} contacts from iCloud sync"
-                      .format(len(all_contacts)))
-        return all_contacts
+
+        with session_scope() as db_session:
+            address_book = db_session.query(CardDavAddressBook). \
+                get(address_book_id)
+            address_book.principal_url = principal
+            address_book.home_url = home_url
+        return home_url
+
+    def _list_changes(self, c, url, sync_token, known_cards):
+        """
+        Run sync-collection REPORTs against the address book at `url` until
+        the server stops truncating the results, starting from `sync_token`,
+        or from scratch if it's None or has expired.
+
+        Returns the hrefs of the cards to fetch (those whose ETag doesn't
+        match `known_cards`), the hrefs of the removed cards and the new
+        sync token.
+
+        """
+        try:
+            return self._sync_collection(c, url, sync_token, known_cards)
+        except InvalidSyncToken:
+            self.log.warning('Address book sync token expired, resyncing')
+            return self._sync_collection(c, url, None, known_cards)
+
+    def _sync_collection(self, c, url, sync_token, known_cards):
+        changed = []
+        removed = []
+        # When syncing from scratch, the server lists every card but doesn't
+        # report removals, so any card we know of that isn't listed has been
+        # removed.
+        listed = set() if sync_token is None else None
+        while True:
+            truncated = False
+            result = c.sync_collection(url, sync_token)
+            for response in result:
+                if response.status == 507:
+                    truncated = True
+                elif response.status == 404:
+                    removed.append(response.href)
+                elif response.href and not response.href.endswith('/'):
+                    if listed is not None:
+                        listed.add(response.href)
+                    known_etag = known_cards.get(response.href,
+                                                 (None, None))[1]
+                    if response.etag is None or response.etag != known_etag:
+                        changed.append(response.href)
+
+            sync_token = result.sync_token
+            if not truncated or sync_token is None:
+                break
+
+        if listed is not None:
+            removed.extend(set(known_cards) - listed)
+        return changed, removed, sync_token
+
+    def commit_sync_state(self, db_session):
+        """
+        Save the sync token and card ETags of the last `get_items` call. Must
+        only be called once the contacts it yielded have been persisted, so
+        that an interrupted sync is resumed from the previous token.
+
+        """
+        if self._pending_state is None:
+            return
+        address_book_id, sync_token, fetched_cards, removed = \
+            self._pending_state
+        self._pending_state = None
+
+        for hrefs in chunk(set(fetched_cards) | set(removed),
+                           CARD_STATE_BATCH_SIZE):
+            existing = {card.href: card for card in
+                        db_session.query(CardDavCard).filter(
+                            CardDavCard.address_book_id == address_book_id,
+                            CardDavCard.href.in_(hrefs))}
+            for href in hrefs:
+                card = existing.get(href)
+                if href not in fetched_cards:
+                    if card is not None:
+                        db_session.delete(card)
+                    continue
+                if card is None:
+                    card = CardDavCard(address_book_id=address_book_id,
+                                       href=href)
+                    db_session.add(card)
+                card.uid, card.etag = fetched_cards[href]
+
+        address_book = db_session.query(CardDavAddressBook). \
+            get(address_book_id)
+        address_book.sync_token = sync_token
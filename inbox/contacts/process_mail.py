@@ -1,60 +1,194 @@
 import uuid
+from collections import OrderedDict
+
 from inbox.util.addr import valid_email
 from inbox.util.addr import canonicalize_address as canonicalize
 from inbox.models import Contact, MessageContactAssociation
 
 from inbox.contacts.crud import INBOX_PROVIDER_NAME
 
+ADDRESS_FIELDS = ('from_addr', 'to_addr', 'cc_addr', 'bcc_addr', 'reply_to')
+
+# Per-account bound on the number of cached canonical addresses. Most accounts
+# correspond with a few hundred addresses, so this comfortably holds the
+# working set during an initial sync.
+MAX_CACHED_ADDRESSES = 5000
+
+
+class ContactAddressCache(object):
+    """
+    Bounded LRU mapping of canonicalized email address ->
+    (contact id, contact name) for a single namespace.
+
+    Only rows that have been read back from the database are cached, so a
+    rolled-back batch can never leave ids of unpersisted contacts behind.
+    Entries must be invalidated when the corresponding contact is deleted or
+    its address changes; see `invalidate_contact_cache`.
+
+    """
+    def __init__(self, max_size=MAX_CACHED_ADDRESSES):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def __contains__(self, canonicalized_address):
+        return canonicalized_address in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, canonicalized_address):
+        entry = self._entries.pop(canonicalized_address, None)
+        if entry is not None:
+            self._entries[canonicalized_address] = entry
+        return entry
+
+    def set(self, canonicalized_address, contact_id, name):
+        self._entries.pop(canonicalized_address, None)
+        self._entries[canonicalized_address] = (contact_id, name)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, canonicalized_addresses):
+        for canonicalized_address in canonicalized_addresses:
+            self._entries.pop(canonicalized_address, None)
+
+    def clear(self):
+        self._entries.clear()
+
+
+# namespace_id -> ContactAddressCache. Used by mail sync, which runs in the
+# same process as contact sync, so contact sync can keep it coherent.
+_contact_caches = {}
+
+
+def get_contact_cache(namespace_id):
+    cache = _contact_caches.get(namespace_id)
+    if cache is None:
+        cache = _contact_caches[namespace_id] = ContactAddressCache()
+    return cache
+
+
+def invalidate_contact_cache(namespace_id, canonicalized_addresses=None):
+    """
+    Drop cached entries for the given addresses, or the namespace's whole
+    cache if no addresses are given.
+
+    """
+    if canonicalized_addresses is None:
+        _contact_caches.pop(namespace_id, None)
+        return
+    cache = _contact_caches.get(namespace_id)
+    if cache is not None:
+        cache.invalidate(canonicalized_addresses)
+
+
+def _message_addresses(message):
+    all_addresses = []
+    for field_name in ADDRESS_FIELDS:
+        # We generally require these attributes to be non-null, but only
+        # set them to the default empty list at flush time. So it's better
+        # to be safe here.
+        field = getattr(message, field_name)
+        if field is not None:
+            all_addresses.extend(field)
+    return all_addresses
+
+
+def update_contacts_from_message(db_session, message, namespace, cache=None):
+    update_contacts_from_messages(db_session, [message], namespace, cache)
+
+
+def update_contacts_from_messages(db_session, messages, namespace, cache=None):
+    """
+    Create Contact objects for any addressees of `messages` that we haven't
+    seen yet, and associate every valid addressee with its message.
+
+    Addresses are resolved with `cache`, falling back to a single IN query for
+    the whole batch. If no cache is given, a throwaway one is used, so the
+    lookup is still batched but nothing outlives the call. Contacts created
+    for the batch are added to the session together.
+
+    """
+    if cache is None:
+        cache = ContactAddressCache()
 
-def update_contacts_from_message(db_session, message, namespace):
     with db_session.no_autoflush:
         # First create Contact objects for any email addresses that we haven't
         # seen yet. We want to dedupe by canonicalized address, so this part is
         # a bit finicky.
-        canonicalized_addresses = []
         all_addresses = []
-        for field in (message.from_addr, message.to_addr, message.cc_addr,
-                      message.bcc_addr, message.reply_to):
-            # We generally require these attributes to be non-null, but only
-            # set them to the default empty list at flush time. So it's better
-            # to be safe here.
-            if field is not None:
-                all_addresses.extend(field)
-        canonicalized_addresses = [canonicalize(addr) for _, addr in
-                                   all_addresses]
-
-        existing_contacts = db_session.query(Contact).filter(
-            Contact._canonicalized_address.in_(canonicalized_addresses),
-            Contact.namespace_id == namespace.id).all()
-
-        contact_map = {c._canonicalized_address: c for c in existing_contacts}
+        for message in messages:
+            all_addresses.extend(_message_addresses(message))
+
+        # canonicalized address -> (contact id, name) for this batch. Kept
+        # separately from the cache so that entries can't be evicted while
+        # we're still using them.
+        resolved = {}
+        uncached = []
+        for canonicalized_address in {canonicalize(addr) for _, addr in
+                                      all_addresses}:
+            entry = cache.get(canonicalized_address)
+            if entry is not None:
+                resolved[canonicalized_address] = entry
+            else:
+                uncached.append(canonicalized_address)
+        if uncached:
+            existing = db_session.query(
+                Contact.id, Contact._canonicalized_address, Contact.name). \
+                filter(Contact._canonicalized_address.in_(uncached),
+                       Contact.namespace_id == namespace.id).all()
+            for contact_id, canonicalized_address, name in existing:
+                resolved[canonicalized_address] = (contact_id, name)
+                cache.set(canonicalized_address, contact_id, name)
+
+        new_contacts = {}
         for name, email_address in all_addresses:
             canonicalized_address = canonicalize(email_address)
-            if canonicalized_address not in contact_map:
-                new_contact = Contact(name=name, email_address=email_address,
-                                      namespace=namespace,
-                                      provider_name=INBOX_PROVIDER_NAME,
-                                      uid=uuid.uuid4().hex)
-                contact_map[canonicalized_address] = new_contact
+            if (canonicalized_address not in resolved and
+                    canonicalized_address not in new_contacts):
+                new_contacts[canonicalized_address] = Contact(
+                    name=name, email_address=email_address,
+                    namespace=namespace, provider_name=INBOX_PROVIDER_NAME,
+                    uid=uuid.uuid4().hex)
+        db_session.add_all(new_contacts.values())
 
         # Now associate each contact to the message.
-        for field_name in ('from_addr', 'to_addr', 'cc_addr', 'bcc_addr',
-                           'reply_to'):
-            field = getattr(message, field_name)
-            if field is None:
-                continue
-            for name, email_address in field:
-                if not valid_email(email_address):
+        for message in messages:
+            for field_name in ADDRESS_FIELDS:
+                field = getattr(message, field_name)
+                if field is None:
                     continue
-                canonicalized_address = canonicalize(email_address)
-                contact = contact_map.get(canonicalized_address)
-                # Hackily address the condition that you get mail from e.g.
-                # "Ben Gotow (via Google Drive) <drive-shares-noreply@google.com"
-                # "Christine Spang (via Google Drive) <drive-shares-noreply@google.com"
-                # and so on: rather than creating many contacts with
-                # varying name, null out the name for the existing contact.
-                if contact.name != name and 'noreply' in canonicalized_address:
-                    contact.name = None
-
-                message.contacts.append(MessageContactAssociation(
-                    contact=contact, field=field_name))
+                for name, email_address in field:
+                    if not valid_email(email_address):
+                        continue
+                    canonicalized_address = canonicalize(email_address)
+                    new_contact = new_contacts.get(canonicalized_address)
+                    if new_contact is not None:
+                        _null_noreply_name(new_contact, name,
+                                           canonicalized_address)
+                        association = MessageContactAssociation(
+                            contact=new_contact, field=field_name)
+                    else:
+                        contact_id, contact_name = \
+                            resolved[canonicalized_address]
+                        if (contact_name != name and contact_name is not None
+                                and 'noreply' in canonicalized_address):
+                            contact = db_session.query(Contact).get(contact_id)
+                            _null_noreply_name(contact, name,
+                                               canonicalized_address)
+                            resolved[canonicalized_address] = (contact_id,
+                                                               None)
+                            cache.set(canonicalized_address, contact_id, None)
+                        association = MessageContactAssociation(
+                            contact_id=contact_id, field=field_name)
+                    message.contacts.append(association)
+
+
+def _null_noreply_name(contact, name, canonicalized_address):
+    # Hackily address the condition that you get mail from e.g.
+    # "Ben Gotow (via Google Drive) <drive-shares-noreply@google.com"
+    # "Christine Spang (via Google Drive) <drive-shares-noreply@google.com"
+    # and so on: rather than creating many contacts with
+    # varying name, null out the name for the existing contact.
+    if contact.name != name and 'noreply' in canonicalized_address:
+        contact.name = None
@@ -1,14 +1,17 @@
 from datetime import datetime
 from collections import Counter
 
-from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy import or_
 
 from nylas.logging import get_logger
 logger = get_logger()
 from inbox.models import Contact, Account
+from inbox.util.addr import canonicalize_address as canonicalize
+from inbox.util.itert import chunk
 from inbox.sync.base_sync import BaseSyncMonitor
 from inbox.contacts.google import GoogleContactsProvider
 from inbox.contacts.icloud import ICloudContactsProvider
+from inbox.contacts.process_mail import invalidate_contact_cache
 from inbox.util.debug import bind_context
 from inbox.models.session import session_scope
 
@@ -19,6 +22,9 @@ CONTACT_SYNC_PROVIDER_MAP = {'gmail': GoogleContactsProvider,
 CONTACT_SYNC_FOLDER_ID = -1
 CONTACT_SYNC_FOLDER_NAME = 'Contacts'
 
+# Number of remote contacts reconciled and committed at a time.
+CONTACT_SYNC_BATCH_SIZE = 500
+
 
 class ContactSync(BaseSyncMonitor):
     """
@@ -61,6 +67,11 @@ class ContactSync(BaseSyncMonitor):
         """Query a remote provider for updates and persist them to the
         database. This function runs every `self.poll_frequency`.
 
+        Providers that define `get_pages` are persisted a page at a time, and
+        the page's checkpoint is saved as the account's
+        `last_synced_contacts`, so that an interrupted sync resumes from the
+        last committed page.
+
         """
         self.log.info('syncing contacts')
         # Grab timestamp so next sync gets deltas from now
@@ -70,50 +81,32 @@ class ContactSync(BaseSyncMonitor):
             account = db_session.query(Account).get(self.account_id)
             last_sync_dt = account.last_synced_contacts
 
-            all_contacts = self.provider.get_items(sync_from_dt=last_sync_dt)
+            if hasattr(self.provider, 'get_pages'):
+                pages = self.provider.get_pages(sync_from_dt=last_sync_dt)
+            else:
+                all_contacts = self.provider.get_items(
+                    sync_from_dt=last_sync_dt)
+                pages = ((batch, None) for batch in
+                         chunk(all_contacts, CONTACT_SYNC_BATCH_SIZE))
 
-            # Do a batch insertion of every 100 contact objects
             change_counter = Counter()
-            for new_contact in all_contacts:
-                new_contact.namespace = account.namespace
-                assert new_contact.uid is not None, \
-                    'Got remote item with null uid'
-                assert isinstance(new_contact.uid, basestring)
-
-                if (not new_contact.deleted and
-                        db_session.query(Contact).filter(
-                            Contact.namespace == account.namespace,
-                            Contact.email_address == new_contact.email_address,
-                            Contact.name == new_contact.name).first()):
-                    # Skip creating a new contact if we've already imported one
-                    # (e.g., from mail).
-                    continue
-
-                try:
-                    existing_contact = db_session.query(Contact).filter(
-                        Contact.namespace == account.namespace,
-                        Contact.provider_name == self.provider.PROVIDER_NAME,
-                        Contact.uid == new_contact.uid).one()
-
-                    # If the remote item was deleted, purge the corresponding
-                    # database entries.
-                    if new_contact.deleted:
-                        db_session.delete(existing_contact)
-                        change_counter['deleted'] += 1
-                    else:
-                        # Update fields in our old item with the new.
-                        # Don't save the newly returned item to the database.
-                        existing_contact.merge_from(new_contact)
-                        change_counter['updated'] += 1
-
-                except NoResultFound:
-                    # We didn't know about this before! Add this item.
-                    db_session.add(new_contact)
-                    change_counter['added'] += 1
-
-                # Flush every 100 objects for perf
-                if sum(change_counter.values()) % 100:
-                    db_session.flush()
+            for contacts, checkpoint in pages:
+                for batch in chunk(contacts, CONTACT_SYNC_BATCH_SIZE):
+                    self._reconcile(batch, account.namespace, db_session,
+                                    change_counter)
+                if checkpoint is not None:
+                    # Commit the page together with the point to resume
+                    # from if the sync is interrupted.
+                    account.last_synced_contacts = checkpoint
+                db_session.commit()
+
+            # Providers that sync incrementally only advance their sync
+            # state once everything they returned has been committed.
+            commit_sync_state = getattr(self.provider, 'commit_sync_state',
+                                        None)
+            if commit_sync_state is not None:
+                commit_sync_state(db_session)
+                db_session.commit()
 
         # Update last sync
         with session_scope() as db_session:
@@ -123,3 +116,91 @@ class ContactSync(BaseSyncMonitor):
         self.log.info('synced contacts', added=change_counter['added'],
                       updated=change_counter['updated'],
                       deleted=change_counter['deleted'])
+
+    def _reconcile(self, remote_contacts, namespace, db_session,
+                   change_counter):
+        """
+        Partition a batch of remote contacts into contacts to insert, update
+        and delete, and apply them. The local contacts matching the batch
+        are loaded up front with one query for the provider uids and one for
+        the (address, name) pairs used to skip duplicates, instead of two
+        queries per remote contact; the changes are flushed together.
+
+        """
+        for new_contact in remote_contacts:
+            assert new_contact.uid is not None, \
+                'Got remote item with null uid'
+            assert isinstance(new_contact.uid, basestring)
+
+        existing = {c.uid: c for c in db_session.query(Contact).filter(
+            Contact.namespace_id == namespace.id,
+            Contact.provider_name == self.provider.PROVIDER_NAME,
+            Contact.uid.in_({c.uid for c in remote_contacts}))}
+
+        # Multiset of the (canonicalized address, name) pairs of the
+        # namespace's contacts that remote contacts in the batch could
+        # duplicate.
+        addresses = {canonicalize(c.email_address) for c in remote_contacts
+                     if not c.deleted}
+        address_filters = []
+        if addresses - {None}:
+            address_filters.append(Contact._canonicalized_address.in_(
+                addresses - {None}))
+        if None in addresses:
+            address_filters.append(Contact._canonicalized_address == None)
+        known = Counter()
+        if address_filters:
+            known.update(db_session.query(
+                Contact._canonicalized_address, Contact.name).filter(
+                Contact.namespace_id == namespace.id, or_(*address_filters)))
+
+        inserts = []
+        deletes = []
+        with db_session.no_autoflush:
+            for new_contact in remote_contacts:
+                new_contact.namespace = namespace
+                key = (canonicalize(new_contact.email_address),
+                       new_contact.name)
+                if not new_contact.deleted and known[key]:
+                    # Skip creating a new contact if we've already imported
+                    # one (e.g., from mail).
+                    continue
+
+                existing_contact = existing.get(new_contact.uid)
+                if existing_contact is None:
+                    # We didn't know about this before! Add this item.
+                    if new_contact.deleted:
+                        continue
+                    inserts.append(new_contact)
+                    existing[new_contact.uid] = new_contact
+                    known[key] += 1
+                    change_counter['added'] += 1
+                    continue
+
+                old_key = (existing_contact._canonicalized_address,
+                           existing_contact.name)
+                if known[old_key]:
+                    known[old_key] -= 1
+                if new_contact.deleted:
+                    # If the remote item was deleted, purge the
+                    # corresponding database entries.
+                    deletes.append(existing_contact)
+                    del existing[new_contact.uid]
+                    change_counter['deleted'] += 1
+                else:
+                    # Update fields in our old item with the new.
+                    # Don't save the newly returned item to the database.
+                    existing_contact.merge_from(new_contact)
+                    known[key] += 1
+                    change_counter['updated'] += 1
+
+                # Keep mail sync's address -> contact cache coherent.
+                invalidate_contact_cache(self.namespace_id, [old_key[0]])
+
+        db_session.add_all(inserts)
+        for contact in deletes:
+            if contact in db_session.new:
+                db_session.expunge(contact)
+            else:
+                db_session.delete(contact)
+        db_session.flush()
@@ -2,6 +2,7 @@
 import datetime
 import json
 import random
+import time
 import urllib
 import gevent
 import requests
@@ -52,6 +53,15 @@ class GoogleEventsProvider(object):
         # by the Google Event API.
         self.calendars_table = {}
 
+        # Reuse connections across requests (and across pages of a listing)
+        # instead of opening a new one for each.
+        self.session = requests.Session()
+
+        # Calendars of the account may be synced concurrently; when the API
+        # rate-limits one of them, requests for all of them are held until
+        # this time.
+        self._backoff_until = 0
+
     def sync_calendars(self):
         """ Fetches data for the user's calendars.
         Returns
@@ -98,6 +108,32 @@ class GoogleEventsProvider(object):
 
         return updates
 
+    def sync_event_pages(self, calendar_uid, sync_from_time=None,
+                         sync_token=None):
+        """ Like `sync_events`, but fetches and parses the events one page
+        of API results at a time, so that they can be persisted as they come
+        in rather than all being held in memory.
+
+        Parameters
+        ----------
+        sync_token: string, optional
+            The `nextSyncToken` returned at the end of the previous sync of
+            this calendar. If given, only events that changed since that sync
+            are fetched, and `sync_from_time` is ignored. If Google no longer
+            accepts the token (HTTP 410), all event data is fetched.
+
+        Returns
+        -------
+        A generator of (list of uncommited Event instances, next sync token)
+        pairs. The next sync token is only set for the last page.
+        """
+        read_only_calendar = self.calendars_table.get(calendar_uid, True)
+        for page in self._iter_raw_event_pages(calendar_uid, sync_from_time,
+                                               sync_token):
+            yield ([parse_event_response(item, read_only_calendar)
+                    for item in page['items']],
+                   page.get('nextSyncToken'))
+
     def _get_raw_calendars(self):
         """Gets raw data for the user's calendars."""
         return self._get_resource_list(CALENDARS_URL)
@@ -117,20 +153,42 @@ class GoogleEventsProvider(object):
         -------
         list of dictionaries representing JSON.
         """
-        if sync_from_time is not None:
+        return [item for page in
+                self._iter_raw_event_pages(calendar_uid, sync_from_time)
+                for item in page['items']]
+
+    def _iter_raw_event_pages(self, calendar_uid, sync_from_time=None,
+                              sync_token=None):
+        """ Gets raw event data for the given calendar, one page at a time.
+
+        Returns
+        -------
+        generator of dictionaries representing the JSON of each page.
+        """
+        params = {}
+        if sync_token is not None:
+            params['syncToken'] = sync_token
+        elif sync_from_time is not None:
             # Note explicit offset is required by Google calendar API.
-            sync_from_time = datetime.datetime.isoformat(sync_from_time) + 'Z'
+            params['updatedMin'] = \
+                datetime.datetime.isoformat(sync_from_time) + 'Z'
 
         url = 'https://www.googleapis.com/calendar/v3/' \
               'calendars/{}/events'.format(urllib.quote(calendar_uid))
         try:
-            return self._get_resource_list(url, updatedMin=sync_from_time)
+            for page in self._iter_resource_pages(url, **params):
+                yield page
         except requests.exceptions.HTTPError as exc:
-            if exc.response.status_code == 410:
-                # The calendar API may return 410 if you pass a value for
-                # updatedMin that's too far in the past. In that case, refetch
-                # all events.
-                return self._get_resource_list(url)
+            if exc.response.status_code == 410 and params:
+                # The calendar API returns 410 if the sync token has expired,
+                # or if you pass a value for updatedMin that's too far in
+                # the past. In that case, refetch all events.
+                self.log.warning('Incremental event sync rejected; '
+                                 'fetching all events',
+                                 calendar_uid=calendar_uid,
+                                 used_sync_token=sync_token is not None)
+                for page in self._iter_resource_pages(url):
+                    yield page
             else:
                 raise
 
@@ -144,22 +202,28 @@ class GoogleEventsProvider(object):
 
     def _get_resource_list(self, url, **params):
         """Handles response pagination."""
+        return [item for page in self._iter_resource_pages(url, **params)
+                for item in page['items']]
+
+    def _iter_resource_pages(self, url, **params):
+        """Yields each page (the decoded JSON response) of a resource
+        listing."""
         token = self._get_access_token()
-        items = []
         next_page_token = None
         params['showDeleted'] = True
         while True:
             if next_page_token is not None:
                 params['pageToken'] = next_page_token
+            self._wait_for_backoff()
             try:
-                r = requests.get(url, params=params,
-                                 auth=OAuthRequestsWrapper(token))
+                r = self.session.get(url, params=params,
+                                     auth=OAuthRequestsWrapper(token))
                 r.raise_for_status()
                 data = r.json()
-                items += data['items']
                 next_page_token = data.get('nextPageToken')
+                yield data
                 if next_page_token is None:
-                    return items
+                    return
 
             except requests.exceptions.SSLError:
                 self.log.warning(
@@ -190,7 +254,7 @@ class GoogleEventsProvider(object):
                         r.raise_for_status()
                     if reason == 'userRateLimitExceeded':
                         log.warning('API request was rate-limited; retrying')
-                        gevent.sleep(30 + random.randrange(0, 60))
+                        self._back_off(30 + random.randrange(0, 60))
                         continue
                     elif reason == 'accessNotConfigured':
                         log.warning('API not enabled; returning empty result')
@@ -198,6 +262,15 @@ class GoogleEventsProvider(object):
                 # Unexpected error; raise.
                 raise
 
+    def _back_off(self, seconds):
+        self._backoff_until = max(self._backoff_until, time.time() + seconds)
+        self._wait_for_backoff()
+
+    def _wait_for_backoff(self):
+        delay = self._backoff_until - time.time()
+        if delay > 0:
+            gevent.sleep(delay)
+
     def _make_event_request(self, method, calendar_uid, event_uid=None,
                             **kwargs):
         """ Makes a POST/PUT/DELETE request for a particular event. """
@@ -206,9 +279,9 @@ class GoogleEventsProvider(object):
               'calendars/{}/events/{}'.format(urllib.quote(calendar_uid),
                                               urllib.quote(event_uid))
         token = self._get_access_token()
-        response = requests.request(method, url,
-                                    auth=OAuthRequestsWrapper(token),
-                                    **kwargs)
+        response = self.session.request(method, url,
+                                        auth=OAuthRequestsWrapper(token),
+                                        **kwargs)
         return response
 
     def create_remote_event(self, event, **kwargs):
@@ -3,8 +3,10 @@ import pytz
 import arrow
 import traceback
 import icalendar
+from collections import OrderedDict
 from icalendar import Calendar as iCalendar
 from datetime import datetime, date
+from sqlalchemy import event as sqlalchemy_event
 
 from flanker import mime
 from html2text import html2text
@@ -14,6 +16,7 @@ from inbox.models.event import Event, EVENT_STATUSES
 from inbox.events.util import MalformedEventError
 from inbox.util.addr import canonicalize_address
 from inbox.models.action_log import schedule_action
+from inbox.util.stats import statsd_client
 
 from nylas.logging import get_logger
 log = get_logger()
@@ -25,6 +28,13 @@ STATUS_MAP = {'NEEDS-ACTION': 'noreply',
               'TENTATIVE': 'maybe'}
 INVERTED_STATUS_MAP = {value: key for key, value in STATUS_MAP.iteritems()}
 
+# Bound on the number of imported calendar attachments remembered, so that
+# identical copies of them are skipped.
+MAX_IMPORTED_INVITES = 10000
+
+# (account id, data_sha256) -> True, in least recently used order.
+_imported_invites = OrderedDict()
+
 
 def events_from_ics(namespace, calendar, ics_str):
     try:
@@ -273,8 +283,19 @@ def events_from_ics(namespace, calendar, ics_str):
     return events
 
 
-def process_invites(db_session, message, account, invites):
-    new_uids = [event.uid for event in invites]
+def process_invites(db_session, account, invites):
+    """
+    Merge invites into the 'Emailed events' calendar.
+
+    Parameters
+    ----------
+    invites: list
+        (message, event) pairs, in the order the messages were received.
+
+    """
+    new_uids = {event.uid for _, event in invites}
+    if not new_uids:
+        return
 
     # Get the list of events which share a uid with those we received.
     # Note that we're limiting this query to events in the 'emailed events'
@@ -286,7 +307,7 @@ def process_invites(db_session, message, account, invites):
 
     existing_events_table = {event.uid: event for event in existing_events}
 
-    for event in invites:
+    for message, event in invites:
         if event.uid not in existing_events_table:
             # This is some SQLAlchemy trickery -- the events returned
             # by events_from_ics aren't bound to a session yet. Because of
@@ -298,6 +319,9 @@ def process_invites(db_session, message, account, invites):
             # will be flushed to the db.
             event.calendar = account.emailed_events_calendar
             event.message = message
+            # Later updates to the same event in this batch are merged into
+            # this one.
+            existing_events_table[event.uid] = event
         else:
             # This is an event we already have in the db.
             # Let's see if the version we have is older or newer.
@@ -328,29 +352,40 @@ def _cleanup_nylas_uid(uid):
     return uid
 
 
-def process_nylas_rsvps(db_session, message, account, rsvps):
+def process_nylas_rsvps(db_session, account, rsvps):
+    """
+    Merge RSVPs to invites we sent into the corresponding events.
+
+    Parameters
+    ----------
+    rsvps: list
+        (message, event) pairs, in the order the messages were received.
+
+    """
     # The invite sending code generates invites with uids of the form
     # `public_id@nylas.com`. We couldn't use Event.uid for this because
     # it wouldn't work with Exchange (Exchange uids are of the form
     # 1:2323 and aren't guaranteed to be unique).
-    new_uids = [_cleanup_nylas_uid(event.uid) for event in rsvps
+    new_uids = [_cleanup_nylas_uid(event.uid) for _, event in rsvps
                 if '@nylas.com' in event.uid]
 
     # Drop uids which aren't base36 uids.
     new_uids = [uid for uid in new_uids if valid_base36(uid)]
 
-    # Get the list of events which share a uid with those we received.
-    # Note that we're excluding events from "Emailed events" because
-    # we don't want to process RSVPs to invites we received.
-    existing_events = db_session.query(Event).filter(
-        Event.namespace_id == account.namespace.id,
-        Event.calendar_id != account.emailed_events_calendar_id,
-        Event.public_id.in_(new_uids)).all()
+    existing_events_table = {}
+    if new_uids:
+        # Get the list of events which share a uid with those we received.
+        # Note that we're excluding events from "Emailed events" because
+        # we don't want to process RSVPs to invites we received.
+        existing_events = db_session.query(Event).filter(
+            Event.namespace_id == account.namespace.id,
+            Event.calendar_id != account.emailed_events_calendar_id,
+            Event.public_id.in_(new_uids)).all()
 
-    existing_events_table = {event.public_id: event
-                             for event in existing_events}
+        existing_events_table = {event.public_id: event
+                                 for event in existing_events}
 
-    for event in rsvps:
+    for message, event in rsvps:
         event_uid = _cleanup_nylas_uid(event.uid)
         if event_uid not in existing_events_table:
             # We've received an RSVP to an event we never heard about. Save it,
@@ -383,10 +418,54 @@ def process_nylas_rsvps(db_session, message, account, rsvps):
                 db_session.flush()
 
 
-def import_attached_events(db_session, account, message):
-    """Import events from a file into the 'Emailed events' calendar."""
+def _was_imported(db_session, key):
+    """
+    Whether an attachment with the given (account id, data_sha256) key was
+    already imported, either in a committed transaction or earlier in
+    `db_session`'s current one.
 
-    assert account is not None
+    """
+    if key in db_session.info.get('imported_invites', ()):
+        return True
+    if key in _imported_invites:
+        # Mark as recently used.
+        _imported_invites[key] = _imported_invites.pop(key)
+        return True
+    return False
+
+
+def _remember_imported(keys):
+    for key in keys:
+        _imported_invites.pop(key, None)
+        _imported_invites[key] = True
+    while len(_imported_invites) > MAX_IMPORTED_INVITES:
+        _imported_invites.popitem(last=False)
+
+
+def _remember_imported_on_commit(db_session, keys):
+    """
+    Remember the keys of attachments imported in `db_session` once its
+    transaction commits, so that an import which is rolled back is retried
+    when the messages are synced again.
+
+    """
+    pending = db_session.info.get('imported_invites')
+    if pending is None:
+        pending = db_session.info['imported_invites'] = set()
+
+        @sqlalchemy_event.listens_for(db_session, 'after_commit')
+        def after_commit(session):
+            _remember_imported(pending)
+            pending.clear()
+
+        @sqlalchemy_event.listens_for(db_session, 'after_soft_rollback')
+        def after_soft_rollback(session, previous_transaction):
+            pending.clear()
+
+    pending.update(keys)
+
+
+def _should_import(account, message):
     # FIXME @karim - Don't import iCalendar events from messages we've sent.
 
     # This is only a stopgap measure -- what we need to have instead is
@@ -397,54 +476,113 @@ def import_attached_events(db_session, account, message):
             # We got a message without a from address --- this is either
             # a message which hasn't been sent or a bogus message. Don't
             # process it.
-            return
+            return False
 
         from_addr = message.from_addr[0][1]
         if from_addr == account.email_address or from_addr == '':
-            return
+            return False
+    return True
 
-    for part in message.attached_event_files:
-        part_data = ''
-        try:
-            part_data = part.block.data
-            if part_data == '':
-                continue
 
-            new_events = events_from_ics(account.namespace,
-                                         account.emailed_events_calendar,
-                                         part_data)
-        except MalformedEventError:
-            log.error('Attached event parsing error',
-                      account_id=account.id, message_id=message.id,
-                      logstash_tag='icalendar_autoimport',
-                      invite=part.block.data)
-            continue
-        except (AssertionError, TypeError, RuntimeError,
-                AttributeError, ValueError, UnboundLocalError,
-                LookupError, ImportError, NameError):
-            # Kind of ugly but we don't want to derail message
-            # creation because of an error in the attached calendar.
-            log.error('Unhandled exception during message parsing',
-                      message_id=message.id,
-                      invite=part_data,
-                      logstash_tag='icalendar_autoimport',
-                      traceback=traceback.format_exception(
-                                    sys.exc_info()[0],
-                                    sys.exc_info()[1],
-                                    sys.exc_info()[2]))
+def _parse_attached_events(account, message, part):
+    """
+    Parse the events in a text/calendar part, or return None if it can't be
+    parsed.
+
+    """
+    part_data = ''
+    try:
+        part_data = part.block.data
+        if part_data == '':
+            return None
+
+        return events_from_ics(account.namespace,
+                               account.emailed_events_calendar,
+                               part_data)
+    except MalformedEventError:
+        log.error('Attached event parsing error',
+                  account_id=account.id, message_id=message.id,
+                  logstash_tag='icalendar_autoimport',
+                  invite=part.block.data)
+    except (AssertionError, TypeError, RuntimeError,
+            AttributeError, ValueError, UnboundLocalError,
+            LookupError, ImportError, NameError):
+        # Kind of ugly but we don't want to derail message
+        # creation because of an error in the attached calendar.
+        log.error('Unhandled exception during message parsing',
+                  message_id=message.id,
+                  invite=part_data,
+                  logstash_tag='icalendar_autoimport',
+                  traceback=traceback.format_exception(
+                                sys.exc_info()[0],
+                                sys.exc_info()[1],
+                                sys.exc_info()[2]))
+    return None
+
+
+def import_attached_events(db_session, account, message):
+    """Import events from a file into the 'Emailed events' calendar."""
+    import_attached_events_from_messages(db_session, account, [message])
+
+
+def import_attached_events_from_messages(db_session, account, messages):
+    """
+    Import the events attached to a batch of synced messages into the
+    'Emailed events' calendar.
+
+    Invite updates tend to arrive in bursts, so attachments whose contents
+    (by `data_sha256`) were already imported for the account are skipped
+    without fetching or parsing them, and the existing events for all the
+    invites in the batch are looked up at once.
+
+    """
+    assert account is not None
+
+    invites = []
+    rsvps = []
+    imported = set()
+    skipped = 0
+    for message in messages:
+        if not _should_import(account, message):
             continue
 
-        process_invites(db_session, message, account, new_events['invites'])
-
-        # Gmail has a very very annoying feature: it doesn't use email to RSVP
-        # to an invite sent by another gmail account. This makes it impossible
-        # for us to update the event correctly. To work around this we let the
-        # Gmail API handle invite sending. For other providers we process this
-        # ourselves.
-        # - karim
-        if account.provider != 'gmail':
-            process_nylas_rsvps(db_session, message, account,
-                                new_events['rsvps'])
+        for part in message.attached_event_files:
+            data_sha256 = part.block.data_sha256
+            key = (account.id, data_sha256)
+            if data_sha256 is not None and (key in imported or
+                                            _was_imported(db_session, key)):
+                skipped += 1
+                continue
+
+            new_events = _parse_attached_events(account, message, part)
+            if new_events is None:
+                if data_sha256 is not None:
+                    # Parsing has no side effects, so there's no need to
+                    # wait for a commit before skipping the attachment.
+                    _remember_imported([key])
+                continue
+
+            if data_sha256 is not None:
+                imported.add(key)
+            invites.extend((message, event)
+                           for event in new_events['invites'])
+            rsvps.extend((message, event) for event in new_events['rsvps'])
+
+    if skipped:
+        statsd_client.incr('events.ical_import.skipped', skipped)
+
+    process_invites(db_session, account, invites)
+
+    # Gmail has a very very annoying feature: it doesn't use email to RSVP
+    # to an invite sent by another gmail account. This makes it impossible
+    # for us to update the event correctly. To work around this we let the
+    # Gmail API handle invite sending. For other providers we process this
+    # ourselves.
+    # - karim
+    if account.provider != 'gmail':
+        process_nylas_rsvps(db_session, account, rsvps)
+
+    _remember_imported_on_commit(db_session, imported)
 
 
 def generate_icalendar_invite(event, invite_type='request'):
@@ -0,0 +1,229 @@
+"""
+Materialized occurrences of recurring events.
+
+Every instance of a recurring event up to a rolling horizon is stored in the
+eventoccurrence table, so that /events?expand_recurring=true can be answered
+with an indexed range scan (and database-side ordering and pagination)
+instead of expanding the RRULE of every recurring event in the namespace on
+each request.
+
+The same pass keeps the eventinterval table, which the /free-busy endpoint
+scans, up to date: it holds the time span of every non-cancelled event, and
+of every materialized occurrence.
+
+Occurrences of a recurring event are rematerialized whenever the event or one
+of its overrides is flushed, and the interval of other events whenever they
+are (see `update_occurrences`, hooked up in inbox/models/session.py).
+`OccurrenceHorizonService` periodically extends the horizon and backfills
+recurring events that have never been materialized. Until an event has been
+materialized far enough, the API falls back to expanding it on the fly.
+
+"""
+from itertools import chain
+
+import arrow
+from datetime import timedelta
+from gevent import Greenlet, sleep
+from sqlalchemy import or_, asc
+from sqlalchemy.orm.attributes import set_committed_value
+
+from inbox.events.recurring import get_start_times, EXPAND_RECURRING_YEARS
+from inbox.models.event import (Event, RecurringEvent,
+                                RecurringEventOverride, EventOccurrence,
+                                EventInterval, InflatedEvent)
+from inbox.models.session import session_scope
+
+from nylas.logging import get_logger
+log = get_logger()
+
+# Occurrences are materialized this far past the API's default expansion
+# window, so that the horizon only has to be extended occasionally.
+HORIZON_SLACK = timedelta(days=30)
+
+# Bound on the number of rows per recurring event, for rules like
+# FREQ=MINUTELY. Events with more instances are only materialized up to
+# their MAX_OCCURRENCESth instance and expanded on the fly past that.
+MAX_OCCURRENCES = 10000
+
+
+def default_expansion_end(now=None):
+    """ The end of the range recurring events are expanded over when the
+        API request doesn't give one (see events/recurring.py). """
+    now = now or arrow.utcnow()
+    return now.replace(years=+EXPAND_RECURRING_YEARS)
+
+
+def materialization_horizon(now=None):
+    return default_expansion_end(now) + HORIZON_SLACK
+
+
+def materialize_occurrences(db_session, master, until=None):
+    """
+    Replace the stored occurrences of the RecurringEvent `master` with its
+    instances starting up to `until` (default: `materialization_horizon()`)
+    plus its non-cancelled overrides, and their intervals with the ones of
+    the new occurrences (none if the master is cancelled).
+
+    Only issues Core statements, and doesn't mark `master` as modified, so
+    it's safe to call from a flush hook.
+
+    """
+    until = until or materialization_horizon()
+    table = EventOccurrence.__table__
+    db_session.execute(table.delete().where(
+        table.c.master_event_id == master.id))
+    intervals = EventInterval.__table__
+    db_session.execute(intervals.delete().where(
+        intervals.c.event_id == master.id))
+
+    # Same override semantics as RecurringEvent.all_events().
+    overrides = master.overrides.filter(
+        RecurringEventOverride.calendar_id == master.calendar_id).all()
+    overridden_starts = {o.original_start_time for o in overrides}
+
+    start_times = get_start_times(master, end=until)
+    if len(start_times) > MAX_OCCURRENCES:
+        start_times = start_times[:MAX_OCCURRENCES]
+        until = start_times[-1]
+
+    length = master.length
+    rows = [{'namespace_id': master.namespace_id,
+             'master_event_id': master.id,
+             'override_event_id': None,
+             'start': start,
+             'end': start + length}
+            for start in start_times if start not in overridden_starts]
+    rows.extend({'namespace_id': master.namespace_id,
+                 'master_event_id': master.id,
+                 'override_event_id': o.id,
+                 'start': o.start,
+                 'end': o.end}
+                for o in overrides if not o.cancelled)
+    if rows:
+        db_session.execute(table.insert(), rows)
+
+    if master.status != 'cancelled':
+        busy = {o.id: o.busy for o in overrides}
+        interval_rows = [{'calendar_id': master.calendar_id,
+                          'event_id': master.id,
+                          'start': row['start'],
+                          'end': row['end'],
+                          'busy': busy.get(row['override_event_id'],
+                                           master.busy)}
+                         for row in rows]
+        if interval_rows:
+            db_session.execute(intervals.insert(), interval_rows)
+
+    recurringevent = RecurringEvent.__table__
+    db_session.execute(recurringevent.update().
+                       where(recurringevent.c.id == master.id).
+                       values(occurrences_until=until))
+    set_committed_value(master, 'occurrences_until', until)
+    return len(rows)
+
+
+def materialize_interval(db_session, event):
+    """
+    Replace the stored interval of the non-recurring Event `event`. Like
+    `materialize_occurrences`, only issues Core statements.
+
+    """
+    table = EventInterval.__table__
+    db_session.execute(table.delete().where(table.c.event_id == event.id))
+    if event.status != 'cancelled':
+        db_session.execute(table.insert().values(
+            calendar_id=event.calendar_id, event_id=event.id,
+            start=event.start, end=event.end, busy=event.busy))
+
+
+def update_occurrences(session):
+    """
+    Rematerialize the occurrences of recurring events that were created or
+    modified, or whose overrides were, in the flush that just happened, and
+    the intervals of other created or modified events.
+    Must be called post-flush so that new objects have ids.
+
+    Occurrences and intervals of deleted events are removed by the foreign
+    key cascade.
+
+    """
+    changed = chain(
+        (obj for obj in session.new if isinstance(obj, Event)),
+        (obj for obj in session.dirty if isinstance(obj, Event) and
+         session.is_modified(obj)))
+
+    master_ids = set()
+    deleted_master_ids = set()
+    for obj in changed:
+        if isinstance(obj, RecurringEvent):
+            master_ids.add(obj.id)
+        elif isinstance(obj, RecurringEventOverride):
+            master_ids.add(obj.master_event_id)
+        elif obj.id is not None and not isinstance(obj, InflatedEvent):
+            materialize_interval(session, obj)
+    for obj in session.deleted:
+        if isinstance(obj, RecurringEvent):
+            deleted_master_ids.add(obj.id)
+        elif isinstance(obj, RecurringEventOverride):
+            master_ids.add(obj.master_event_id)
+
+    master_ids -= deleted_master_ids
+    master_ids.discard(None)
+    if not master_ids:
+        return
+
+    masters = session.query(RecurringEvent).filter(
+        RecurringEvent.id.in_(master_ids))
+    for master in masters:
+        materialize_occurrences(session, master)
+
+
+class OccurrenceHorizonService(Greenlet):
+    """
+    Keep the materialized occurrences of every recurring event ahead of the
+    API's default expansion window, by periodically rematerializing the
+    events whose horizon is about to be passed or that have never been
+    materialized.
+
+    """
+    def __init__(self, poll_interval=3600, chunk_size=100):
+        self.poll_interval = poll_interval
+        self.chunk_size = chunk_size
+
+        self.log = log.new(component='event-occurrences')
+        Greenlet.__init__(self)
+
+    def _run(self):
+        self.log.info('Starting event occurrence horizon service')
+        while True:
+            self.extend_horizon()
+            sleep(self.poll_interval)
+
+    def extend_horizon(self):
+        # Events are visited in id order, at most once per pass, so that
+        # events that can't be materialized all the way (see
+        # MAX_OCCURRENCES) don't keep the pass from finishing.
+        threshold = default_expansion_end() + HORIZON_SLACK / 2
+        last_id = 0
+        updated = 0
+        while True:
+            with session_scope() as db_session:
+                masters = db_session.query(RecurringEvent).filter(
+                    RecurringEvent.id > last_id,
+                    or_(RecurringEvent.occurrences_until == None,
+                        RecurringEvent.occurrences_until < threshold)). \
+                    order_by(asc(RecurringEvent.id)). \
+                    limit(self.chunk_size).all()
+                if not masters:
+                    break
+
+                until = materialization_horizon()
+                for master in masters:
+                    materialize_occurrences(db_session, master, until)
+                db_session.commit()
+                last_id = masters[-1].id
+                updated += len(masters)
+
+        self.log.info('extended event occurrence horizon',
+                      updated=updated)
+        return updated
@@ -52,13 +52,51 @@ def link_master(db_session, event):
     return event.master  # This may be None.
 
 
-def parse_rrule(event):
-    # Parse the RRULE string and return a dateutil.rrule.rrule object
+def link_event_batch(db_session, events):
+    # Like link_events, for a batch of flushed events: finds the overrides
+    # of all the RecurringEvents and the masters of all the
+    # RecurringEventOverrides with one query each.
+    def key(e, uid):
+        return (e.namespace_id, e.calendar_id, uid, e.source)
+
+    masters = {key(e, e.uid): e for e in events
+               if isinstance(e, RecurringEvent)}
+    if masters:
+        orphans = db_session.query(RecurringEventOverride).filter(
+            RecurringEventOverride.namespace_id.in_(
+                {k[0] for k in masters}),
+            RecurringEventOverride.master_event_uid.in_(
+                {k[2] for k in masters}),
+            RecurringEventOverride.master_event_id == None)
+        for o in orphans:
+            master = masters.get(key(o, o.master_event_uid))
+            if master is not None:
+                o.master = master
+
+    overrides = [e for e in events if isinstance(e, RecurringEventOverride)
+                 and e.master_event_id is None and e.master_event_uid]
+    if overrides:
+        candidates = db_session.query(RecurringEvent).filter(
+            RecurringEvent.namespace_id.in_(
+                {o.namespace_id for o in overrides}),
+            RecurringEvent.uid.in_({o.master_event_uid for o in overrides}))
+        for m in candidates:
+            masters.setdefault(key(m, m.uid), m)
+        for o in overrides:
+            master = masters.get(key(o, o.master_event_uid))
+            if master is not None:
+                o.master = master
+
+
+def parse_rrule(event, dtstart=None):
+    # Parse the RRULE string and return a dateutil.rrule.rrule object.
+    # `dtstart` overrides the event start, e.g. with a localized one.
     if event.rrule is not None:
+        dtstart = dtstart or event.start
         if event.all_day:
-            start = event.start.to('utc').naive
+            start = dtstart.to('utc').naive
         else:
-            start = event.start.datetime
+            start = dtstart.datetime
         try:
             rule = rrulestr(event.rrule, dtstart=start,
                              compatible=True)
@@ -93,9 +131,18 @@ def get_start_times(event, start=None, end=None):
     # otherwise defaults to the event start date and now + 1 year;
     # this can return a lot of instances if the event recurs more frequently
     # than weekly!
+    return list(iter_start_times(event, start, end))
+
+
+def iter_start_times(event, start=None, end=None):
+    # Like get_start_times, but lazily yields the start times in order, so
+    # that callers which only need the first few don't pay for expanding the
+    # whole range.
 
     if isinstance(event, RecurringEvent):
-        # Localize first so that expansion covers DST
+        # Localize first so that expansion covers DST. Don't assign the
+        # localized time back to the event, that would mark it as modified.
+        event_start = event.start
         if event.start_timezone:
             # FIXME @karim: This hotfix was added because of
             # https://phab.nylas.com/T3612. Remove it after
@@ -104,10 +151,10 @@ def get_start_times(event, start=None, end=None):
             if tz in timezones_table:
                 tz = timezones_table[tz]
 
-            event.start = event.start.to(tz)
+            event_start = event_start.to(tz)
 
         if not start:
-            start = event.start
+            start = event_start
         else:
             start = arrow.get(start)
         if not end:
@@ -115,11 +162,12 @@ def get_start_times(event, start=None, end=None):
         else:
             end = arrow.get(end)
 
-        rrules = parse_rrule(event)
+        rrules = parse_rrule(event, event_start)
         if not rrules:
             log.warn('Tried to expand a non-recurring event',
                      event_id=event.id)
-            return [event.start]
+            yield event_start
+            return
 
         excl_dates = parse_exdate(event)
 
@@ -132,22 +180,27 @@ def get_start_times(event, start=None, end=None):
                 excl_dates = map(lambda x: x.naive, excl_dates)
             map(rrules.exdate, excl_dates)
 
-        # Return all start times between start and end, including start and
+        # Yield all start times between start and end, including start and
         # end themselves if they obey the rule.
         if event.all_day:
             # compare naive times, since date handling in rrulestr is naive
             # when UNTIL takes the form YYYYMMDD
             start = start.to('utc').naive
             end = end.to('utc').naive
-
-        start_times = rrules.between(start, end, inc=True)
-
-        # Convert back to UTC, which covers daylight savings differences
-        start_times = [arrow.get(t).to('utc') for t in start_times]
-
-        return start_times
-
-    return [event.start]
+        else:
+            start = start.datetime
+            end = end.datetime
+
+        for t in rrules:
+            if t > end:
+                break
+            if t >= start:
+                # Convert back to UTC, which covers daylight savings
+                # differences
+                yield arrow.get(t).to('utc')
+        return
+
+    yield event.start
 
 
 # rrule constant values
@@ -1,6 +1,6 @@
 from datetime import datetime, timedelta
+from gevent.pool import Pool
 from requests.exceptions import HTTPError
-from sqlalchemy import func
 
 from nylas.logging import get_logger
 logger = get_logger()
@@ -9,22 +9,28 @@ from inbox.basicauth import AccessNotEnabledError, OAuthError
 from inbox.config import config
 from inbox.sync.base_sync import BaseSyncMonitor
 from inbox.models import Event, Calendar
-from inbox.models.event import RecurringEvent, RecurringEventOverride
+from inbox.models.event import RecurringEvent
 from inbox.util.debug import bind_context
+from inbox.util.itert import chunk
 from inbox.models.session import session_scope
 
 from inbox.models.account import Account
 
-from inbox.events.recurring import link_events
+from inbox.events.recurring import link_event_batch
 from inbox.events.google import GoogleEventsProvider
 
 
 EVENT_SYNC_FOLDER_ID = -2
 EVENT_SYNC_FOLDER_NAME = 'Events'
 POLL_FREQUENCY = config.get('CALENDAR_POLL_FREQUENCY', 300)
+# Maximum number of calendars of an account that are synced at once.
+CALENDAR_SYNC_CONCURRENCY = config.get('CALENDAR_SYNC_CONCURRENCY', 4)
 
 MAX_TIME_WITHOUT_SYNC = timedelta(seconds=3600)
 
+# Google returns up to 250 events per page by default.
+EVENT_BATCH_SIZE = 250
+
 
 class EventSync(BaseSyncMonitor):
     """Per-account event sync engine."""
@@ -70,17 +76,22 @@ class EventSync(BaseSyncMonitor):
             # miss remote updates that happen while the poll loop is executing.
             sync_timestamp = datetime.utcnow()
             with session_scope() as db_session:
-                last_sync = db_session.query(Calendar.last_synced).filter(
-                    Calendar.id == id_).scalar()
-
-            event_changes = self.provider.sync_events(
-                uid, sync_from_time=last_sync)
+                last_sync, sync_token = db_session.query(
+                    Calendar.last_synced, Calendar.sync_token).filter(
+                    Calendar.id == id_).one()
 
             with session_scope() as db_session:
-                handle_event_updates(self.namespace_id, id_, event_changes,
-                                     self.log, db_session)
+                next_sync_token = None
+                for event_changes, next_sync_token in \
+                        self.provider.sync_event_pages(
+                            uid, sync_from_time=last_sync,
+                            sync_token=sync_token):
+                    handle_event_updates(self.namespace_id, id_,
+                                         event_changes, self.log, db_session)
                 cal = db_session.query(Calendar).get(id_)
                 cal.last_synced = sync_timestamp
+                if next_sync_token is not None:
+                    cal.sync_token = next_sync_token
                 db_session.commit()
 
 
@@ -131,63 +142,23 @@ def handle_calendar_updates(namespace_id, calendars, log, db_session):
 
 
 def handle_event_updates(namespace_id, calendar_id, events, log, db_session):
-    """Persists new or updated Event objects to the database."""
+    """Persists new or updated Event objects to the database.
+
+    `events` may be any iterable, e.g. a page of API results. It's handled
+    in batches of EVENT_BATCH_SIZE: the existing local events of a batch are
+    loaded with a single query, new ones are added together, the batch is
+    flushed once and then its recurring events and overrides are linked
+    together. Each batch is committed to avoid long transactions that may
+    lock calendar rows.
+    """
     added_count = 0
     updated_count = 0
-    existing_event_count = db_session.query(func.count(Event.id)).filter(
-        Event.namespace_id == namespace_id,
-        Event.calendar_id == calendar_id).scalar()
-    for event in events:
-        assert event.uid is not None, 'Got remote item with null uid'
-
-        local_event = None
-        if existing_event_count:
-            # Skip this lookup if there are no local events at all, for faster
-            # first sync.
-            local_event = db_session.query(Event).filter(
-                Event.namespace_id == namespace_id,
-                Event.calendar_id == calendar_id,
-                Event.uid == event.uid).first()
-
-        if local_event is not None:
-            # We also need to mark all overrides as cancelled if we're
-            # cancelling a recurring event. However, note the original event
-            # may not itself be recurring (recurrence may have been added).
-            if isinstance(local_event, RecurringEvent) and \
-                    event.status == 'cancelled' and \
-                    local_event.status != 'cancelled':
-                    for override in local_event.overrides:
-                        override.status = 'cancelled'
-
-            merged_participants = local_event.\
-                _partial_participants_merge(event)
-
-            local_event.update(event)
-
-            # We have to do this mumbo-jumbo because MutableList does
-            # not register changes to nested elements.
-            local_event.participants = []
-            for participant in merged_participants:
-                local_event.participants.append(participant)
-
-            updated_count += 1
-        else:
-            local_event = event
-            local_event.namespace_id = namespace_id
-            local_event.calendar_id = calendar_id
-            db_session.add(local_event)
-            added_count += 1
-
-        # If we just updated/added a recurring event or override, make sure
-        # we link it to the right master event.
-        if isinstance(event, RecurringEvent) or \
-                isinstance(event, RecurringEventOverride):
-            db_session.flush()
-            link_events(db_session, event)
-
-        # Batch commits to avoid long transactions that may lock calendar rows.
-        if (added_count + updated_count) % 1000 == 0:
-            db_session.commit()
+    for batch in chunk(events, EVENT_BATCH_SIZE):
+        added, updated = _handle_event_batch(namespace_id, calendar_id,
+                                             batch, db_session)
+        db_session.commit()
+        added_count += added
+        updated_count += updated
 
     log.info('synced added and updated events',
              calendar_id=calendar_id,
@@ -195,6 +166,63 @@ def handle_event_updates(namespace_id, calendar_id, events, log, db_session):
              updated=updated_count)
 
 
+def _handle_event_batch(namespace_id, calendar_id, events, db_session):
+    added_count = 0
+    updated_count = 0
+    uids = set()
+    for event in events:
+        assert event.uid is not None, 'Got remote item with null uid'
+        uids.add(event.uid)
+
+    local_events = {e.uid: e for e in db_session.query(Event).filter(
+        Event.namespace_id == namespace_id,
+        Event.calendar_id == calendar_id,
+        Event.uid.in_(uids))}
+
+    new_events = []
+    with db_session.no_autoflush:
+        for event in events:
+            local_event = local_events.get(event.uid)
+            if local_event is not None:
+                # We also need to mark all overrides as cancelled if we're
+                # cancelling a recurring event. However, note the original
+                # event may not itself be recurring (recurrence may have been
+                # added).
+                if isinstance(local_event, RecurringEvent) and \
+                        event.status == 'cancelled' and \
+                        local_event.status != 'cancelled':
+                        for override in local_event.overrides:
+                            override.status = 'cancelled'
+
+                merged_participants = local_event.\
+                    _partial_participants_merge(event)
+
+                local_event.update(event)
+
+                # We have to do this mumbo-jumbo because MutableList does
+                # not register changes to nested elements.
+                local_event.participants = []
+                for participant in merged_participants:
+                    local_event.participants.append(participant)
+
+                updated_count += 1
+            else:
+                local_event = event
+                local_event.namespace_id = namespace_id
+                local_event.calendar_id = calendar_id
+                local_events[event.uid] = local_event
+                new_events.append(local_event)
+                added_count += 1
+
+    db_session.add_all(new_events)
+    db_session.flush()
+
+    # If we just updated/added recurring events or overrides, make sure
+    # we link them to the right master events.
+    link_event_batch(db_session, local_events.values())
+    return added_count, updated_count
+
+
 class GoogleEventSync(EventSync):
 
     def sync(self):
@@ -266,23 +294,40 @@ class GoogleEventSync(EventSync):
             if account.should_update_calendars(MAX_TIME_WITHOUT_SYNC):
                 self._sync_calendar_list(account, db_session)
 
-            stale_calendars = (
-                cal for cal in account.namespace.calendars
+            stale_calendar_ids = [
+                cal.id for cal in account.namespace.calendars
                 if cal.should_update_events(MAX_TIME_WITHOUT_SYNC)
-            )
-            for cal in stale_calendars:
-                try:
-                    self._sync_calendar(cal, db_session)
-                except HTTPError as exc:
-                    if exc.response.status_code == 404:
-                        self.log.warning(
-                            'Tried to sync a deleted calendar.'
-                            'Deleting local calendar.',
-                            calendar_id=cal.id,
-                            calendar_uid=cal.uid)
-                        db_session.delete(cal)
-                    else:
-                        raise exc
+            ]
+
+        # Sync calendars concurrently so that one slow calendar doesn't hold
+        # up the others. The provider is shared, so if one of them gets
+        # rate-limited the others back off too.
+        pool = Pool(CALENDAR_SYNC_CONCURRENCY)
+        greenlets = [pool.spawn(self._sync_calendar_by_id, calendar_id)
+                     for calendar_id in stale_calendar_ids]
+        pool.join()
+        for greenlet in greenlets:
+            # Re-raise the first error, if any.
+            greenlet.get()
+
+    def _sync_calendar_by_id(self, calendar_id):
+        with session_scope() as db_session:
+            cal = db_session.query(Calendar).get(calendar_id)
+            if cal is None:
+                return
+            try:
+                self._sync_calendar(cal, db_session)
+            except HTTPError as exc:
+                if exc.response.status_code == 404:
+                    self.log.warning(
+                        'Tried to sync a deleted calendar.'
+                        'Deleting local calendar.',
+                        calendar_id=cal.id,
+                        calendar_uid=cal.uid)
+                    db_session.delete(cal)
+                    db_session.commit()
+                else:
+                    raise exc
 
     def _sync_calendar_list(self, account, db_session):
         sync_timestamp = datetime.utcnow()
@@ -300,10 +345,15 @@ class GoogleEventSync(EventSync):
 
     def _sync_calendar(self, calendar, db_session):
         sync_timestamp = datetime.utcnow()
-        event_changes = self.provider.sync_events(
-            calendar.uid, sync_from_time=calendar.last_synced)
-
-        handle_event_updates(self.namespace_id, calendar.id,
-                             event_changes, self.log, db_session)
+        next_sync_token = None
+        for event_changes, next_sync_token in self.provider.sync_event_pages(
+                calendar.uid, sync_from_time=calendar.last_synced,
+                sync_token=calendar.sync_token):
+            handle_event_updates(self.namespace_id, calendar.id,
+                                 event_changes, self.log, db_session)
         calendar.last_synced = sync_timestamp
+        # Only store the token once every page has been persisted, so an
+        # interrupted sync is retried from the previous token.
+        if next_sync_token is not None:
+            calendar.sync_token = next_sync_token
         db_session.commit()
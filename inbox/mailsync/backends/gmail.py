@@ -29,6 +29,8 @@ from inbox.util.itert import chunk
 from inbox.util.debug import bind_context
 
 from nylas.logging import get_logger
+from inbox.contacts.process_mail import (update_contacts_from_messages,
+                                         get_contact_cache)
 from inbox.models import Message, Folder, Namespace, Account, Label, Category
 from inbox.models.backends.imap import ImapFolderInfo, ImapUid, ImapThread
 from inbox.models.session import session_scope
@@ -320,13 +322,22 @@ class GmailFolderSyncEngine(FolderSyncEngine):
                 if not raw_messages:
                     return 0
 
+                event_messages = []
                 for msg in raw_messages:
                     uid = self.create_message(db_session, account, folder,
                                               msg)
                     if uid is not None:
                         db_session.add(uid)
-                        db_session.commit()
+                        db_session.flush()
                         new_uids.add(uid)
+                        if uid.message.has_attached_events:
+                            event_messages.append(uid.message)
+                self.import_attached_events(db_session, account,
+                                            event_messages)
+                update_contacts_from_messages(
+                    db_session, [new_uid.message for new_uid in new_uids],
+                    account.namespace, get_contact_cache(self.namespace_id))
+                db_session.commit()
 
         log.info('Committed new UIDs',
                  new_committed_message_count=len(new_uids))
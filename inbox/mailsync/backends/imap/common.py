@@ -17,7 +17,6 @@ from sqlalchemy import bindparam, desc
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.sql.expression import func
 
-from inbox.contacts.process_mail import update_contacts_from_message
 from inbox.models import Account, Message, Folder, ActionLog
 from inbox.models.backends.imap import ImapUid, ImapFolderInfo
 from inbox.models.util import reconcile_message
@@ -170,6 +169,10 @@ def create_imap_message(db_session, account, folder, msg):
         New db object, which links to new Message and Block objects through
         relationships. All new objects are uncommitted.
 
+    Contacts are not created here; callers process a whole batch of
+    messages at once with
+    inbox.contacts.process_mail.update_contacts_from_messages.
+
     """
     new_message = Message.create_from_synced(account=account, mid=msg.uid,
                                              folder_name=folder.name,
@@ -193,8 +196,6 @@ def create_imap_message(db_session, account, folder, msg):
         update_message_metadata(db_session, account, new_message,
                                 imapuid.is_draft)
 
-    update_contacts_from_message(db_session, new_message, account.namespace)
-
     return imapuid
 
 
@@ -207,13 +208,20 @@ def _update_categories(db_session, message, synced_categories):
     now = datetime.utcnow()
 
     # We make the simplifying assumption that only the latest syncback action
-    # matters, since it reflects the current local state.
+    # matters, since it reflects the current local state. The message's own
+    # action and the bulk actions covering it are logged separately, so
+    # check the latest of the former and, if it's newer, of the latter.
     actionlog_id = db_session.query(func.max(ActionLog.id)).filter(
         ActionLog.namespace_id == message.namespace_id,
         ActionLog.table_name == 'message',
         ActionLog.record_id == message.id,
         ActionLog.action.in_(['change_labels', 'move'])).scalar()
-    actionlog = db_session.query(ActionLog).get(actionlog_id)
+    actionlogs = []
+    if actionlog_id is not None:
+        actionlogs.append(db_session.query(ActionLog).get(actionlog_id))
+    bulk_actionlog = _latest_bulk_action(db_session, message, actionlog_id)
+    if bulk_actionlog is not None:
+        actionlogs.append(bulk_actionlog)
 
     # We completed the syncback action /long enough ago/ (on average and
     # with an error margin) that:
@@ -224,10 +232,32 @@ def _update_categories(db_session, message, synced_categories):
     # TODO[k]/(emfree): Implement proper rollback of local state in this case.
     # This is needed in order to pick up future changes to the message,
     # the local_changes counter is reset as well.
-    if actionlog.status in ('successful', 'failed') and \
-            (now - actionlog.updated_at).seconds >= 90:
+    if all(actionlog.status in ('successful', 'failed') and
+           (now - actionlog.updated_at).seconds >= 90
+           for actionlog in actionlogs):
         message.categories = synced_categories
         message.categories_changes = False
 
     # Do /not/ overwrite message.categories in case of a recent local change -
     # namely, a still 'pending' action or one that completed recently.
+
+
+def _latest_bulk_action(db_session, message, after_id=None):
+    """
+    Return the latest bulk label change or move that covers `message` and is
+    newer than the action log entry with id `after_id`, if there's one.
+
+    """
+    query = db_session.query(ActionLog).filter(
+        ActionLog.namespace_id == message.namespace_id,
+        ActionLog.table_name == 'message',
+        ActionLog.action.in_(['bulk_change_labels', 'bulk_move']),
+        ActionLog.record_id <= message.id,
+        ActionLog.last_record_id >= message.id)
+    if after_id is not None:
+        query = query.filter(ActionLog.id > after_id)
+    # The id range of an entry may include messages it doesn't cover.
+    for actionlog in query.order_by(desc(ActionLog.id)):
+        if message.id in actionlog.extra_args['record_ids']:
+            return actionlog
+    return None
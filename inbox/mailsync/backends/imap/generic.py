@@ -78,6 +78,8 @@ from inbox.util.threading import fetch_corresponding_thread, MAX_THREAD_LENGTH
 from inbox.util.stats import statsd_client
 from nylas.logging import get_logger
 log = get_logger()
+from inbox.contacts.process_mail import (update_contacts_from_messages,
+                                         get_contact_cache)
 from inbox.crispin import connection_pool, retry_crispin, FolderMissingError
 from inbox.models import Folder, Account, Message
 from inbox.models.backends.imap import (ImapFolderSyncStatus, ImapThread,
@@ -87,7 +89,7 @@ from inbox.mailsync.exc import UidInvalid
 from inbox.mailsync.backends.imap import common
 from inbox.mailsync.backends.base import MailsyncDone, THROTTLE_WAIT
 from inbox.heartbeat.store import HeartbeatStatusProxy
-from inbox.events.ical import import_attached_events
+from inbox.events.ical import import_attached_events_from_messages
 
 
 # Idle doesn't necessarily pick up flag changes, so we don't want to
@@ -430,14 +432,6 @@ class FolderSyncEngine(Greenlet):
 
         db_session.flush()
 
-        # We're calling import_attached_events here instead of some more
-        # obvious place (like Message.create_from_synced) because the function
-        # requires new_uid.message to have been flushed.
-        # This is necessary because the import_attached_events does db lookups.
-        if new_uid.message.has_attached_events:
-            with db_session.no_autoflush:
-                import_attached_events(db_session, acct, new_uid.message)
-
         # If we're in the polling state, then we want to report the metric
         # for latency when the message was received vs created
         if self.state == 'poll':
@@ -454,6 +448,17 @@ class FolderSyncEngine(Greenlet):
 
         return new_uid
 
+    def import_attached_events(self, db_session, acct, messages):
+        # We're importing attached events here instead of some more obvious
+        # place (like Message.create_from_synced) because the messages must
+        # have been flushed, as the import does db lookups. Importing the
+        # whole batch at once lets it look up the events for all the
+        # invites in one query.
+        if not messages:
+            return
+        with db_session.no_autoflush:
+            import_attached_events_from_messages(db_session, acct, messages)
+
     def _count_thread_messages(self, thread_id, db_session):
         count, = db_session.query(func.count(Message.id)). \
             filter(Message.thread_id == thread_id).one()
@@ -494,6 +499,7 @@ class FolderSyncEngine(Greenlet):
             with session_scope() as db_session:
                 account = Account.get(self.account_id, db_session)
                 folder = Folder.get(self.folder_id, db_session)
+                event_messages = []
                 for msg in raw_messages:
                     uid = self.create_message(db_session, account,
                                               folder, msg)
@@ -501,6 +507,13 @@ class FolderSyncEngine(Greenlet):
                         db_session.add(uid)
                         db_session.flush()
                         new_uids.add(uid)
+                        if uid.message.has_attached_events:
+                            event_messages.append(uid.message)
+                self.import_attached_events(db_session, account,
+                                            event_messages)
+                update_contacts_from_messages(
+                    db_session, [new_uid.message for new_uid in new_uids],
+                    account.namespace, get_contact_cache(self.namespace_id))
                 db_session.commit()
 
         log.info('Committed new UIDs',
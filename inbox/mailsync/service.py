@@ -6,10 +6,12 @@ from setproctitle import setproctitle
 from inbox.providers import providers
 from inbox.config import config
 from inbox.contacts.remote_sync import ContactSync
+from inbox.contacts.process_mail import invalidate_contact_cache
 from inbox.events.remote_sync import EventSync, GoogleEventSync
 from nylas.logging import get_logger
 from inbox.models.session import session_scope
 from inbox.models import Account
+from inbox.util.blob_upload import get_blob_spool
 from inbox.util.concurrency import retry_with_logging
 from inbox.util.rdb import break_to_interpreter
 
@@ -67,6 +69,12 @@ class SyncService(object):
             gevent.spawn(break_to_interpreter, port=port)
 
         setproctitle('inbox-sync-{}'.format(self.cpu_id))
+
+        blob_spool = get_blob_spool()
+        if blob_spool is not None:
+            # Upload what previous processes left in the spool.
+            blob_spool.start()
+
         retry_with_logging(self._run_impl, self.log)
 
     def stop(self):
@@ -223,6 +231,10 @@ class SyncService(object):
         # Update the state in the database (if necessary)
         with session_scope() as db_session:
             acc = db_session.query(Account).get(account_id)
+            if acc is not None:
+                # The account may be deleted or moved to another sync host
+                # after this; don't hold on to its contacts.
+                invalidate_contact_cache(acc.namespace.id)
             if acc is None:
                 self.log.error('No such account', account_id=account_id)
             elif acc.sync_host is None:
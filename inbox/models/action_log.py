@@ -6,6 +6,8 @@ from inbox.sqlalchemy_ext.util import JSON
 from inbox.models.base import MailSyncBase
 from inbox.models.namespace import Namespace
 
+MAX_BULK_ACTION_RECORDS = 1000
+
 
 def schedule_action(func_name, record, namespace_id, db_session, **kwargs):
     # Ensure that the record's id is non-null
@@ -26,6 +28,35 @@ def schedule_action(func_name, record, namespace_id, db_session, **kwargs):
     db_session.add(log_entry)
 
 
+def schedule_bulk_action(func_name, table_name, record_ids, namespace_id,
+                         db_session, **kwargs):
+    """
+    Schedule the same action on many records of a table with a few compact
+    log entries: each covers up to MAX_BULK_ACTION_RECORDS records, whose ids
+    are passed to the action as the `record_ids` extra argument. The entries'
+    `record_id` and `last_record_id` are the lowest and highest of these ids,
+    so that the entries covering a record can be looked up by id range.
+
+    """
+    account = db_session.query(Namespace).get(namespace_id).account
+
+    if account.sync_state == 'invalid':
+        raise ActionError()
+
+    record_ids = sorted(record_ids)
+    for i in range(0, len(record_ids), MAX_BULK_ACTION_RECORDS):
+        chunk = record_ids[i:i + MAX_BULK_ACTION_RECORDS]
+        extra_args = dict(kwargs, record_ids=chunk)
+        log_entry = account.actionlog_cls.create(
+            action=func_name,
+            table_name=table_name,
+            record_id=chunk[0],
+            namespace_id=namespace_id,
+            extra_args=extra_args)
+        log_entry.last_record_id = chunk[-1]
+        db_session.add(log_entry)
+
+
 class ActionLog(MailSyncBase):
     namespace_id = Column(ForeignKey(Namespace.id, ondelete='CASCADE'),
                           nullable=False,
@@ -34,6 +65,8 @@ class ActionLog(MailSyncBase):
 
     action = Column(Text(40), nullable=False)
     record_id = Column(Integer, nullable=False)
+    # Only set for bulk actions: the highest of their records' ids.
+    last_record_id = Column(Integer, nullable=True)
     table_name = Column(Text(40), nullable=False)
     status = Column(Enum('pending', 'successful', 'failed'),
                     server_default='pending')
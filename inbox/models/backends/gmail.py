@@ -1,4 +1,4 @@
-from collections import defaultdict, namedtuple
+from collections import namedtuple
 from datetime import datetime, timedelta
 from random import shuffle
 
@@ -13,6 +13,8 @@ from inbox.models.backends.imap import ImapAccount
 from inbox.models.backends.oauth import OAuthAccount
 from inbox.models.base import MailSyncBase
 from inbox.models.secret import Secret
+from inbox.util.token_cache import (get_token_cache, token_key,
+                                    to_timestamp, from_timestamp)
 
 from nylas.logging import get_logger
 log = get_logger()
@@ -38,31 +40,39 @@ class GTokenManager(object):
     Necessary because google access tokens are only valid for certain
     scopes.
     Based off of TokenManager in inbox/backends/oauth.py
-    """
-    def __init__(self):
-        self._tokens = defaultdict(dict)
 
-    def _get_token(self, account, scope, force_refresh=False):
-        if not force_refresh:
+    Tokens are shared between processes through the token cache (see
+    inbox/util/token_cache.py), keyed by account and scope. A cached token is
+    only used while the GmailAuthCredentials it was issued for are valid.
+    """
+    def _get_token(self, account, scope, force_refresh=False,
+                   client_ids=None):
+        def accept(cached):
+            if client_ids is not None and cached['client_id'] not in \
+                    client_ids:
+                return False
+            return cached['auth_creds_id'] in \
+                {creds.id for creds in account.valid_auth_credentials}
+
+        def refresh():
+            # If we find invalid GmailAuthCredentials while trying to
+            # get a new token, we mark them as invalid. We want to make
+            # sure we commit those changes to the database before we
+            # actually throw an error.
             try:
-                gtoken = self._tokens[account.id][scope]
-                if datetime.utcnow() < gtoken.expiration:
-                    return gtoken
-            except KeyError:
-                pass
-
-        # If we find invalid GmailAuthCredentials while trying to
-        # get a new token, we mark them as invalid. We want to make
-        # sure we commit those changes to the database before we
-        # actually throw an error.
-        try:
-            gtoken = account.new_token(scope)
-        except (ConnectionError, OAuthError):
-            object_session(account).commit()
-            raise
+                gtoken = account.new_token(scope, client_ids=client_ids)
+            except (ConnectionError, OAuthError):
+                object_session(account).commit()
+                raise
 
-        self.cache_token(account, gtoken)
-        return gtoken
+            # Cache the token for the credentials' other scopes too.
+            self.cache_token(account, gtoken)
+            return _serialize_gtoken(gtoken), gtoken.expiration
+
+        cached = get_token_cache().get(token_key(account.id, scope), refresh,
+                                       force_refresh=force_refresh,
+                                       accept=accept)
+        return _deserialize_gtoken(cached)
 
     def get_token(self, account, scope, force_refresh=False):
         gtoken = self._get_token(account, scope, force_refresh=force_refresh)
@@ -88,11 +98,15 @@ class GTokenManager(object):
                 account, GOOGLE_CONTACTS_SCOPE, force_refresh)
 
     def cache_token(self, account, gtoken):
+        token_cache = get_token_cache()
         for scope in gtoken.scopes:
-            self._tokens[account.id][scope] = gtoken
+            token_cache.set(token_key(account.id, scope),
+                            _serialize_gtoken(gtoken), gtoken.expiration)
 
     def clear_cache(self, account):
-        self._tokens[account.id] = {}
+        get_token_cache().delete(*[token_key(account.id, scope) for scope in
+                                   (GOOGLE_EMAIL_SCOPE, GOOGLE_CALENDAR_SCOPE,
+                                    GOOGLE_CONTACTS_SCOPE)])
 
     def get_token_for_calendars_restrict_ids(self, account, client_ids,
                                              force_refresh=False):
@@ -100,25 +114,24 @@ class GTokenManager(object):
         For the given account, returns an access token that's associated
         with a client id from the given list of client_ids.
         '''
-        scope = GOOGLE_CALENDAR_SCOPE
-        if not force_refresh:
-            try:
-                gtoken = self._tokens[account.id][scope]
-                if gtoken.client_id in client_ids:
-                    return gtoken.value
-            except KeyError:
-                pass
+        gtoken = self._get_token(account, GOOGLE_CALENDAR_SCOPE,
+                                 force_refresh=force_refresh,
+                                 client_ids=client_ids)
+        return gtoken.value
 
-        # Need to get access token for specific client_id/client_secret pair
-        try:
-            gtoken = account.new_token(
-                    scope, client_ids=client_ids)
-        except (ConnectionError, OAuthError):
-            object_session(account).commit()
-            raise
 
-        self.cache_token(account, gtoken)
-        return gtoken.value
+def _serialize_gtoken(gtoken):
+    return {'value': gtoken.value,
+            'expiration': to_timestamp(gtoken.expiration),
+            'scopes': gtoken.scopes,
+            'client_id': gtoken.client_id,
+            'auth_creds_id': gtoken.auth_creds_id}
+
+
+def _deserialize_gtoken(cached):
+    return GToken(cached['value'], from_timestamp(cached['expiration']),
+                  cached['scopes'], cached['client_id'],
+                  cached['auth_creds_id'])
 
 
 g_token_manager = GTokenManager()
@@ -9,28 +9,32 @@ from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declared_attr
 
 from inbox.models.secret import Secret
+from inbox.util.token_cache import get_token_cache, token_key
 from nylas.logging import get_logger
 log = get_logger()
 
 
 class TokenManager(object):
-    def __init__(self):
-        self._tokens = {}
+    """
+    Access tokens of OAuth accounts, shared between processes through the
+    token cache (see inbox/util/token_cache.py).
 
+    """
     def get_token(self, account, force_refresh=False):
-        if account.id in self._tokens:
-            token, expiration = self._tokens[account.id]
-            if not force_refresh and expiration > datetime.utcnow():
-                return token
+        def refresh():
+            new_token, expires_in = account.new_token()
+            return new_token, self._expiration(expires_in)
 
-        new_token, expires_in = account.new_token()
-        self.cache_token(account, new_token, expires_in)
-        return new_token
+        return get_token_cache().get(token_key(account.id), refresh,
+                                     force_refresh=force_refresh)
 
     def cache_token(self, account, token, expires_in):
+        get_token_cache().set(token_key(account.id), token,
+                              self._expiration(expires_in))
+
+    def _expiration(self, expires_in):
         expires_in -= 10
-        expiration = datetime.utcnow() + timedelta(seconds=expires_in)
-        self._tokens[account.id] = token, expiration
+        return datetime.utcnow() + timedelta(seconds=expires_in)
 
 
 token_manager = TokenManager()
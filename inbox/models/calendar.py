@@ -30,6 +30,9 @@ class Calendar(MailSyncBase, HasPublicID, HasRevisions):
     read_only = Column(Boolean, nullable=False, default=False)
 
     last_synced = Column(DateTime, nullable=True)
+    # Google's nextSyncToken from the last complete event sync; passed back
+    # on the next sync to fetch only the events changed since.
+    sync_token = Column(String(255), nullable=True)
 
     gpush_last_ping = Column(DateTime)
     gpush_expiration = Column(DateTime)
@@ -0,0 +1,53 @@
+from sqlalchemy import Column, String, ForeignKey, Index
+from sqlalchemy.orm import relationship, backref
+from sqlalchemy.schema import UniqueConstraint
+
+from inbox.models.base import MailSyncBase
+from inbox.models.account import Account
+
+
+class CardDavAddressBook(MailSyncBase):
+    """
+    CardDAV sync state of an account's address book: the discovered principal
+    and address book home URLs, so they don't have to be looked up on every
+    sync, and the WebDAV Sync (RFC 6578) token of the last completed sync.
+
+    """
+    account_id = Column(ForeignKey(Account.id, ondelete='CASCADE'),
+                        nullable=False)
+    account = relationship(
+        Account,
+        backref=backref('carddav_address_book', uselist=False,
+                        cascade='all, delete-orphan'))
+
+    principal_url = Column(String(255), nullable=True)
+    home_url = Column(String(255), nullable=True)
+    sync_token = Column(String(255), nullable=True)
+
+    __table_args__ = (UniqueConstraint('account_id'),)
+
+
+class CardDavCard(MailSyncBase):
+    """
+    A member of a CardDAV address book: the ETag of the version of the card
+    that was last synced, used to skip fetching unchanged cards, and the UID
+    of the contact it was synced into, used to process remote deletions
+    (which only give the card's href).
+
+    """
+    address_book_id = Column(ForeignKey(CardDavAddressBook.id,
+                                        ondelete='CASCADE'),
+                             nullable=False)
+    address_book = relationship(
+        CardDavAddressBook,
+        backref=backref('cards', lazy='dynamic',
+                        cascade='all, delete-orphan'))
+
+    href = Column(String(255), nullable=False)
+    etag = Column(String(255), nullable=True)
+    # Null for cards that aren't synced as contacts (e.g. groups).
+    uid = Column(String(64), nullable=True)
+
+    __table_args__ = (Index('ix_carddavcard_address_book_id_href',
+                            'address_book_id', 'href',
+                            mysql_length={'href': 191}),)
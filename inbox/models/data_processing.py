@@ -1,10 +1,11 @@
-from sqlalchemy import Column, ForeignKey
+from sqlalchemy import Column, ForeignKey, Integer
 from sqlalchemy.schema import UniqueConstraint
 from sqlalchemy.dialects.mysql import MEDIUMBLOB
 from sqlalchemy import DateTime
 
 from inbox.models.base import MailSyncBase
 from inbox.models.namespace import Namespace
+from inbox.models.transaction import Transaction
 
 import datetime
 import json
@@ -18,8 +19,12 @@ class DataProcessingCache(MailSyncBase):
                           nullable=False)
     _contact_rankings = Column('contact_rankings', MEDIUMBLOB)
     _contact_groups = Column('contact_groups', MEDIUMBLOB)
+    _contact_group_molecules = Column('contact_group_molecules', MEDIUMBLOB)
     contact_rankings_last_updated = Column(DateTime)
     contact_groups_last_updated = Column(DateTime)
+    # Ids of the sent messages included in the accumulated rankings and
+    # group molecules.
+    _processed_message_ids = Column('processed_message_ids', MEDIUMBLOB)
 
     @property
     def contact_rankings(self):
@@ -46,4 +51,39 @@ class DataProcessingCache(MailSyncBase):
         self._contact_groups = zlib.compress(json.dumps(value).encode('utf-8'))
         self.contact_groups_last_updated = datetime.datetime.now()
 
+    @property
+    def contact_group_molecules(self):
+        if self._contact_group_molecules is None:
+            return None
+        else:
+            return json.loads(zlib.decompress(self._contact_group_molecules))
+
+    @contact_group_molecules.setter
+    def contact_group_molecules(self, value):
+        self._contact_group_molecules = \
+            zlib.compress(json.dumps(value).encode('utf-8'))
+
+    @property
+    def processed_message_ids(self):
+        if self._processed_message_ids is None:
+            return set()
+        else:
+            return set(json.loads(zlib.decompress(
+                self._processed_message_ids)))
+
+    @processed_message_ids.setter
+    def processed_message_ids(self, value):
+        self._processed_message_ids = \
+            zlib.compress(json.dumps(sorted(value)).encode('utf-8'))
+
     __table_args__ = (UniqueConstraint('namespace_id'),)
+
+
+class DataProcessingCursor(MailSyncBase):
+    """
+    Store the id of the last Transaction processed by the
+    DataProcessingService. Is namespace-agnostic.
+
+    """
+    transaction_id = Column(Integer, ForeignKey(Transaction.id),
+                            nullable=True, index=True)
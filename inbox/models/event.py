@@ -18,6 +18,7 @@ from inbox.models.namespace import Namespace
 from inbox.models.message import Message
 from inbox.models.when import Time, TimeSpan, Date, DateSpan
 from inbox.events.util import parse_rrule_datetime
+from inbox.util.itert import merge_sorted
 
 from nylas.logging import get_logger
 log = get_logger()
@@ -340,6 +341,9 @@ class RecurringEvent(Event):
     exdate = Column(Text)  # There can be a lot of exception dates
     until = Column(FlexibleDateTime, nullable=True)
     start_timezone = Column(String(35))
+    # Occurrences starting up to this time have been materialized into
+    # the eventoccurrence table (see inbox/events/occurrences.py).
+    occurrences_until = Column(FlexibleDateTime, nullable=True)
 
     override_uids = association_proxy('overrides', 'uid')
 
@@ -365,9 +369,13 @@ class RecurringEvent(Event):
     def inflate(self, start=None, end=None):
         # Convert a RecurringEvent into a series of InflatedEvents
         # by expanding its RRULE into a series of start times.
-        from inbox.events.recurring import get_start_times
-        occurrences = get_start_times(self, start, end)
-        return [InflatedEvent(self, o) for o in occurrences]
+        return list(self.iter_inflated(start, end))
+
+    def iter_inflated(self, start=None, end=None):
+        # Like inflate, but lazily, in start order.
+        from inbox.events.recurring import iter_start_times
+        for o in iter_start_times(self, start, end):
+            yield InflatedEvent(self, o)
 
     def unwrap_rrule(self):
         # Unwraps the RRULE list of strings into RecurringEvent properties.
@@ -384,6 +392,11 @@ class RecurringEvent(Event):
     def all_events(self, start=None, end=None):
         # Returns all inflated events along with overrides that match the
         # provided time range.
+        return list(self.iter_events(start, end))
+
+    def iter_events(self, start=None, end=None):
+        # Like all_events, but lazily, in start order: occurrences are only
+        # inflated as far as the caller consumes them.
         overrides = self.overrides
         if start:
             overrides = overrides.filter(RecurringEventOverride.start > start)
@@ -398,18 +411,19 @@ class RecurringEvent(Event):
         overrides = overrides.filter(
                 RecurringEventOverride.calendar_id == self.calendar_id)
 
-        events = list(overrides)
-        overridden_starts = [e.original_start_time for e in events]
+        overrides = sorted(overrides, key=lambda e: e.start)
+        overridden_starts = {e.original_start_time for e in overrides}
         # Remove cancellations from the override set
-        events = filter(lambda e: not e.cancelled, events)
+        overrides = [e for e in overrides if not e.cancelled]
         # If an override has not changed the start time for an event, including
         # if the override is a cancellation, the RRULE doesn't include an
         # exception for it. Filter out unnecessary inflated events
         # to cover this case by checking the start time.
-        for e in self.inflate(start, end):
-            if e.start not in overridden_starts:
-                events.append(e)
-        return sorted(events, key=lambda e: e.start)
+        inflated = (e for e in self.iter_inflated(start, end)
+                    if e.start not in overridden_starts)
+        for e in merge_sorted([overrides, inflated],
+                              key=lambda e: e.start):
+            yield e
 
     def update(self, event):
         super(RecurringEvent, self).update(event)
@@ -446,6 +460,47 @@ class RecurringEventOverride(Event):
         self.recurrence = None  # These single instances don't recur
 
 
+class EventOccurrence(MailSyncBase):
+    """ A materialized instance of a RecurringEvent, so that expanding
+        recurring events for a time range is an indexed range scan rather
+        than an RRULE expansion of every recurring event in the namespace.
+        Instances replaced by an override point to it; cancelled instances
+        don't have a row.
+        Maintained by inbox/events/occurrences.py.
+    """
+    namespace_id = Column(ForeignKey(Namespace.id, ondelete='CASCADE'),
+                          nullable=False)
+    master_event_id = Column(ForeignKey('event.id', ondelete='CASCADE'),
+                             nullable=False)
+    override_event_id = Column(ForeignKey('event.id', ondelete='CASCADE'),
+                               nullable=True)
+    start = Column(FlexibleDateTime, nullable=False)
+    end = Column(FlexibleDateTime, nullable=False)
+
+    __table_args__ = (Index('ix_eventoccurrence_namespace_id_start',
+                            'namespace_id', 'start'),
+                      Index('ix_eventoccurrence_master_event_id_start',
+                            'master_event_id', 'start'))
+
+
+class EventInterval(MailSyncBase):
+    """ The time span of a non-cancelled event, or of a materialized instance
+        of a recurring event (with `event_id` pointing to the master), so that
+        free/busy queries over a set of calendars are an indexed range scan.
+        Maintained by inbox/events/occurrences.py.
+    """
+    calendar_id = Column(ForeignKey(Calendar.id, ondelete='CASCADE'),
+                         nullable=False)
+    event_id = Column(ForeignKey('event.id', ondelete='CASCADE'),
+                      nullable=False, index=True)
+    start = Column(FlexibleDateTime, nullable=False)
+    end = Column(FlexibleDateTime, nullable=False)
+    busy = Column(Boolean, nullable=False)
+
+    __table_args__ = (Index('ix_eventinterval_calendar_id_end_start',
+                            'calendar_id', 'end', 'start'),)
+
+
 class InflatedEvent(Event):
     """ This represents an individual instance of a recurring event, generated
         on the fly when a recurring event is expanded.
@@ -1,15 +1,21 @@
 import os
+import shutil
 from hashlib import sha256
 
 from sqlalchemy import Column, Integer, String
 
 from inbox.config import config
+from inbox.util.blob_upload import get_blob_spool
 from nylas.logging import get_logger
 log = get_logger()
 
 # TODO: store AWS credentials in a better way.
 STORE_MSG_ON_S3 = config.get('STORE_MESSAGES_ON_S3', None)
 
+# Default size of the chunks data is read and written in by `iter_data` and
+# `set_data_from_file`.
+DATA_CHUNK_SIZE = 256 * 1024
+
 if STORE_MSG_ON_S3:
     from boto.s3.connection import S3Connection
     from boto.s3.key import Key
@@ -23,6 +29,14 @@ else:
     _data_file_path = lambda h: os.path.join(_data_file_directory(h), h)
 
 
+def get_s3_bucket():
+    # Boto pools connections at the class level
+    conn = S3Connection(config.get('AWS_ACCESS_KEY_ID'),
+                        config.get('AWS_SECRET_ACCESS_KEY'))
+    return conn.get_bucket(config.get('MESSAGE_STORE_BUCKET_NAME'),
+                           validate=False)
+
+
 class Blob(object):
     """ A blob of data that can be saved to local or remote (S3) disk. """
 
@@ -74,17 +88,68 @@ class Blob(object):
             log.warning('Not saving 0-length {1} {0}'.format(
                 self.id, self.__class__.__name__))
 
+    def iter_data(self, chunk_size=DATA_CHUNK_SIZE):
+        """
+        Like `data`, but yields the data in chunks of at most `chunk_size`
+        bytes, reading it from disk or S3 as it goes, rather than all at once.
+
+        """
+        if self.size == 0 or hasattr(self, '_data'):
+            value = self.data
+            for i in range(0, len(value or ''), chunk_size):
+                yield value[i:i + chunk_size]
+            return
+
+        if STORE_MSG_ON_S3:
+            chunks = self._iter_from_s3(chunk_size)
+        else:
+            chunks = self._iter_from_disk(chunk_size)
+
+        data_sha256 = sha256()
+        for chunk in chunks:
+            data_sha256.update(chunk)
+            yield chunk
+        assert self.data_sha256 == data_sha256.hexdigest(), \
+            "Returned data doesn't match stored hash!"
+
+    def set_data_from_file(self, f):
+        """
+        Like setting `data`, but reads the data from the file object `f`, in
+        chunks, so that it doesn't all need to be in memory.
+
+        """
+        self.__dict__.pop('_data', None)
+        data_sha256 = sha256()
+        self.size = 0
+        f.seek(0)
+        for chunk in iter(lambda: f.read(DATA_CHUNK_SIZE), ''):
+            data_sha256.update(chunk)
+            self.size += len(chunk)
+        self.data_sha256 = data_sha256.hexdigest()
+
+        if self.size > 0:
+            f.seek(0)
+            if STORE_MSG_ON_S3:
+                self._save_file_to_s3(f)
+            else:
+                self._save_file_to_disk(f)
+        else:
+            log.warning('Not saving 0-length {1} {0}'.format(
+                self.id, self.__class__.__name__))
+
     def _save_to_s3(self, data):
         assert 'AWS_ACCESS_KEY_ID' in config, 'Need AWS key!'
         assert 'AWS_SECRET_ACCESS_KEY' in config, 'Need AWS secret!'
         assert 'MESSAGE_STORE_BUCKET_NAME' in config, \
             'Need bucket name to store message data!'
 
-        # Boto pools connections at the class level
-        conn = S3Connection(config.get('AWS_ACCESS_KEY_ID'),
-                            config.get('AWS_SECRET_ACCESS_KEY'))
-        bucket = conn.get_bucket(config.get('MESSAGE_STORE_BUCKET_NAME'),
-                                 validate=False)
+        # Upload it in the background if there's a spool.
+        spool = get_blob_spool()
+        if spool is not None:
+            spool.add(self.data_sha256, data)
+            return
+
+        bucket = get_s3_bucket()
 
         # See if it already exists; if so, don't recreate.
         key = bucket.get_key(self.data_sha256)
@@ -95,23 +160,63 @@ class Blob(object):
         key.key = self.data_sha256
         key.set_contents_from_string(data)
 
-    def _get_from_s3(self):
+    def _save_file_to_s3(self, f):
+        spool = get_blob_spool()
+        if spool is not None:
+            spool.add_file(self.data_sha256, f)
+            return
+
+        bucket = get_s3_bucket()
+        if bucket.get_key(self.data_sha256):
+            return
+
+        key = Key(bucket)
+        key.key = self.data_sha256
+        key.set_contents_from_file(f)
+
+    def _get_s3_key(self):
         if not self.data_sha256:
             return None
 
-        conn = S3Connection(config.get('AWS_ACCESS_KEY_ID'),
-                            config.get('AWS_SECRET_ACCESS_KEY'))
-        bucket = conn.get_bucket(config.get('MESSAGE_STORE_BUCKET_NAME'),
-                                 validate=False)
-
-        key = bucket.get_key(self.data_sha256)
+        key = get_s3_bucket().get_key(self.data_sha256)
 
         if not key:
             log.error('No key with name: {} returned!'.
                       format(self.data_sha256))
+        return key
+
+    def _get_spooled_file(self):
+        # The data is in the spool until its upload finishes.
+        spool = get_blob_spool()
+        if spool is not None and self.data_sha256:
+            return spool.open(self.data_sha256)
+
+    def _get_from_s3(self):
+        spooled = self._get_spooled_file()
+        if spooled is not None:
+            with spooled:
+                return spooled.read()
+
+        key = self._get_s3_key()
+        if key:
+            return key.get_contents_as_string()
+
+    def _iter_from_s3(self, chunk_size):
+        spooled = self._get_spooled_file()
+        if spooled is not None:
+            with spooled:
+                for chunk in iter(lambda: spooled.read(chunk_size), ''):
+                    yield chunk
             return
 
-        return key.get_contents_as_string()
+        key = self._get_s3_key()
+        if not key:
+            return
+        try:
+            for chunk in iter(lambda: key.read(chunk_size), ''):
+                yield chunk
+        finally:
+            key.close()
 
     def _save_to_disk(self, data):
         directory = _data_file_directory(self.data_sha256)
@@ -120,6 +225,12 @@ class Blob(object):
         with open(_data_file_path(self.data_sha256), 'wb') as f:
             f.write(data)
 
+    def _save_file_to_disk(self, f):
+        mkdirp(_data_file_directory(self.data_sha256))
+
+        with open(_data_file_path(self.data_sha256), 'wb') as data_file:
+            shutil.copyfileobj(f, data_file, DATA_CHUNK_SIZE)
+
     def _get_from_disk(self):
         if not self.data_sha256:
             return None
@@ -130,3 +241,17 @@ class Blob(object):
         except IOError:
             log.error('No file with name: {}!'.format(self.data_sha256))
             return
+
+    def _iter_from_disk(self, chunk_size):
+        if not self.data_sha256:
+            return
+
+        try:
+            f = open(_data_file_path(self.data_sha256), 'rb')
+        except IOError:
+            log.error('No file with name: {}!'.format(self.data_sha256))
+            return
+
+        with f:
+            for chunk in iter(lambda: f.read(chunk_size), ''):
+                yield chunk
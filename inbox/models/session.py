@@ -26,6 +26,7 @@ def new_session(engine, versioned=True):
         from inbox.models.transaction import (create_revisions,
                                               propagate_changes,
                                               increment_versions)
+        from inbox.events.occurrences import update_occurrences
 
         @event.listens_for(session, 'before_flush')
         def before_flush(session, flush_context, instances):
@@ -35,11 +36,13 @@ def new_session(engine, versioned=True):
         @event.listens_for(session, 'after_flush')
         def after_flush(session, flush_context):
             """
-            Hook to log revision snapshots. Must be post-flush in order to
-            grab object IDs on new objects.
+            Hook to log revision snapshots and to materialize the
+            occurrences of changed recurring events. Must be post-flush in
+            order to grab object IDs on new objects.
 
             """
             create_revisions(session)
+            update_occurrences(session)
 
         # Make statsd calls for transaction times
         transaction_start_map = {}
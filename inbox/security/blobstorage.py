@@ -4,47 +4,150 @@ binary blobs. These have the following data format:
 
 |<1 byte>|
 +--------+--------+--------+--------+--------+--------+--------+--------+-----
-| scheme |              key version          |               data
+| scheme |   key version   | compr. | dict.  |               data
 +--------+--------+--------+--------+--------+--------+--------+--------+-----
 
 The "scheme" byte can be used to version the data format. Currently the only
 values are 0 (no encryption) and 1 (encryption with a static key). The key
 version bytes can be used to rotate encryption keys. (Right now these are
 always just null bytes.)
+
+The "compression" byte is the compression scheme: 0 for zlib, or 1 for zlib
+with a preset dictionary, whose id is the "dictionary" byte (otherwise a null
+byte). Dictionaries are trained from a sample of the data, e.g. message
+bodies, and help compress short data with a lot in common, like notification
+emails. The BLOB_COMPRESSION_DICTIONARIES config option maps dictionary ids to
+the paths of their files, and new blobs are compressed with the dictionary
+whose id is BLOB_COMPRESSION_DICTIONARY_ID, if it's set. A dictionary can't be
+changed or removed once blobs have been compressed with it.
 """
+import re
 import struct
 import zlib
+from collections import defaultdict
+from inbox.config import config
 from inbox.security.oracles import get_encryption_oracle, get_decryption_oracle
 
 
 KEY_VERSION = 0
 HEADER_WIDTH = 5
 
+ZLIB = 0
+ZLIB_WITH_DICTIONARY = 1
+
+# Deflate only refers back to the last 32KB of data, minus the lookahead.
+MAX_DICTIONARY_SIZE = 32 * 1024 - 262
+# Dictionaries are made of fragments of the samples ending at tags or line
+# breaks, which are common in at least this many samples.
+MIN_FRAGMENT_LENGTH = 8
+MIN_FRAGMENT_SAMPLES = 2
+
+_FRAGMENT_PATTERN = re.compile(r'[^>\n]*[>\n]?')
+
+# dictionary id -> CompressionDictionary
+_dictionaries = {}
 
-def _pack_header(scheme):
-    return struct.pack('<BI', scheme, KEY_VERSION)
+
+def _pack_header(scheme, compression=ZLIB, dictionary_id=0):
+    return struct.pack('<BHBB', scheme, KEY_VERSION, compression,
+                       dictionary_id)
 
 
 def _unpack_header(header):
-    scheme, key_version = struct.unpack('<BI', header)
+    scheme, key_version, compression, dictionary_id = struct.unpack(
+        '<BHBB', header)
     assert key_version == KEY_VERSION
-    return scheme
+    return scheme, compression, dictionary_id
+
+
+class CompressionDictionary(object):
+    """
+    A zlib preset dictionary.
+
+    Python 2's zlib doesn't support preset dictionaries, so data is instead
+    compressed as the continuation of a zlib stream that starts with the
+    dictionary: the (de)compression state after the dictionary is computed
+    once, and copied to compress or decompress each blob.
+    """
+    def __init__(self, dictionary):
+        assert len(dictionary) <= MAX_DICTIONARY_SIZE, \
+            'Dictionary is too large to be used'
+        self.dictionary = dictionary
+        self._compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION)
+        prefix = (self._compressor.compress(dictionary) +
+                  self._compressor.flush(zlib.Z_SYNC_FLUSH))
+        self._decompressor = zlib.decompressobj()
+        assert self._decompressor.decompress(prefix) == dictionary
+
+    def compress(self, data):
+        compressor = self._compressor.copy()
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, compressed):
+        decompressor = self._decompressor.copy()
+        return decompressor.decompress(compressed) + decompressor.flush()
+
+
+def get_dictionary(dictionary_id):
+    if dictionary_id not in _dictionaries:
+        paths = config.get('BLOB_COMPRESSION_DICTIONARIES', {})
+        with open(paths[str(dictionary_id)], 'rb') as f:
+            _dictionaries[dictionary_id] = CompressionDictionary(f.read())
+    return _dictionaries[dictionary_id]
+
+
+def train_dictionary(samples, size=MAX_DICTIONARY_SIZE):
+    """
+    Build a compression dictionary of at most `size` bytes from `samples`,
+    out of the fragments (ending at HTML tags or line breaks) that the most
+    samples have in common, weighted by their length. The most valuable
+    fragments are at the end of the dictionary, so that references to them
+    are the shortest.
+
+    """
+    fragment_samples = defaultdict(int)
+    for sample in samples:
+        for fragment in set(_FRAGMENT_PATTERN.findall(sample)):
+            if len(fragment) >= MIN_FRAGMENT_LENGTH:
+                fragment_samples[fragment] += 1
+
+    candidates = sorted(
+        ((count * len(fragment), fragment)
+         for fragment, count in fragment_samples.iteritems()
+         if count >= MIN_FRAGMENT_SAMPLES), reverse=True)
+    chosen = []
+    remaining = min(size, MAX_DICTIONARY_SIZE)
+    for _, fragment in candidates:
+        if len(fragment) <= remaining:
+            chosen.append(fragment)
+            remaining -= len(fragment)
+    return ''.join(reversed(chosen))
 
 
 def encode_blob(plaintext):
     assert isinstance(plaintext, bytes), 'Plaintext should be bytes'
-    compressed = zlib.compress(plaintext)
+    dictionary_id = config.get('BLOB_COMPRESSION_DICTIONARY_ID')
+    if dictionary_id:
+        compression = ZLIB_WITH_DICTIONARY
+        compressed = get_dictionary(dictionary_id).compress(plaintext)
+    else:
+        compression, dictionary_id = ZLIB, 0
+        compressed = zlib.compress(plaintext)
     encryption_oracle = get_encryption_oracle('BLOCK_ENCRYPTION_KEY')
     ciphertext, scheme = encryption_oracle.encrypt(compressed)
-    header = _pack_header(scheme)
+    header = _pack_header(scheme, compression, dictionary_id)
     return header + ciphertext
 
 
 def decode_blob(blob):
     header = blob[:HEADER_WIDTH]
     body = blob[HEADER_WIDTH:]
-    scheme = _unpack_header(header)
+    scheme, compression, dictionary_id = _unpack_header(header)
     decryption_oracle = get_decryption_oracle('BLOCK_ENCRYPTION_KEY')
     compressed_plaintext = decryption_oracle.decrypt(body, scheme)
+    if compression == ZLIB_WITH_DICTIONARY:
+        return get_dictionary(dictionary_id).decompress(compressed_plaintext)
+    assert compression == ZLIB, \
+        'Unknown compression scheme: {}'.format(compression)
     result = zlib.decompress(compressed_plaintext)
     return result
@@ -309,11 +309,12 @@ def delete_draft(db_session, account, draft):
 
 
 def generate_attachments(blocks):
+    # The data is only read (in chunks) when the email is generated.
     attachment_dicts = []
     for block in blocks:
         attachment_dicts.append({
             'filename': block.filename,
-            'data': block.data,
+            'iter_data': block.iter_data,
             'content_type': block.content_type})
     return attachment_dicts
 
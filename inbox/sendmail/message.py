@@ -13,6 +13,9 @@ This is because not all servers support 8BIT and so flanker drops to b64.
 http://www.w3.org/Protocols/rfc1341/5_Content-Transfer-Encoding.html
 
 """
+import uuid
+import base64
+import tempfile
 import pkg_resources
 
 from flanker import mime
@@ -21,11 +24,20 @@ from flanker.addresslib.quote import smart_quote
 from flanker.mime.message.headers.encoding import encode_string
 from flanker.addresslib.parser import MAX_ADDRESS_LENGTH
 from html2text import html2text
+from nylas.logging import get_logger
+log = get_logger()
 
 VERSION = pkg_resources.get_distribution('inbox-sync').version
 
 REPLYSTR = 'Re: '
 
+# Base64 encodes each 57 bytes of input as one 76 character line.
+BASE64_LINE_INPUT_SIZE = 57
+# Attachments are read and encoded this many bytes at a time.
+ATTACHMENT_CHUNK_SIZE = BASE64_LINE_INPUT_SIZE * 4096
+# Streamed messages are spooled in memory up to this size, then on disk.
+SPOOL_MAX_MEMORY_SIZE = 1024 * 1024
+
 
 # Patch flanker to use base64 rather than quoted-printable encoding for
 # MIME parts with long lines. Flanker's implementation of quoted-printable
@@ -87,8 +99,188 @@ def create_email(from_name,
         If this message is a reply, the Message-Ids of prior messages in the
         thread.
     attachments: list of dicts, optional
-        a list of dicts(filename, data, content_type)
+        a list of dicts(filename, data, content_type). Instead of `data`, a
+        dict can have `iter_data`, a function returning the data in chunks.
+    """
+    return create_email_stream(from_name, from_email, reply_to, inbox_uid,
+                               to_addr, cc_addr, bcc_addr, subject, html,
+                               in_reply_to, references,
+                               attachments).to_string()
+
+
+def create_email_stream(from_name,
+                        from_email,
+                        reply_to,
+                        inbox_uid,
+                        to_addr,
+                        cc_addr,
+                        bcc_addr,
+                        subject,
+                        html,
+                        in_reply_to,
+                        references,
+                        attachments):
+    """
+    Like create_email, but returns a StreamedMessage: attachments that
+    aren't text or messages are only read (using their `iter_data`, if
+    they have one) and base64-encoded as the message is iterated over, so
+    that they're never all in memory.
+
+    """
+    # Stream each attachment as the body of a flanker-generated part with
+    # some placeholder data: flanker still generates the headers, and the
+    # base64-encoded placeholder marks where to write the attachment.
+    streamed = []
+    mime_attachments = []
+    for a in attachments or []:
+        if _is_streamable(a['content_type']):
+            placeholder = 'nylas-attachment-{}'.format(uuid.uuid4().hex)
+            streamed.append((base64.b64encode(placeholder), a))
+            mime_attachments.append(dict(a, data=placeholder))
+        else:
+            mime_attachments.append(dict(a, data=_attachment_data(a)))
+
+    msgstring = _create_mime(from_name, from_email, reply_to, inbox_uid,
+                             to_addr, cc_addr, bcc_addr, subject, html,
+                             in_reply_to, references, mime_attachments)
+
+    pieces = []
+    for encoded_placeholder, a in streamed:
+        start = msgstring.find(encoded_placeholder)
+        if start == -1:
+            # Flanker didn't base64-encode the part; generate the whole
+            # message in memory instead.
+            log.warning('Not streaming attachments',
+                        content_type=a['content_type'])
+            attachments = [dict(a, data=_attachment_data(a))
+                           for a in attachments]
+            return StreamedMessage([_create_mime(
+                from_name, from_email, reply_to, inbox_uid, to_addr,
+                cc_addr, bcc_addr, subject, html, in_reply_to, references,
+                attachments)])
+        end = start + len(encoded_placeholder)
+        # Match the line endings flanker uses for encoded parts.
+        newline = '\r\n' if msgstring[end:end + 2] == '\r\n' else '\n'
+        pieces.append(msgstring[:start])
+        pieces.append(_attachment_stream(a, newline))
+        msgstring = msgstring[end:]
+    pieces.append(msgstring)
+    return StreamedMessage(pieces)
+
+
+class StreamedMessage(object):
+    """
+    A MIME message that's generated as it's iterated over, in chunks.
+
+    `pieces` are strings, and functions returning the (base64-encoded)
+    attachments in chunks. The message is spooled to a temporary file the
+    first time it's iterated over completely, so that it can be iterated
+    over again (e.g. to retry sending it, or save a copy of it) without
+    reading and encoding the attachments again.
+
+    """
+    def __init__(self, pieces):
+        self.pieces = pieces
+        self._spool = None
+
+    def __iter__(self):
+        if self._spool is not None:
+            self._spool.seek(0)
+            for chunk in iter(lambda: self._spool.read(ATTACHMENT_CHUNK_SIZE),
+                              ''):
+                yield chunk
+            return
+
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY_SIZE)
+        for piece in self.pieces:
+            chunks = [piece] if isinstance(piece, basestring) else piece()
+            for chunk in chunks:
+                spool.write(chunk)
+                yield chunk
+        self._spool = spool
+
+    def __str__(self):
+        return self.to_string()
+
+    def to_string(self):
+        return ''.join(self)
+
+    def file(self):
+        """
+        Return a file object with the whole message, positioned at its
+        start.
+
+        """
+        if self._spool is None:
+            for _ in self:
+                pass
+        self._spool.seek(0)
+        return self._spool
+
+
+def bcc_header(bcc_addr):
+    """ The Bcc header for the given recipients, to add to an email created
+        without one.
+    """
+    full_bcc_specs = [_get_full_spec_without_validation(name, spec)
+                      for name, spec in bcc_addr]
+    return u'Bcc: {}\r\n'.format(u', '.join(full_bcc_specs)).encode('utf-8')
+
+
+def _is_streamable(content_type):
+    # Flanker picks the encoding of text parts (which are usually small
+    # anyway) depending on their content, and parses message parts.
+    maintype = content_type.split('/')[0].lower()
+    return maintype not in ('text', 'message', 'multipart')
+
+
+def _attachment_data(attachment):
+    if attachment.get('data') is not None:
+        return attachment['data']
+    return ''.join(attachment['iter_data']())
+
+
+def _attachment_chunks(attachment):
+    if attachment.get('data') is not None:
+        data = attachment['data']
+        return (data[i:i + ATTACHMENT_CHUNK_SIZE]
+                for i in range(0, len(data), ATTACHMENT_CHUNK_SIZE))
+    return attachment['iter_data'](ATTACHMENT_CHUNK_SIZE)
+
+
+def _attachment_stream(attachment, newline):
+    return lambda: base64_lines(_attachment_chunks(attachment), newline)
+
+
+def base64_lines(chunks, newline='\r\n'):
     """
+    Base64-encode the data read in `chunks`, as 76 character lines
+    separated by `newline` (without one after the last line), yielding the
+    encoded data as it's read.
+
+    """
+    pending = ''
+    separator = ''
+    for chunk in chunks:
+        pending += chunk
+        size = len(pending) - len(pending) % BASE64_LINE_INPUT_SIZE
+        if size:
+            yield separator + _base64_encode(pending[:size], newline)
+            pending = pending[size:]
+            separator = newline
+    if pending:
+        yield separator + _base64_encode(pending, newline)
+
+
+def _base64_encode(data, newline):
+    return newline.join(
+        base64.b64encode(data[i:i + BASE64_LINE_INPUT_SIZE])
+        for i in range(0, len(data), BASE64_LINE_INPUT_SIZE))
+
+
+def _create_mime(from_name, from_email, reply_to, inbox_uid, to_addr,
+                 cc_addr, bcc_addr, subject, html, in_reply_to, references,
+                 attachments):
     html = html if html else ''
     plaintext = html2text(html)
 
@@ -1,12 +1,16 @@
 import re
 import ssl
 import sys
+import time
 import base64
 import socket
 import itertools
+import contextlib
+from collections import deque
 
 import smtplib
 
+import gevent
 import requests
 
 from nylas.logging import get_logger
@@ -15,9 +19,10 @@ from inbox.models.backends.imap import ImapAccount
 from inbox.models.backends.oauth import token_manager as default_token_manager
 from inbox.models.backends.gmail import g_token_manager
 from inbox.sendmail.base import generate_attachments, SendMailException
-from inbox.sendmail.message import create_email
+from inbox.sendmail.message import create_email_stream
 from inbox.basicauth import OAuthError
 from inbox.providers import provider_info
+from inbox.util.stats import statsd_client
 log = get_logger()
 
 # TODO[k]: Other types (LOGIN, XOAUTH, PLAIN-CLIENTTOKEN, CRAM-MD5)
@@ -38,6 +43,19 @@ SMTP_AUTH_SUCCESS = 235
 SMTP_AUTH_CHALLENGE = 334
 SMTP_TEMP_AUTH_FAIL = 454
 
+# How many idle connections are kept per account, for how long (in seconds),
+# and how many messages are sent over a connection before it's closed.
+SMTP_POOL_SIZE = 3
+SMTP_CONNECTION_IDLE_TIMEOUT = 60
+SMTP_MAX_MESSAGES_PER_CONNECTION = 50
+# How often (in seconds) expired idle connections are closed, and pools left
+# empty are dropped.
+SMTP_POOL_SWEEP_INTERVAL = 30
+
+# (account id, SMTP endpoint) -> SMTPConnectionPool
+_connection_pools = {}
+_pool_sweeper = None
+
 
 class _TokenManagerWrapper:
     def get_token(self, account, force_refresh=False):
@@ -192,17 +210,31 @@ class SMTPConnection(object):
         self.log.bind(account_id=self.account_id)
         self.auth_handlers = {'oauth2': self.smtp_oauth2,
                               'password': self.smtp_password}
+        self.messages_sent = 0
         self.setup()
 
     def __enter__(self):
         return self
 
     def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
         try:
             self.connection.quit()
-        except smtplib.SMTPServerDisconnected:
+        except (smtplib.SMTPException, socket.error):
             return
 
+    def is_healthy(self):
+        """ Check that the server still answers on the connection (with a
+            NOOP), e.g. before reusing it.
+        """
+        try:
+            code, _ = self.connection.noop()
+        except (smtplib.SMTPException, socket.error):
+            return False
+        return code == 250
+
     def _connect(self, host, port):
         """ Connect, with error-handling """
         try:
@@ -296,14 +328,172 @@ class SMTPConnection(object):
         self.log.info('SMTP Auth(Password) success')
 
     def sendmail(self, recipients, msg):
+        """ Send `msg`, a string or an iterable of chunks of the message
+            (e.g. a StreamedMessage, which is then sent as it's generated).
+            Returns the failed recipients, like smtplib's sendmail.
+        """
+        self.messages_sent += 1
         try:
-            return self.connection.sendmail(self.email_address, recipients, msg)
+            if isinstance(msg, basestring):
+                return self.connection.sendmail(self.email_address,
+                                                recipients, msg)
+            return self._sendmail_streamed(recipients, msg)
         except UnicodeEncodeError:
             self.log.error('Unicode error when trying to decode email',
                            logstash_tag='sendmail_encode_error',
                            email=self.email_address, recipients=recipients)
             raise SendMailException('Invalid character in recipient address', 402)
 
+    def _sendmail_streamed(self, recipients, chunks):
+        # Like smtplib's sendmail, but writes the message during the DATA
+        # command as its chunks are generated.
+        conn = self.connection
+        conn.ehlo_or_helo_if_needed()
+        code, resp = conn.mail(self.email_address)
+        if code != 250:
+            conn.rset()
+            raise smtplib.SMTPSenderRefused(code, resp, self.email_address)
+        failures = {}
+        for recipient in recipients:
+            code, resp = conn.rcpt(recipient)
+            if code not in (250, 251):
+                failures[recipient] = (code, resp)
+        if len(failures) == len(recipients):
+            conn.rset()
+            raise smtplib.SMTPRecipientsRefused(failures)
+
+        code, resp = conn.docmd('data')
+        if code != 354:
+            conn.rset()
+            raise smtplib.SMTPDataError(code, resp)
+        end = ''
+        for data in _quoted_chunks(chunks):
+            conn.send(data)
+            end = (end + data)[-2:]
+        conn.send(('' if end == smtplib.CRLF else smtplib.CRLF) +
+                  '.' + smtplib.CRLF)
+        code, resp = conn.getreply()
+        if code != 250:
+            conn.rset()
+            raise smtplib.SMTPDataError(code, resp)
+        return failures
+
+
+def _quoted_chunks(chunks):
+    """ Apply smtplib's line ending normalization and dot-stuffing to a
+        message given in chunks, only ever quoting whole lines at once.
+    """
+    pending = ''
+    for chunk in chunks:
+        pending += chunk
+        end = pending.rfind('\n') + 1
+        if end:
+            yield smtplib.quotedata(pending[:end])
+            pending = pending[end:]
+    if pending:
+        yield smtplib.quotedata(pending)
+
+
+class SMTPConnectionPool(object):
+    """
+    Idle, authenticated SMTP connections to an account's server, so that
+    consecutive sends don't each pay for connecting, STARTTLS and AUTH.
+
+    Use like this:
+
+        with pool.get(new_connection) as smtpconn:
+            smtpconn.sendmail(recipients, msg)
+
+    where `new_connection` creates an SMTPConnection if there's no idle one
+    to reuse. Idle connections are checked with a NOOP before being reused,
+    and closed once they've been idle for SMTP_CONNECTION_IDLE_TIMEOUT
+    seconds (by `close_expired`, or when they would have been reused) or
+    have sent SMTP_MAX_MESSAGES_PER_CONNECTION messages. A connection that
+    raises an error while in use is discarded.
+    """
+    def __init__(self, max_idle=SMTP_POOL_SIZE):
+        self.max_idle = max_idle
+        # (connection, time it became idle), most recently used last.
+        self._idle = deque()
+        self.in_use = 0
+
+    @property
+    def empty(self):
+        return not self._idle and not self.in_use
+
+    @contextlib.contextmanager
+    def get(self, new_connection):
+        # Counted from the start, so that the pool isn't dropped while a
+        # connection is checked or established.
+        self.in_use += 1
+        try:
+            connection = self._reuse_connection()
+            if connection is None:
+                statsd_client.incr('smtp.connection_pool.misses')
+                connection = new_connection()
+            else:
+                statsd_client.incr('smtp.connection_pool.hits')
+            try:
+                yield connection
+            except Exception:
+                connection.close()
+                raise
+            self._release(connection)
+        finally:
+            self.in_use -= 1
+
+    def close_expired(self):
+        """ Close the connections that have been idle for too long. """
+        while (self._idle and time.time() - self._idle[0][1] >=
+               SMTP_CONNECTION_IDLE_TIMEOUT):
+            connection, _ = self._idle.popleft()
+            connection.close()
+
+    def _reuse_connection(self):
+        while self._idle:
+            connection, idle_since = self._idle.pop()
+            if (time.time() - idle_since < SMTP_CONNECTION_IDLE_TIMEOUT and
+                    connection.is_healthy()):
+                return connection
+            connection.close()
+
+    def _release(self, connection):
+        if (connection.messages_sent >= SMTP_MAX_MESSAGES_PER_CONNECTION or
+                len(self._idle) >= self.max_idle):
+            connection.close()
+            return
+        self._idle.append((connection, time.time()))
+
+
+def smtp_connection_pool(account_id, smtp_endpoint):
+    """ Per-account SMTP connection pool. """
+    global _pool_sweeper
+    key = (account_id, tuple(smtp_endpoint))
+    if key not in _connection_pools:
+        _connection_pools[key] = SMTPConnectionPool()
+    if _pool_sweeper is None:
+        _pool_sweeper = gevent.spawn(_sweep_connection_pools_periodically)
+    return _connection_pools[key]
+
+
+def sweep_connection_pools():
+    """ Close the expired idle connections of every pool, and drop the pools
+        that are left without connections.
+    """
+    for key, pool in _connection_pools.items():
+        pool.close_expired()
+        if pool.empty:
+            del _connection_pools[key]
+
+
+def _sweep_connection_pools_periodically():
+    while True:
+        gevent.sleep(SMTP_POOL_SWEEP_INTERVAL)
+        try:
+            sweep_connection_pools()
+        except Exception:
+            log.error('Error sweeping SMTP connection pools', exc_info=True)
+
 
 class SMTPClient(object):
     """ SMTPClient for Gmail and other IMAP providers. """
@@ -336,7 +526,7 @@ class SMTPClient(object):
         ----------
         recipients: list
             list of recipient email addresses.
-        msg: string
+        msg: string or StreamedMessage
             byte-encoded MIME message.
 
         Raises
@@ -413,6 +603,11 @@ class SMTPClient(object):
         ----------
         draft : models.message.Message object
             the draft message to send.
+
+        Returns
+        -------
+        StreamedMessage
+            the MIME message as it was sent (without a Bcc header).
         """
         blocks = [p.block for p in draft.attachments]
         attachments = generate_attachments(blocks)
@@ -435,18 +630,18 @@ class SMTPClient(object):
 
         # from_addr is only ever a list with one element
         from_addr = draft.from_addr[0]
-        msg = create_email(from_name=from_addr[0],
-                           from_email=from_addr[1],
-                           reply_to=draft.reply_to,
-                           inbox_uid=draft.inbox_uid,
-                           to_addr=draft.to_addr,
-                           cc_addr=draft.cc_addr,
-                           bcc_addr=None,
-                           subject=draft.subject,
-                           html=draft.body,
-                           in_reply_to=draft.in_reply_to,
-                           references=draft.references,
-                           attachments=attachments)
+        msg = create_email_stream(from_name=from_addr[0],
+                                  from_email=from_addr[1],
+                                  reply_to=draft.reply_to,
+                                  inbox_uid=draft.inbox_uid,
+                                  to_addr=draft.to_addr,
+                                  cc_addr=draft.cc_addr,
+                                  bcc_addr=None,
+                                  subject=draft.subject,
+                                  html=draft.body,
+                                  in_reply_to=draft.in_reply_to,
+                                  references=draft.references,
+                                  attachments=attachments)
 
         recipient_emails = [email for name, email in itertools.chain(
             draft.to_addr, draft.cc_addr, draft.bcc_addr)]
@@ -455,6 +650,7 @@ class SMTPClient(object):
         # Sent to all successfully
         self.log.info('Sending successful', sender=from_addr[1],
                       recipients=recipient_emails)
+        return msg
 
     def send_raw(self, msg):
         recipient_emails = [email for name, email in itertools.chain(
@@ -469,6 +665,10 @@ class SMTPClient(object):
                       recipients=recipient_emails)
 
     def _get_connection(self):
+        pool = smtp_connection_pool(self.account_id, self.smtp_endpoint)
+        return pool.get(self._new_connection)
+
+    def _new_connection(self):
         smtp_connection = SMTPConnection(account_id=self.account_id,
                                          email_address=self.email_address,
                                          auth_type=self.auth_type,
@@ -41,6 +41,10 @@ ACTION_FUNCTION_MAP = {
     'mark_starred': mark_starred,
     'move': move,
     'change_labels': change_labels,
+    'bulk_mark_unread': mark_unread,
+    'bulk_mark_starred': mark_starred,
+    'bulk_move': move,
+    'bulk_change_labels': change_labels,
     'save_draft': save_draft,
     'update_draft': update_draft,
     'delete_draft': delete_draft,
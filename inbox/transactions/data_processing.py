@@ -0,0 +1,146 @@
+from collections import defaultdict
+
+from sqlalchemy import asc, desc
+from sqlalchemy.orm.exc import NoResultFound
+from gevent import Greenlet, sleep
+
+from inbox.api.filtering import messages_for_contact_scores
+from inbox.contacts.algorithms import (accumulate_contact_scores,
+                                       accumulate_group_molecules,
+                                       calculate_group_scores_from_molecules)
+from inbox.models import Transaction, Namespace, DataProcessingCache
+from inbox.models.data_processing import DataProcessingCursor
+from inbox.models.session import session_scope
+
+from nylas.logging import get_logger
+log = get_logger()
+
+
+def update_contact_scores(db_session, namespace_id, message_ids=(),
+                          recompute=False):
+    """
+    Fold the sent messages among `message_ids` that haven't been processed
+    yet into the namespace's contact rankings and contact groups, or
+    recompute both from all sent messages if `recompute` is set or nothing
+    has been computed yet.
+
+    Returns the (uncommitted) DataProcessingCache.
+
+    """
+    try:
+        dpcache = db_session.query(DataProcessingCache).filter(
+            DataProcessingCache.namespace_id == namespace_id).one()
+    except NoResultFound:
+        dpcache = DataProcessingCache(namespace_id=namespace_id)
+        db_session.add(dpcache)
+
+    if (dpcache.contact_rankings is None or
+            dpcache.contact_group_molecules is None):
+        recompute = True
+
+    if recompute:
+        messages = messages_for_contact_scores(db_session, namespace_id)
+        processed_message_ids = set()
+        rankings, molecules = None, None
+    else:
+        if not message_ids:
+            return dpcache
+        # Messages become sent messages in any order (e.g. drafts keep their
+        # id when they're sent), and their later changes are in the
+        # transaction log too, so keep track of the ones already folded in.
+        processed_message_ids = dpcache.processed_message_ids
+        messages = [m for m in messages_for_contact_scores(
+                        db_session, namespace_id, message_ids=message_ids)
+                    if m.id not in processed_message_ids]
+        if not messages:
+            return dpcache
+        rankings = dpcache.contact_rankings
+        molecules = dpcache.contact_group_molecules
+
+    from_email = db_session.query(Namespace).get(namespace_id).email_address
+    dpcache.contact_rankings = accumulate_contact_scores(
+        rankings, dpcache.contact_rankings_last_updated, messages)
+    molecules = accumulate_group_molecules(
+        molecules, dpcache.contact_groups_last_updated, messages, from_email)
+    dpcache.contact_group_molecules = molecules
+    dpcache.contact_groups = calculate_group_scores_from_molecules(molecules)
+    dpcache.processed_message_ids = \
+        processed_message_ids | {m.id for m in messages}
+    return dpcache
+
+
+class DataProcessingService(Greenlet):
+    """
+    Poll the transaction log for message operations and incrementally update
+    the contact rankings and contact groups of the affected namespaces, so
+    that the /contacts/rankings and /groups/intrinsic endpoints only have to
+    read precomputed results.
+
+    """
+    def __init__(self, poll_interval=30, chunk_size=1000):
+        self.poll_interval = poll_interval
+        self.chunk_size = chunk_size
+        self.transaction_pointer = None
+
+        self.log = log.new(component='data-processing')
+        Greenlet.__init__(self)
+
+    def _run(self):
+        with session_scope() as db_session:
+            pointer = db_session.query(DataProcessingCursor).first()
+            if pointer:
+                self.transaction_pointer = pointer.transaction_id
+            else:
+                # Never start from 0; namespaces without any computed data
+                # are computed from scratch the first time they're seen.
+                latest_transaction = db_session.query(Transaction).order_by(
+                    desc(Transaction.created_at)).first()
+                self.transaction_pointer = latest_transaction.id
+
+        self.log.info('Starting data processing service',
+                      transaction_pointer=self.transaction_pointer)
+
+        while True:
+            with session_scope() as db_session:
+                transactions = db_session.query(
+                    Transaction.id, Transaction.namespace_id,
+                    Transaction.record_id). \
+                    filter(Transaction.id > self.transaction_pointer,
+                           Transaction.object_type == 'message'). \
+                    order_by(asc(Transaction.id)). \
+                    limit(self.chunk_size).all()
+
+                if transactions:
+                    self.process(transactions, db_session)
+                    self.update_pointer(transactions[-1].id, db_session)
+                else:
+                    sleep(self.poll_interval)
+                db_session.commit()
+
+    def process(self, transactions, db_session):
+        message_ids = defaultdict(set)
+        for trx in transactions:
+            message_ids[trx.namespace_id].add(trx.record_id)
+        namespace_ids = message_ids.keys()
+        for namespace_id in namespace_ids:
+            update_contact_scores(db_session, namespace_id,
+                                  message_ids[namespace_id])
+            # Commit per namespace so one namespace's data isn't lost if a
+            # later one fails.
+            db_session.commit()
+        self.log.info('updated contact scores',
+                      namespaces=len(namespace_ids),
+                      transactions=len(transactions))
+
+    def update_pointer(self, new_pointer, db_session):
+        """
+        Persist transaction pointer to support restarts, update
+        self.transaction_pointer.
+
+        """
+        pointer = db_session.query(DataProcessingCursor).first()
+        if pointer is None:
+            pointer = DataProcessingCursor()
+            db_session.add(pointer)
+        pointer.transaction_id = new_pointer
+        self.transaction_pointer = new_pointer
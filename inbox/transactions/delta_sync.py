@@ -250,8 +250,9 @@ def streaming_change_generator(namespace, poll_interval, timeout,
 
         if new_pointer is not None and new_pointer != transaction_pointer:
             transaction_pointer = new_pointer
-            for delta in deltas:
-                yield encoder.cereal(delta) + '\n'
+            # Yield each batch in one piece, so that it's sent (and
+            # compressed) at once.
+            yield ''.join(encoder.cereal(delta) + '\n' for delta in deltas)
         else:
             yield '\n'
             gevent.sleep(poll_interval)
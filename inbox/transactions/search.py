@@ -1,7 +1,8 @@
 import json
+from datetime import datetime
 
 from sqlalchemy import asc, desc
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, subqueryload
 from gevent import Greenlet, sleep
 
 from inbox.models import Transaction, Contact
@@ -9,6 +10,8 @@ from inbox.models.session import session_scope
 from inbox.models.search import ContactSearchIndexCursor
 from inbox.contacts.search import (get_doc_service, DOC_UPLOAD_CHUNK_SIZE,
                                    cloudsearch_contact_repr)
+from inbox.util.itert import chunk
+from inbox.util.stats import statsd_client
 
 from nylas.logging import get_logger
 log = get_logger()
@@ -20,10 +23,18 @@ class ContactSearchIndexService(Greenlet):
     (inserts, updates, deletes) for all namespaces and perform the
     corresponding CloudSearch index operations.
 
+    Transactions are read a page at a time. Multiple transactions for the
+    same contact within a page are collapsed into a single add or delete
+    document, and documents are uploaded in batches of at most `batch_size`.
+    The persisted transaction pointer only advances once a batch has been
+    uploaded successfully.
+
     """
-    def __init__(self, poll_interval=30, chunk_size=DOC_UPLOAD_CHUNK_SIZE):
+    def __init__(self, poll_interval=30, chunk_size=DOC_UPLOAD_CHUNK_SIZE,
+                 batch_size=DOC_UPLOAD_CHUNK_SIZE):
         self.poll_interval = poll_interval
         self.chunk_size = chunk_size
+        self.batch_size = batch_size
         self.transaction_pointer = None
 
         self.log = log.new(component='contact-search-index')
@@ -61,46 +72,96 @@ class ContactSearchIndexService(Greenlet):
                 # index up to chunk_size transactions
                 if transactions:
                     self.index(transactions, db_session)
+                    # Advance past any trailing transactions that didn't
+                    # produce a document (e.g. updates to since-deleted
+                    # contacts).
                     new_pointer = transactions[-1].id
                     self.update_pointer(new_pointer, db_session)
                 else:
                     sleep(self.poll_interval)
                 db_session.commit()
 
+    def _collapse(self, transactions):
+        """
+        Reduce a page of transactions to the most recent transaction for
+        each contact, ordered by transaction id. An insert or update followed
+        by a delete becomes a delete; a delete followed by an insert (which
+        shouldn't happen, but is harmless) becomes an add.
+
+        """
+        latest = {}
+        for trx in transactions:
+            latest[trx.record_id] = trx
+        return sorted(latest.values(), key=lambda trx: trx.id)
+
+    def _load_contacts(self, transactions, db_session):
+        """
+        Load every contact referenced by a non-delete transaction with a
+        single IN query, returning a dict of contact id -> Contact.
+
+        """
+        contact_ids = [trx.record_id for trx in transactions
+                       if trx.command != 'delete']
+        if not contact_ids:
+            return {}
+        contacts = db_session.query(Contact).filter(
+            Contact.id.in_(contact_ids)).options(
+                subqueryload(Contact.phone_numbers)).all()
+        return {contact.id: contact for contact in contacts}
+
     def index(self, transactions, db_session):
         """
         Translate database operations to CloudSearch index operations
         and perform them.
 
         """
-        docs = []
-        adds, deletes = 0, 0
         doc_service = get_doc_service()
-        for trx in transactions:
-            if trx.command == 'delete':
-                deletes += 1
-                doc = {'type': 'delete', 'id': trx.record_id}
-            else:
-                adds += 1
-                obj = db_session.query(Contact).get(trx.record_id)
+        collapsed = self._collapse(transactions)
+        contacts = self._load_contacts(collapsed, db_session)
+
+        adds, deletes = 0, 0
+        for batch in chunk(collapsed, self.batch_size):
+            docs = []
+            for trx in batch:
+                if trx.command == 'delete':
+                    docs.append({'type': 'delete', 'id': trx.record_id})
+                    continue
+                obj = contacts.get(trx.record_id)
                 if obj is None:
                     continue
-                doc = {'type': 'add', 'id': trx.record_id,
-                       'fields': cloudsearch_contact_repr(obj)}
-            docs.append(doc)
+                docs.append({'type': 'add', 'id': trx.record_id,
+                             'fields': cloudsearch_contact_repr(obj)})
 
-            if len(docs) > self.chunk_size:
+            if docs:
+                start_time = datetime.utcnow()
                 doc_service.upload_documents(
                     documents=json.dumps(docs),
                     contentType='application/json')
-                docs = []
-
-        if docs:
-            doc_service.upload_documents(
-                documents=json.dumps(docs),
-                contentType='application/json')
-
-        self.log.info('docs indexed', adds=adds, deletes=deletes)
+                batch_deletes = sum(1 for d in docs if d['type'] == 'delete')
+                adds += len(docs) - batch_deletes
+                deletes += batch_deletes
+                self._log_to_statsd(len(docs) - batch_deletes, batch_deletes,
+                                    start_time, batch[-1])
+
+            # Every transaction up to the end of this batch has either been
+            # indexed or is superseded by a later transaction for the same
+            # contact, so it's safe to persist progress.
+            self.update_pointer(batch[-1].id, db_session)
+            db_session.commit()
+
+        self.log.info('docs indexed', adds=adds, deletes=deletes,
+                      transactions=len(transactions),
+                      documents=len(collapsed))
+
+    def _log_to_statsd(self, adds, deletes, start_time, last_transaction):
+        now = datetime.utcnow()
+        upload_latency = (now - start_time).total_seconds()
+        lag = (now - last_transaction.created_at).total_seconds()
+        statsd_client.incr('contacts.search_index.adds', adds)
+        statsd_client.incr('contacts.search_index.deletes', deletes)
+        statsd_client.timing('contacts.search_index.upload_latency',
+                             upload_latency * 1000)
+        statsd_client.gauge('contacts.search_index.lag', lag)
 
     def update_pointer(self, new_pointer, db_session):
         """
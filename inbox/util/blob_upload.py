@@ -0,0 +1,246 @@
+"""
+Asynchronous uploads of blob data to S3, through a local spool directory.
+
+When messages are stored on S3 and the BLOB_UPLOAD_SPOOL_DIRECTORY config
+option is set, saving a Blob's data only writes it to a file named by its
+sha256 in the spool directory, so that e.g. sync doesn't wait for S3. A
+background greenlet then uploads spooled files to S3, a bounded number at
+a time and retrying failed uploads, and deletes them once they're uploaded.
+Until then, reads of the blob's data are served from the spool.
+
+Spooled files are only removed after they've been uploaded, so blobs left
+in the spool (by a process that exited, or uploads that kept failing) are
+uploaded when the directory is next scanned, by any process using it:
+right after that process' uploader starts, then every SPOOL_SCAN_INTERVAL
+seconds. Files are synced to disk before they're added to the spool, and
+their sha256 is checked again before they're uploaded: files that don't
+match it (e.g. corrupted by a crash) are moved to the QUARANTINE_DIRECTORY
+subdirectory of the spool instead.
+
+"""
+import os
+import time
+import shutil
+import tempfile
+from hashlib import sha256
+
+import gevent
+from gevent.pool import Pool
+from gevent.queue import Queue
+
+from inbox.config import config
+from inbox.util.file import mkdirp
+from inbox.util.stats import statsd_client
+from nylas.logging import get_logger
+log = get_logger()
+
+# How many uploads run at once, per process.
+UPLOAD_CONCURRENCY = 8
+# A failed upload is retried after UPLOAD_RETRY_DELAY seconds, doubling after
+# each attempt; after MAX_UPLOAD_ATTEMPTS, the blob is left in the spool
+# until the next scan.
+MAX_UPLOAD_ATTEMPTS = 5
+UPLOAD_RETRY_DELAY = 2
+SPOOL_SCAN_INTERVAL = 300
+# Files still being written to the spool have this suffix; ones older than
+# this many seconds were abandoned, and are deleted by scans.
+TEMP_SUFFIX = '.tmp'
+MAX_TEMP_FILE_AGE = 3600
+QUARANTINE_DIRECTORY = 'quarantine'
+HASH_CHUNK_SIZE = 64 * 1024
+
+_blob_spool = None
+
+
+def get_blob_spool():
+    """ This process' BlobSpool, or None if blobs are saved to S3 directly.
+    """
+    global _blob_spool
+    if (_blob_spool is None and config.get('STORE_MESSAGES_ON_S3') and
+            config.get('BLOB_UPLOAD_SPOOL_DIRECTORY')):
+        _blob_spool = BlobSpool(config['BLOB_UPLOAD_SPOOL_DIRECTORY'])
+    return _blob_spool
+
+
+def upload_to_s3(data_sha256, path):
+    from boto.s3.key import Key
+    from inbox.models.roles import get_s3_bucket
+
+    bucket = get_s3_bucket()
+    # See if it already exists; if so, don't recreate.
+    if bucket.get_key(data_sha256):
+        return
+    key = Key(bucket)
+    key.key = data_sha256
+    key.set_contents_from_filename(path)
+
+
+class BlobSpool(object):
+    """
+    Spool of blob data waiting to be uploaded.
+
+    Parameters
+    ----------
+    directory: string
+        Where the data is spooled.
+    upload: function, optional
+        Called with a sha256 and the path of the spooled file with that data
+        to upload it; upload_to_s3 by default.
+    concurrency: int, optional
+        How many uploads run at once.
+    """
+    def __init__(self, directory, upload=upload_to_s3,
+                 concurrency=UPLOAD_CONCURRENCY):
+        self.directory = directory
+        self.upload = upload
+        self.concurrency = concurrency
+        # The sha256s of the blobs queued or being uploaded.
+        self.pending = set()
+        self._queue = Queue()
+        self._greenlets = []
+        mkdirp(os.path.join(directory, QUARANTINE_DIRECTORY))
+
+    def path(self, data_sha256):
+        return os.path.join(self.directory, data_sha256)
+
+    def add(self, data_sha256, data):
+        self._write(data_sha256, lambda f: f.write(data))
+
+    def add_file(self, data_sha256, data_file):
+        self._write(data_sha256,
+                    lambda f: shutil.copyfileobj(data_file, f))
+
+    def _write(self, data_sha256, write):
+        # Write to a temporary file first, so that the spooled file only ever
+        # has all the data, even after a crash.
+        with tempfile.NamedTemporaryFile(dir=self.directory,
+                                         suffix=TEMP_SUFFIX,
+                                         delete=False) as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(f.name, self.path(data_sha256))
+        statsd_client.incr('blob_upload.spooled')
+        self._enqueue(data_sha256)
+
+    def open(self, data_sha256):
+        """ Open the spooled file with the given data, or return None if it
+            isn't in the spool (anymore).
+        """
+        try:
+            return open(self.path(data_sha256), 'rb')
+        except IOError:
+            return None
+
+    def get(self, data_sha256):
+        f = self.open(data_sha256)
+        if f is None:
+            return None
+        with f:
+            return f.read()
+
+    def start(self):
+        """ Start uploading the spooled blobs, if this hasn't already been
+            done.
+        """
+        if not self._greenlets:
+            self._greenlets = [gevent.spawn(self._upload_queued),
+                               gevent.spawn(self._scan_periodically)]
+
+    def stop(self):
+        gevent.killall(self._greenlets)
+        self._greenlets = []
+
+    def join(self, timeout=None):
+        """ Wait until there's nothing left to upload. """
+        with gevent.Timeout(timeout):
+            while self.pending:
+                gevent.sleep(0.01)
+
+    def _enqueue(self, data_sha256):
+        self.start()
+        if data_sha256 not in self.pending:
+            self.pending.add(data_sha256)
+            self._queue.put(data_sha256)
+
+    def _upload_queued(self):
+        pool = Pool(self.concurrency)
+        for data_sha256 in self._queue:
+            # Blocks while `concurrency` uploads are running.
+            pool.spawn(self._upload, data_sha256)
+
+    def _scan_periodically(self):
+        while True:
+            self.scan()
+            gevent.sleep(SPOOL_SCAN_INTERVAL)
+
+    def scan(self):
+        """ Queue up all the blobs in the spool. """
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path):
+                continue
+            if not name.endswith(TEMP_SUFFIX):
+                self._enqueue(name)
+                continue
+            try:
+                if time.time() - os.path.getmtime(path) > MAX_TEMP_FILE_AGE:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _upload(self, data_sha256):
+        path = self.path(data_sha256)
+        try:
+            try:
+                if _file_sha256(path) != data_sha256:
+                    self._quarantine(data_sha256)
+                    return
+            except (IOError, OSError):
+                # Another process using this spool uploaded it.
+                return
+
+            for attempt in range(MAX_UPLOAD_ATTEMPTS):
+                if not os.path.exists(path):
+                    # Another process using this spool uploaded it.
+                    return
+                try:
+                    self.upload(data_sha256, path)
+                    break
+                except Exception:
+                    log.warning('Error uploading blob', exc_info=True,
+                                data_sha256=data_sha256, attempt=attempt)
+                    statsd_client.incr('blob_upload.failures')
+                    if attempt + 1 < MAX_UPLOAD_ATTEMPTS:
+                        gevent.sleep(UPLOAD_RETRY_DELAY * 2 ** attempt)
+            else:
+                log.error('Failed to upload blob; leaving it in the spool',
+                          data_sha256=data_sha256)
+                return
+
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            statsd_client.incr('blob_upload.uploaded')
+        finally:
+            self.pending.discard(data_sha256)
+
+    def _quarantine(self, data_sha256):
+        log.error('Spooled blob data does not match its sha256; '
+                  'quarantining it', data_sha256=data_sha256)
+        statsd_client.incr('blob_upload.quarantined')
+        try:
+            os.rename(self.path(data_sha256),
+                      os.path.join(self.directory, QUARANTINE_DIRECTORY,
+                                   data_sha256))
+        except OSError:
+            pass
+
+
+def _file_sha256(path):
+    data_sha256 = sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), ''):
+            data_sha256.update(chunk)
+    return data_sha256.hexdigest()
@@ -1,3 +1,4 @@
+import heapq
 import itertools
 
 
@@ -25,3 +26,18 @@ def partition(pred, iterable):
     """
     t1, t2 = itertools.tee(iterable)
     return list(itertools.ifilterfalse(pred, t1)), filter(pred, t2)
+
+
+def merge_sorted(iterables, key):
+    """ Lazily merge iterables that are each sorted by key into one sorted
+        iterator, consuming them only as far as needed.
+
+        Items with equal keys are yielded in the order of the iterables they
+        come from, like a stable sort of their concatenation.
+    """
+    def decorate(index, iterable):
+        for position, item in enumerate(iterable):
+            yield key(item), index, position, item
+
+    decorated = [decorate(i, iterable) for i, iterable in enumerate(iterables)]
+    return (item for _, _, _, item in heapq.merge(*decorated))
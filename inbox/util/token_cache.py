@@ -0,0 +1,263 @@
+"""
+Cross-process cache of OAuth access tokens.
+
+Access tokens are cached per account and scope in a store shared by every
+sync, API and syncback process (Redis, in production), so that all of them
+reuse an account's token until it expires instead of each refreshing it.
+Refreshes are single-flight: while one process or greenlet refreshes an
+account's token for a scope, the others wait for it to publish the new token
+rather than hitting the provider too.
+
+The backend is picked with the TOKEN_CACHE_BACKEND config option: 'redis'
+for the shared Redis cache, or 'local' (the default) for an in-process
+stand-in with the same semantics.
+
+"""
+import json
+import time
+import uuid
+from calendar import timegm
+from datetime import datetime
+
+import gevent
+from redis import RedisError
+
+from inbox.config import config
+from inbox.util.stats import statsd_client
+from nylas.logging import get_logger
+log = get_logger()
+
+TOKEN_CACHE_DATABASE = 3
+
+# How long a refresh may hold the lock for an account and scope before other
+# processes stop waiting for it and refresh themselves.
+REFRESH_LOCK_TIMEOUT = 30
+
+# How often waiting processes check whether the token has been refreshed.
+REFRESH_POLL_INTERVAL = 0.1
+
+
+def to_timestamp(expiration):
+    """ Serialize a naive UTC datetime for caching. """
+    return timegm(expiration.utctimetuple())
+
+
+def from_timestamp(timestamp):
+    return datetime.utcfromtimestamp(timestamp)
+
+
+def token_key(account_id, scope=None):
+    if scope is None:
+        return 'token:{}'.format(account_id)
+    return 'token:{}:{}'.format(account_id, scope)
+
+
+class TokenCache(object):
+    """
+    Base class implementing expiry-aware reuse and single-flight refresh on
+    top of a backend's primitive get/set/delete and lock operations.
+
+    Cached values must be JSON-serializable.
+
+    """
+
+    def get(self, key, refresh, force_refresh=False, accept=None):
+        """
+        Return the cached value for `key`, or call `refresh` to get a new one
+        if there's none that hasn't expired, or if `force_refresh` is set.
+
+        Parameters
+        ----------
+        key: str
+            The cache key, see `token_key`.
+        refresh: callable
+            Returns a (value, expiration) tuple, where `expiration` is a naive
+            UTC datetime.
+        force_refresh: bool
+            Whether the cached value is known to be bad. A value cached by
+            another process since it was read is still used.
+        accept: callable, optional
+            Predicate on cached values; values it rejects are refreshed.
+
+        """
+        def usable(value):
+            return (value is not None and value != stale and
+                    (accept is None or accept(value)))
+
+        cached = self._get(key)
+        stale = cached if force_refresh else None
+        if usable(cached):
+            statsd_client.incr('oauth.token_cache.hits')
+            return cached
+        statsd_client.incr('oauth.token_cache.misses')
+
+        while True:
+            lock = self._acquire_lock(key)
+            if lock is not None:
+                try:
+                    # Check again, in case another refresh finished between
+                    # the read and taking the lock.
+                    cached = self._get(key)
+                    if usable(cached):
+                        return cached
+                    return self._refresh(key, refresh)
+                finally:
+                    self._release_lock(key, lock)
+
+            statsd_client.incr('oauth.token_refresh.waits')
+            gevent.sleep(REFRESH_POLL_INTERVAL)
+            cached = self._get(key)
+            if usable(cached):
+                return cached
+
+    def _refresh(self, key, refresh):
+        start = time.time()
+        try:
+            value, expiration = refresh()
+        except Exception:
+            statsd_client.incr('oauth.token_refresh.errors')
+            raise
+        statsd_client.incr('oauth.token_refresh.count')
+        statsd_client.timing('oauth.token_refresh.latency',
+                             (time.time() - start) * 1000)
+        self.set(key, value, expiration)
+        return value
+
+    def set(self, key, value, expiration):
+        ttl = to_timestamp(expiration) - int(time.time())
+        if ttl > 0:
+            self._set(key, value, ttl)
+
+    def delete(self, *keys):
+        if keys:
+            self._delete(keys)
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def _delete(self, keys):
+        raise NotImplementedError
+
+    def _acquire_lock(self, key):
+        """ Return a lock token, or None if the lock is held. """
+        raise NotImplementedError
+
+    def _release_lock(self, key, lock):
+        raise NotImplementedError
+
+
+class LocalTokenCache(TokenCache):
+    """ In-process stand-in for RedisTokenCache. """
+
+    def __init__(self):
+        # key -> (value, expiration timestamp)
+        self._values = {}
+        # key -> (lock token, expiration timestamp)
+        self._locks = {}
+
+    def _get(self, key):
+        value, expiration = self._values.get(key, (None, None))
+        if value is None or expiration <= time.time():
+            return None
+        return value
+
+    def _set(self, key, value, ttl):
+        self._values[key] = value, time.time() + ttl
+
+    def _delete(self, keys):
+        for key in keys:
+            self._values.pop(key, None)
+
+    def _acquire_lock(self, key):
+        _, expiration = self._locks.get(key, (None, None))
+        if expiration is not None and expiration > time.time():
+            return None
+        lock = uuid.uuid4().hex
+        self._locks[key] = lock, time.time() + REFRESH_LOCK_TIMEOUT
+        return lock
+
+    def _release_lock(self, key, lock):
+        if self._locks.get(key, (None, None))[0] == lock:
+            del self._locks[key]
+
+
+# Only delete the lock if we still hold it, i.e. if it hasn't expired and
+# been taken by another process in the meantime.
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+else
+    return 0
+end
+"""
+
+
+class RedisTokenCache(TokenCache):
+    """
+    Token cache shared through Redis. Values expire with the tokens they
+    hold, and locks after REFRESH_LOCK_TIMEOUT seconds, so that a process
+    dying mid-refresh can't block the others.
+
+    If Redis is unavailable, tokens are refreshed without being cached
+    rather than failing authentication.
+
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._release_script = client.register_script(RELEASE_LOCK_SCRIPT)
+
+    def _get(self, key):
+        try:
+            value = self.client.get(key)
+        except RedisError:
+            log.warning('Error reading from token cache', exc_info=True)
+            return None
+        return json.loads(value) if value is not None else None
+
+    def _set(self, key, value, ttl):
+        try:
+            self.client.setex(key, ttl, json.dumps(value))
+        except RedisError:
+            log.warning('Error writing to token cache', exc_info=True)
+
+    def _delete(self, keys):
+        try:
+            self.client.delete(*keys)
+        except RedisError:
+            log.warning('Error deleting from token cache', exc_info=True)
+
+    def _acquire_lock(self, key):
+        lock = uuid.uuid4().hex
+        try:
+            if self.client.set(key + ':lock', lock, nx=True,
+                               ex=REFRESH_LOCK_TIMEOUT):
+                return lock
+            return None
+        except RedisError:
+            log.warning('Error locking token cache', exc_info=True)
+            return lock
+
+    def _release_lock(self, key, lock):
+        try:
+            self._release_script(keys=[key + ':lock'], args=[lock])
+        except RedisError:
+            log.warning('Error unlocking token cache', exc_info=True)
+
+
+_token_cache = None
+
+
+def get_token_cache():
+    global _token_cache
+    if _token_cache is None:
+        if config.get('TOKEN_CACHE_BACKEND', 'local') == 'redis':
+            from inbox.heartbeat.config import get_redis_client
+            _token_cache = RedisTokenCache(
+                get_redis_client(db=TOKEN_CACHE_DATABASE))
+        else:
+            _token_cache = LocalTokenCache()
+    return _token_cache
@@ -0,0 +1,49 @@
+"""add incremental data processing state
+
+Revision ID: 1f06c15ae796
+Revises: 4b225df49747
+Create Date: 2015-10-08 18:21:03.154310
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1f06c15ae796'
+down_revision = '4b225df49747'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+def upgrade():
+    op.add_column('dataprocessingcache',
+                  sa.Column('contact_group_molecules', mysql.MEDIUMBLOB(),
+                            nullable=True))
+    op.add_column('dataprocessingcache',
+                  sa.Column('processed_message_ids', mysql.MEDIUMBLOB(),
+                            nullable=True))
+
+    op.create_table('dataprocessingcursor',
+                    sa.Column('created_at', sa.DateTime(), nullable=False),
+                    sa.Column('updated_at', sa.DateTime(), nullable=False),
+                    sa.Column('deleted_at', sa.DateTime(), nullable=True),
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('transaction_id', sa.Integer(), nullable=True),
+                    sa.ForeignKeyConstraint(['transaction_id'],
+                                            [u'transaction.id'], ),
+                    sa.PrimaryKeyConstraint('id')
+                    )
+    op.create_index('ix_dataprocessingcursor_created_at',
+                    'dataprocessingcursor', ['created_at'], unique=False)
+    op.create_index('ix_dataprocessingcursor_deleted_at',
+                    'dataprocessingcursor', ['deleted_at'], unique=False)
+    op.create_index('ix_dataprocessingcursor_transaction_id',
+                    'dataprocessingcursor', ['transaction_id'], unique=False)
+    op.create_index('ix_dataprocessingcursor_updated_at',
+                    'dataprocessingcursor', ['updated_at'], unique=False)
+
+
+def downgrade():
+    op.drop_table('dataprocessingcursor')
+    op.drop_column('dataprocessingcache', 'processed_message_ids')
+    op.drop_column('dataprocessingcache', 'contact_group_molecules')
@@ -0,0 +1,61 @@
+"""add materialized recurring event occurrences
+
+Revision ID: 2c1ac5a2f3d8
+Revises: 1f06c15ae796
+Create Date: 2015-10-13 20:42:17.621038
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2c1ac5a2f3d8'
+down_revision = '1f06c15ae796'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('recurringevent',
+                  sa.Column('occurrences_until', sa.DateTime(),
+                            nullable=True))
+
+    op.create_table('eventoccurrence',
+                    sa.Column('created_at', sa.DateTime(), nullable=False),
+                    sa.Column('updated_at', sa.DateTime(), nullable=False),
+                    sa.Column('deleted_at', sa.DateTime(), nullable=True),
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('namespace_id', sa.Integer(), nullable=False),
+                    sa.Column('master_event_id', sa.Integer(),
+                              nullable=False),
+                    sa.Column('override_event_id', sa.Integer(),
+                              nullable=True),
+                    sa.Column('start', sa.DateTime(), nullable=False),
+                    sa.Column('end', sa.DateTime(), nullable=False),
+                    sa.ForeignKeyConstraint(['namespace_id'],
+                                            [u'namespace.id'],
+                                            ondelete='CASCADE'),
+                    sa.ForeignKeyConstraint(['master_event_id'],
+                                            [u'event.id'],
+                                            ondelete='CASCADE'),
+                    sa.ForeignKeyConstraint(['override_event_id'],
+                                            [u'event.id'],
+                                            ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('id')
+                    )
+    op.create_index('ix_eventoccurrence_created_at',
+                    'eventoccurrence', ['created_at'], unique=False)
+    op.create_index('ix_eventoccurrence_deleted_at',
+                    'eventoccurrence', ['deleted_at'], unique=False)
+    op.create_index('ix_eventoccurrence_updated_at',
+                    'eventoccurrence', ['updated_at'], unique=False)
+    op.create_index('ix_eventoccurrence_namespace_id_start',
+                    'eventoccurrence', ['namespace_id', 'start'],
+                    unique=False)
+    op.create_index('ix_eventoccurrence_master_event_id_start',
+                    'eventoccurrence', ['master_event_id', 'start'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_table('eventoccurrence')
+    op.drop_column('recurringevent', 'occurrences_until')
@@ -0,0 +1,23 @@
+"""add calendar sync token
+
+Revision ID: 5e3f0b7c9a21
+Revises: 2c1ac5a2f3d8
+Create Date: 2015-10-15 17:03:44.118270
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5e3f0b7c9a21'
+down_revision = '2c1ac5a2f3d8'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('calendar', sa.Column('sync_token', sa.String(length=255),
+                                        nullable=True))
+
+
+def downgrade():
+    op.drop_column('calendar', 'sync_token')
@@ -0,0 +1,71 @@
+"""add carddav sync state
+
+Revision ID: 3a9f6c2d7e10
+Revises: 5e3f0b7c9a21
+Create Date: 2015-10-16 14:27:51.390412
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3a9f6c2d7e10'
+down_revision = '5e3f0b7c9a21'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('carddavaddressbook',
+                    sa.Column('created_at', sa.DateTime(), nullable=False),
+                    sa.Column('updated_at', sa.DateTime(), nullable=False),
+                    sa.Column('deleted_at', sa.DateTime(), nullable=True),
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('account_id', sa.Integer(), nullable=False),
+                    sa.Column('principal_url', sa.String(length=255),
+                              nullable=True),
+                    sa.Column('home_url', sa.String(length=255),
+                              nullable=True),
+                    sa.Column('sync_token', sa.String(length=255),
+                              nullable=True),
+                    sa.ForeignKeyConstraint(['account_id'],
+                                            [u'account.id'],
+                                            ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('id'),
+                    sa.UniqueConstraint('account_id')
+                    )
+    op.create_index('ix_carddavaddressbook_created_at',
+                    'carddavaddressbook', ['created_at'], unique=False)
+    op.create_index('ix_carddavaddressbook_deleted_at',
+                    'carddavaddressbook', ['deleted_at'], unique=False)
+    op.create_index('ix_carddavaddressbook_updated_at',
+                    'carddavaddressbook', ['updated_at'], unique=False)
+
+    op.create_table('carddavcard',
+                    sa.Column('created_at', sa.DateTime(), nullable=False),
+                    sa.Column('updated_at', sa.DateTime(), nullable=False),
+                    sa.Column('deleted_at', sa.DateTime(), nullable=True),
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('address_book_id', sa.Integer(),
+                              nullable=False),
+                    sa.Column('href', sa.String(length=255), nullable=False),
+                    sa.Column('etag', sa.String(length=255), nullable=True),
+                    sa.Column('uid', sa.String(length=64), nullable=True),
+                    sa.ForeignKeyConstraint(['address_book_id'],
+                                            [u'carddavaddressbook.id'],
+                                            ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('id')
+                    )
+    op.create_index('ix_carddavcard_created_at',
+                    'carddavcard', ['created_at'], unique=False)
+    op.create_index('ix_carddavcard_deleted_at',
+                    'carddavcard', ['deleted_at'], unique=False)
+    op.create_index('ix_carddavcard_updated_at',
+                    'carddavcard', ['updated_at'], unique=False)
+    op.create_index('ix_carddavcard_address_book_id_href',
+                    'carddavcard', ['address_book_id', 'href'],
+                    unique=False, mysql_length={'href': 191})
+
+
+def downgrade():
+    op.drop_table('carddavcard')
+    op.drop_table('carddavaddressbook')
@@ -0,0 +1,72 @@
+"""add event intervals for free/busy queries
+
+Revision ID: 4d8e2b61f0a3
+Revises: 3a9f6c2d7e10
+Create Date: 2015-10-19 11:52:08.413296
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4d8e2b61f0a3'
+down_revision = '3a9f6c2d7e10'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('eventinterval',
+                    sa.Column('created_at', sa.DateTime(), nullable=False),
+                    sa.Column('updated_at', sa.DateTime(), nullable=False),
+                    sa.Column('deleted_at', sa.DateTime(), nullable=True),
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('calendar_id', sa.Integer(), nullable=False),
+                    sa.Column('event_id', sa.Integer(), nullable=False),
+                    sa.Column('start', sa.DateTime(), nullable=False),
+                    sa.Column('end', sa.DateTime(), nullable=False),
+                    sa.Column('busy', sa.Boolean(), nullable=False),
+                    sa.ForeignKeyConstraint(['calendar_id'],
+                                            [u'calendar.id'],
+                                            ondelete='CASCADE'),
+                    sa.ForeignKeyConstraint(['event_id'], [u'event.id'],
+                                            ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('id')
+                    )
+    op.create_index('ix_eventinterval_created_at',
+                    'eventinterval', ['created_at'], unique=False)
+    op.create_index('ix_eventinterval_deleted_at',
+                    'eventinterval', ['deleted_at'], unique=False)
+    op.create_index('ix_eventinterval_updated_at',
+                    'eventinterval', ['updated_at'], unique=False)
+    op.create_index('ix_eventinterval_event_id',
+                    'eventinterval', ['event_id'], unique=False)
+    op.create_index('ix_eventinterval_calendar_id_end_start',
+                    'eventinterval', ['calendar_id', 'end', 'start'],
+                    unique=False)
+
+    # Non-recurring events.
+    op.execute("""
+        INSERT INTO eventinterval
+            (created_at, updated_at, calendar_id, event_id, start, end, busy)
+        SELECT NOW(), NOW(), calendar_id, id, start, end, busy
+        FROM event
+        WHERE discriminator = 'event' AND status != 'cancelled'
+    """)
+    # Materialized occurrences of recurring events. Recurring events that
+    # haven't been materialized yet get their intervals when they are.
+    op.execute("""
+        INSERT INTO eventinterval
+            (created_at, updated_at, calendar_id, event_id, start, end, busy)
+        SELECT NOW(), NOW(), master.calendar_id, master.id,
+               eventoccurrence.start, eventoccurrence.end,
+               COALESCE(override.busy, master.busy)
+        FROM eventoccurrence
+        JOIN event AS master ON master.id = eventoccurrence.master_event_id
+        LEFT JOIN event AS override
+            ON override.id = eventoccurrence.override_event_id
+        WHERE master.status != 'cancelled'
+    """)
+
+
+def downgrade():
+    op.drop_table('eventinterval')
@@ -0,0 +1,23 @@
+"""add the id range of the records covered by bulk actions
+
+Revision ID: 2b7f4c8e1a93
+Revises: 4d8e2b61f0a3
+Create Date: 2015-10-22 15:03:11.240815
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2b7f4c8e1a93'
+down_revision = '4d8e2b61f0a3'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('actionlog',
+                  sa.Column('last_record_id', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('actionlog', 'last_record_id')
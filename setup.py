@@ -82,6 +82,8 @@ setup(
              'bin/contact-search-service',
              'bin/contact-search-backfill',
              'bin/contact-search-delete-index',
+             'bin/data-processing-service',
+             'bin/event-occurrence-service',
              ],
 
     # See:
@@ -0,0 +1,122 @@
+import json
+
+from inbox.models import ActionLog, Transaction
+from tests.api.base import api_client, new_api_client
+from tests.util.base import (add_fake_category, add_fake_message,
+                             add_fake_thread)
+
+__all__ = ['api_client']
+
+
+def latest_action(db, namespace, action):
+    return db.session.query(ActionLog).filter(
+        ActionLog.namespace_id == namespace.id,
+        ActionLog.action == action).order_by(ActionLog.id.desc()).first()
+
+
+def test_batch_read(db, api_client, message, thread, contact, event):
+    missing_id = 'doesnotexist'
+    response = api_client.get_data(
+        '/batch?messages={},{}&threads={}&contacts={}&events={}'.format(
+            message.public_id, missing_id, thread.public_id,
+            contact.public_id, event.public_id))
+
+    assert response['messages'][0] == \
+        api_client.get_data('/messages/{}'.format(message.public_id))
+    assert response['messages'][1]['id'] == missing_id
+    assert response['messages'][1]['object'] == 'message'
+    assert 'error' in response['messages'][1]
+    assert response['threads'] == \
+        [api_client.get_data('/threads/{}'.format(thread.public_id))]
+    assert response['contacts'][0]['id'] == contact.public_id
+    assert response['events'][0]['id'] == event.public_id
+
+    expanded = api_client.get_data('/batch?threads={}&view=expanded'.format(
+        thread.public_id))
+    assert 'messages' in expanded['threads'][0]
+
+
+def test_batch_read_validation(db, api_client):
+    assert api_client.get_raw('/batch').status_code == 400
+    assert api_client.get_raw('/batch?messages=not-an-id').status_code == 400
+    too_many = ','.join(['abc'] * 1001)
+    assert api_client.get_raw(
+        '/batch?threads={}'.format(too_many)).status_code == 400
+
+
+def test_bulk_update(db, api_client, default_namespace):
+    thread = add_fake_thread(db.session, default_namespace.id)
+    thread_messages = [add_fake_message(db.session, default_namespace.id,
+                                        thread) for _ in range(3)]
+    other_message = add_fake_message(
+        db.session, default_namespace.id,
+        add_fake_thread(db.session, default_namespace.id))
+    label = add_fake_category(db.session, default_namespace.id,
+                              'Bulk label')
+    messages = thread_messages + [other_message]
+    thread_version = thread.version
+
+    response = api_client.put_data('/batch', {
+        'threads': [thread.public_id],
+        'messages': [other_message.public_id],
+        'unread': False,
+        'add_label_ids': [label.public_id]})
+    assert json.loads(response.data) == {'updated_messages': 4}
+
+    db.session.expire_all()
+    for message in messages:
+        assert message.is_read
+        assert label in message.categories
+        assert message.categories_changes
+    assert thread.version == thread_version + 1
+
+    message_ids = sorted(message.id for message in messages)
+    for action in ('bulk_mark_unread', 'bulk_change_labels'):
+        entry = latest_action(db, default_namespace, action)
+        assert entry.extra_args['record_ids'] == message_ids
+    assert latest_action(db, default_namespace,
+                         'bulk_change_labels').extra_args['added_labels'] == \
+        ['Bulk label']
+    assert db.session.query(Transaction).filter(
+        Transaction.object_public_id == thread.public_id,
+        Transaction.command == 'update').count()
+
+    # Nothing left to change.
+    response = api_client.put_data('/batch', {
+        'threads': [thread.public_id],
+        'unread': False,
+        'add_label_ids': [label.public_id]})
+    assert json.loads(response.data) == {'updated_messages': 0}
+
+
+def test_bulk_move(db, generic_account):
+    namespace = generic_account.namespace
+    api_client = new_api_client(db, namespace)
+    thread = add_fake_thread(db.session, namespace.id)
+    received = add_fake_message(db.session, namespace.id, thread)
+    sent = add_fake_message(db.session, namespace.id, thread,
+                            add_sent_category=True)
+    archive = add_fake_category(db.session, namespace.id, 'Archive',
+                                'archive')
+
+    response = api_client.put_data('/batch', {
+        'threads': [thread.public_id], 'folder_id': archive.public_id})
+    assert json.loads(response.data) == {'updated_messages': 1}
+
+    db.session.expire_all()
+    assert received.categories == {archive}
+    assert archive not in sent.categories
+    entry = latest_action(db, namespace, 'bulk_move')
+    assert entry.extra_args == {'record_ids': [received.id],
+                                'destination': 'Archive'}
+
+
+def test_bulk_update_validation(db, api_client, default_namespace):
+    thread = add_fake_thread(db.session, default_namespace.id)
+    assert api_client.put_data('/batch', {'unread': True}).status_code == 400
+    assert api_client.put_data('/batch', {
+        'threads': ['doesnotexist'], 'unread': True}).status_code == 404
+    # Gmail accounts have labels, not folders.
+    assert api_client.put_data('/batch', {
+        'threads': [thread.public_id],
+        'folder_id': thread.public_id}).status_code == 400
@@ -0,0 +1,54 @@
+import json
+import zlib
+
+import pytest
+from inbox.config import config
+from inbox.util.url import url_concat
+from tests.api.base import api_client
+
+__all__ = ['api_client']
+
+
+def decompress(data, encoding):
+    wbits = 16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS
+    return zlib.decompress(data, wbits)
+
+
+@pytest.mark.parametrize('encoding', ['gzip', 'deflate'])
+def test_compressed_response(db, api_client, message, monkeypatch, encoding):
+    monkeypatch.setitem(config, 'API_COMPRESSION_MIN_SIZE', 0)
+    plain = api_client.get_raw('/messages')
+    assert 'Content-Encoding' not in plain.headers
+
+    response = api_client.get_raw('/messages',
+                                  headers={'Accept-Encoding': encoding})
+    assert response.headers['Content-Encoding'] == encoding
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert json.loads(decompress(response.data, encoding)) == \
+        json.loads(plain.data)
+
+
+def test_negotiation(db, api_client, monkeypatch):
+    monkeypatch.setitem(config, 'API_COMPRESSION_MIN_SIZE', 0)
+    response = api_client.get_raw(
+        '/account', headers={'Accept-Encoding': 'gzip;q=0.5, deflate'})
+    assert response.headers['Content-Encoding'] == 'deflate'
+    response = api_client.get_raw(
+        '/account', headers={'Accept-Encoding': 'gzip;q=0, identity'})
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_small_response_not_compressed(db, api_client):
+    response = api_client.get_raw('/account',
+                                  headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    json.loads(response.data)
+
+
+def test_compressed_stream(db, api_client):
+    url = url_concat('/delta/streaming', {'timeout': .1, 'cursor': '0'})
+    response = api_client.get_raw(url, headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    for line in decompress(response.data, 'gzip').split('\n'):
+        if line:
+            assert 'cursor' in json.loads(line)
@@ -146,3 +146,85 @@ def test_contact_groups(db, api_client, default_namespace):
         assert cached_data.contact_groups_last_updated is not None
     except (NoResultFound, AssertionError):
         assert False, "Contact groups not cached"
+
+
+def test_contact_scores_updated_incrementally(db, api_client,
+                                              default_namespace):
+    from inbox.transactions.data_processing import update_contact_scores
+    namespace_id = default_namespace.id
+    me = ('me', default_namespace.email_address)
+
+    def send(recipients_list):
+        fake_thread = add_fake_thread(db.session, namespace_id)
+        return add_fake_message(db.session, namespace_id, fake_thread,
+                                subject='Froop',
+                                from_addr=[me],
+                                to_addr=recipients_list,
+                                add_sent_category=True).id
+
+    for _ in range(3):
+        send([('x', 'x@nylas.com'), ('y', 'y@nylas.com')])
+    update_contact_scores(db.session, namespace_id, recompute=True)
+    db.session.commit()
+
+    message_ids = [send([('z', 'z@nylas.com')]) for _ in range(5)]
+    message_ids += [send([('v', 'v@nylas.com'), ('w', 'w@nylas.com')])
+                    for _ in range(3)]
+    update_contact_scores(db.session, namespace_id, message_ids)
+    db.session.commit()
+    # Messages that were already folded in aren't counted again.
+    update_contact_scores(db.session, namespace_id, message_ids)
+    db.session.commit()
+
+    # The endpoints only read what was accumulated above.
+    resp = api_client.get_raw('/contacts/rankings')
+    assert resp.status_code == 200
+    emails_scores = {e: s for (e, s) in json.loads(resp.data)}
+    assert emails_scores['z@nylas.com'] > emails_scores['x@nylas.com']
+    assert abs(emails_scores['x@nylas.com'] - 3) < 0.01
+    assert abs(emails_scores['z@nylas.com'] - 5) < 0.01
+
+    resp = api_client.get_raw('/groups/intrinsic')
+    assert resp.status_code == 200
+    groups_scores = {g: s for (g, s) in json.loads(resp.data)}
+    assert 'x@nylas.com, y@nylas.com' in groups_scores
+    assert 'v@nylas.com, w@nylas.com' in groups_scores
+
+
+def test_draft_sent_after_newer_message_is_scored(db, api_client,
+                                                  default_namespace):
+    from inbox.models import Category
+    from inbox.transactions.data_processing import update_contact_scores
+    namespace_id = default_namespace.id
+    me = ('me', default_namespace.email_address)
+
+    draft = add_fake_message(db.session, namespace_id,
+                             add_fake_thread(db.session, namespace_id),
+                             from_addr=[me],
+                             to_addr=[('draft', 'draft@nylas.com')])
+    draft.is_draft = True
+    db.session.commit()
+    update_contact_scores(db.session, namespace_id, recompute=True)
+    db.session.commit()
+
+    other = add_fake_message(db.session, namespace_id,
+                             add_fake_thread(db.session, namespace_id),
+                             from_addr=[me],
+                             to_addr=[('other', 'other@nylas.com')],
+                             add_sent_category=True)
+    update_contact_scores(db.session, namespace_id, [other.id])
+    db.session.commit()
+
+    # Sending the draft keeps its (older) id.
+    draft.is_draft = False
+    draft.categories.add(Category.find_or_create(
+        db.session, namespace_id, 'sent', 'sent', type_='folder'))
+    db.session.commit()
+    update_contact_scores(db.session, namespace_id, [draft.id])
+    db.session.commit()
+
+    resp = api_client.get_raw('/contacts/rankings')
+    assert resp.status_code == 200
+    emails = {e for (e, s) in json.loads(resp.data)}
+    assert 'other@nylas.com' in emails
+    assert 'draft@nylas.com' in emails
@@ -0,0 +1,87 @@
+import arrow
+import pytest
+
+from inbox.models.event import EventInterval, RecurringEvent
+from tests.api.base import api_client
+from tests.util.base import add_fake_calendar, add_fake_event
+from tests.events.test_recurrence import recurring_event, TEST_EXDATE_RULE
+
+__all__ = ['api_client']
+
+DAY = arrow.get(2015, 11, 2)
+
+
+def at(hours, minutes=0):
+    return DAY.replace(hours=+hours, minutes=+minutes)
+
+
+@pytest.fixture
+def free_busy_calendar(db, default_namespace):
+    return add_fake_calendar(db.session, default_namespace.id,
+                             name='Free busy', uid='freebusyuid')
+
+
+def busy_slots(api_client, calendar, start, end):
+    response = api_client.get_data(
+        '/free-busy?calendar_id={}&start={}&end={}'.format(
+            calendar.public_id, start.timestamp, end.timestamp))
+    assert response['calendar_ids'] == [calendar.public_id]
+    return [(slot['start_time'], slot['end_time'])
+            for slot in response['time_slots']]
+
+
+def test_free_busy_merges_busy_intervals(db, api_client, default_namespace,
+                                         free_busy_calendar):
+    def add_event(start, end, busy=True):
+        return add_fake_event(db.session, default_namespace.id,
+                              calendar=free_busy_calendar, busy=busy,
+                              start=start, end=end)
+
+    add_event(at(9), at(10))
+    add_event(at(9, 30), at(11))
+    add_event(at(11), at(11, 30))
+    add_event(at(13), at(14), busy=False)
+    cancelled = add_event(at(15), at(16))
+    add_event(at(17), at(19))
+    moved = add_event(at(20), at(21))
+
+    cancelled.status = 'cancelled'
+    moved.start = at(7)
+    moved.end = at(8)
+    db.session.commit()
+
+    assert busy_slots(api_client, free_busy_calendar, at(6), at(18)) == [
+        (at(7).timestamp, at(8).timestamp),
+        (at(9).timestamp, at(11, 30).timestamp),
+        (at(17).timestamp, at(18).timestamp)]
+
+
+def test_free_busy_expands_recurring_events(db, api_client, default_account,
+                                            free_busy_calendar):
+    master = recurring_event(db, default_account, free_busy_calendar,
+                             TEST_EXDATE_RULE)
+    master.busy = True
+    db.session.commit()
+    expected = [(e.start.timestamp, e.end.timestamp)
+                for e in master.inflate()]
+    start, end = arrow.get(2014, 8, 1), arrow.get(2014, 10, 1)
+
+    assert busy_slots(api_client, free_busy_calendar, start, end) == expected
+
+    # Recurring events that haven't been materialized are expanded on the
+    # fly.
+    db.session.query(EventInterval).filter(
+        EventInterval.event_id == master.id).delete()
+    db.session.execute(RecurringEvent.__table__.update().values(
+        occurrences_until=None))
+    db.session.commit()
+    assert busy_slots(api_client, free_busy_calendar, start, end) == expected
+
+
+def test_free_busy_validation(api_client, free_busy_calendar):
+    response = api_client.get_raw('/free-busy?start={}'.format(
+        at(9).timestamp))
+    assert response.status_code == 400
+    response = api_client.get_raw('/free-busy?start={}&end={}'.format(
+        at(9).timestamp, at(8).timestamp))
+    assert response.status_code == 400
@@ -0,0 +1,27 @@
+from inbox.api.namespace_cache import get_namespace_info
+
+
+def test_namespace_info_cached(db, default_namespace):
+    info = get_namespace_info(default_namespace.public_id, db.session)
+    assert info.id == default_namespace.id
+    assert info.account_id == default_namespace.account_id
+    assert info.provider == 'gmail'
+    # Cache hits don't need a session.
+    assert get_namespace_info(default_namespace.public_id) is info
+
+    # Updating the account, e.g. disabling it, invalidates the entry.
+    default_namespace.account.disable_sync('test')
+    db.session.commit()
+    assert get_namespace_info(default_namespace.public_id,
+                              db.session) is not info
+
+    assert get_namespace_info('doesnotexist', db.session) is None
+
+
+def test_namespace_cache_miss_counted_once(db, monkeypatch):
+    from inbox.util.stats import statsd_client
+    counted = []
+    monkeypatch.setattr(statsd_client, 'incr', counted.append)
+    # Looks the namespace up in a new session.
+    assert get_namespace_info('doesnotexist') is None
+    assert counted == ['api.namespace_cache.misses']
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import os
 import smtplib
 import json
 import time
@@ -36,6 +37,31 @@ class MockGoogleTokenManager(object):
         raise OAuthError()
 
 
+class BaseMockSMTPConnection(object):
+    messages_sent = 0
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, value, traceback):
+        pass
+
+    def is_healthy(self):
+        return True
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def clear_smtp_connection_pools(monkeypatch):
+    # Don't reuse the mock connections of other tests.
+    monkeypatch.setattr('inbox.sendmail.smtp.postel._connection_pools', {})
+
+
 @pytest.fixture
 def patch_token_manager(monkeypatch):
     monkeypatch.setattr('inbox.sendmail.smtp.postel.default_token_manager',
@@ -56,19 +82,11 @@ def disallow_auth(monkeypatch):
 def patch_smtp(patch_token_manager, monkeypatch):
     submitted_messages = []
 
-    class MockSMTPConnection(object):
-
-        def __init__(self, *args, **kwargs):
-            pass
-
-        def __enter__(self):
-            return self
-
-        def __exit__(self, exc_type, value, traceback):
-            pass
+    class MockSMTPConnection(BaseMockSMTPConnection):
 
         def sendmail(self, recipients, msg):
-            submitted_messages.append((recipients, msg))
+            # Messages with attachments are streamed.
+            submitted_messages.append((recipients, str(msg)))
 
     monkeypatch.setattr('inbox.sendmail.smtp.postel.SMTPConnection',
                         MockSMTPConnection)
@@ -76,16 +94,7 @@ def patch_smtp(patch_token_manager, monkeypatch):
 
 
 def erring_smtp_connection(exc_type, *args):
-    class ErringSMTPConnection(object):
-
-        def __init__(self, *args, **kwargs):
-            pass
-
-        def __enter__(self):
-            return self
-
-        def __exit__(self, exc_type, value, traceback):
-            pass
+    class ErringSMTPConnection(BaseMockSMTPConnection):
 
         def sendmail(self, recipients, msg):
             raise exc_type(*args)
@@ -625,3 +634,26 @@ def test_sent_messages_shown_in_delta(patch_smtp, api_client, example_draft):
     assert message_delta is not None
     assert message_delta['object'] == 'message'
     assert message_delta['event'] == 'create'
+
+
+def test_sending_with_attachments(patch_smtp, api_client, example_draft):
+    attachments = {}
+    file_ids = []
+    for filename in ('muir.jpg', 'LetMeSendYouEmail.wav'):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                            'data', filename)
+        with open(path, 'rb') as f:
+            attachments[filename] = f.read()
+        r = api_client.post_raw('/files',
+                                data={'file': (open(path, 'rb'), filename)})
+        assert r.status_code == 200
+        file_ids.append(json.loads(r.data)[0]['id'])
+
+    r = api_client.post_data('/send', dict(example_draft, file_ids=file_ids))
+    assert r.status_code == 200
+
+    _, msg = patch_smtp[-1]
+    parsed = mime.from_string(msg)
+    sent_attachments = {part.detected_file_name: part.body
+                        for part in parsed.walk() if part.is_attachment()}
+    assert sent_attachments == attachments
@@ -1,3 +1,4 @@
+import json
 import pytest
 from tests.api.base import api_client
 
@@ -23,3 +24,45 @@ def test_resource_views(resource_name, db, api_client,
         assert isinstance(ids[i], basestring), \
             "&views=ids should return string"
         assert elem["id"] == ids[i], "view=ids should preserve order"
+
+
+def test_json_formatting(db, api_client, message):
+    response = api_client.get_raw('/messages')
+    assert response.is_streamed
+    assert '\n' not in response.data
+    compact = json.loads(response.data)
+
+    response = api_client.get_raw('/messages?pretty=true')
+    assert not response.is_streamed
+    assert '\n    ' in response.data
+    assert json.loads(response.data) == compact
+
+    response = api_client.get_raw('/messages?pretty=maybe')
+    assert response.status_code == 400
+
+    # Other endpoints, which may write, don't stream their lists.
+    response = api_client.get_raw('/contacts')
+    assert not response.is_streamed
+    assert '\n' not in response.data
+
+
+def test_sparse_fields(db, api_client, message):
+    messages = api_client.get_data('/messages?fields=subject,date')
+    assert messages
+    for msg in messages:
+        assert set(msg) == {'id', 'object', 'subject', 'date'}
+
+    full = api_client.get_data('/messages')
+    selected = api_client.get_data('/messages?fields=body,files,unread')
+    assert selected == [{key: msg[key] for key in
+                         ('id', 'object', 'body', 'files', 'unread')}
+                        for msg in full]
+
+    for view in ('', '&view=expanded'):
+        threads = api_client.get_data('/threads?fields=subject,unread' + view)
+        assert threads
+        for thread in threads:
+            assert set(thread) == {'id', 'object', 'subject', 'unread'}
+
+    response = api_client.get_raw('/messages?fields=,')
+    assert response.status_code == 400
@@ -0,0 +1,53 @@
+import time
+from datetime import datetime, timedelta
+
+import gevent
+from gevent.event import Event
+
+from inbox.util.token_cache import LocalTokenCache
+
+
+def expiration(seconds=3600):
+    return datetime.utcnow() + timedelta(seconds=seconds)
+
+
+class Refresher(object):
+    def __init__(self, release=None):
+        self.calls = 0
+        self.release = release
+
+    def __call__(self):
+        self.calls += 1
+        if self.release is not None:
+            self.release.wait()
+        return 'token_{}'.format(self.calls), expiration()
+
+
+def test_cached_token_reused_until_expired(monkeypatch):
+    cache = LocalTokenCache()
+    refresh = Refresher()
+    assert cache.get('token:1', refresh) == 'token_1'
+    assert cache.get('token:1', refresh) == 'token_1'
+    assert refresh.calls == 1
+
+    assert cache.get('token:1', refresh, force_refresh=True) == 'token_2'
+    assert cache.get('token:1', refresh,
+                     accept=lambda token: token != 'token_2') == 'token_3'
+
+    later = time.time() + 7200
+    monkeypatch.setattr('inbox.util.token_cache.time.time', lambda: later)
+    assert cache.get('token:1', lambda: ('token_4', expiration(10000))) == \
+        'token_4'
+
+
+def test_concurrent_refreshes_are_single_flight():
+    cache = LocalTokenCache()
+    release = Event()
+    refresh = Refresher(release)
+    greenlets = [gevent.spawn(cache.get, 'token:2', refresh,
+                              force_refresh=True) for _ in range(5)]
+    gevent.sleep(0)
+    release.set()
+    gevent.joinall(greenlets, raise_error=True)
+    assert [g.value for g in greenlets] == ['token_1'] * 5
+    assert refresh.calls == 1
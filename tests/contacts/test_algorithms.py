@@ -0,0 +1,113 @@
+"""Check the bitset-based social molecule computation against a direct,
+set-based implementation of the same algorithm."""
+import random
+from collections import defaultdict
+
+import pytest
+
+from inbox.contacts.algorithms import (calculate_group_scores_from_molecules,
+                                       MIN_GROUP_SIZE, MIN_MESSAGE_COUNT,
+                                       SELF_IDENTITY_THRESHOLD,
+                                       JACCARD_THRESHOLD,
+                                       SOCIAL_MOLECULE_EXPANSION_LIMIT)
+
+
+def reference_group_scores(molecule_weights):
+    def weight(keys):
+        return sum(molecule_weights[k] for k in keys)
+
+    molecules_dict = defaultdict(set)
+    for key in molecule_weights:
+        molecules_dict[key].add(key)
+
+    if len(molecules_dict) < SOCIAL_MOLECULE_EXPANSION_LIMIT:
+        items = [(set(g), m) for (g, m) in molecules_dict.items()]
+        for i in xrange(len(items)):
+            g1, m1 = items[i]
+            for j in xrange(i, len(items)):
+                g2, m2 = items[j]
+                new = tuple(sorted(g1 & g2))
+                if len(new) >= MIN_GROUP_SIZE:
+                    molecules_dict[new] = molecules_dict[new] | m1 | m2
+
+    molecules = [(set(g), set(m)) for (g, m) in molecules_dict.items()
+                 if weight(m) >= MIN_MESSAGE_COUNT]
+
+    molecules.sort(key=lambda x: (-len(x[0]), tuple(sorted(x[0]))))
+    subsumed = [False] * len(molecules)
+    for i in xrange(1, len(molecules)):
+        g1, m1 = molecules[i]
+        for j in xrange(i):
+            if subsumed[j]:
+                continue
+            g2, m2 = molecules[j]
+            if g1 <= g2:
+                error = ((len(g2) - len(g1)) * (weight(m1) - weight(m2)) /
+                         (1.0 * len(g2) * weight(m1)))
+                if error < SELF_IDENTITY_THRESHOLD:
+                    subsumed[i] = True
+                    break
+    molecules = [m for (m, dead) in zip(molecules, subsumed) if not dead]
+
+    start = 0
+    while start < len(molecules):
+        combined = [False] * len(molecules)
+        new_guys = []
+        for j in xrange(start, len(molecules)):
+            for i in xrange(0, j):
+                if combined[i]:
+                    continue
+                (g1, m1), (g2, m2) = molecules[i], molecules[j]
+                if len(g1 & g2) / float(len(g1 | g2)) > JACCARD_THRESHOLD:
+                    new_guys.append((g1 | g2, m1 | m2))
+                    combined[i] = combined[j] = True
+                    break
+        molecules = [m for (m, c) in zip(molecules, combined) if not c]
+        start = len(molecules)
+        molecules.extend(new_guys)
+
+    return {', '.join(sorted(g)): weight(m) for (g, m) in molecules}
+
+
+def assert_equivalent(molecule_weights):
+    expected = reference_group_scores(molecule_weights)
+    result = calculate_group_scores_from_molecules(molecule_weights)
+    assert set(result) == set(expected)
+    for group, score in expected.iteritems():
+        assert abs(result[group] - score) < 1e-6
+
+
+def test_api_fixture_groups():
+    # The recipient lists sent in tests/api/test_data_processing.py.
+    molecule_weights = {
+        ('a@nylas.com', 'b@nylas.com', 'c@nylas.com'): 8,
+        ('b@nylas.com', 'c@nylas.com', 'd@nylas.com'): 8,
+        ('d@nylas.com', 'e@nylas.com', 'f@nylas.com'): 8,
+        ('g@nylas.com', 'h@nylas.com', 'i@nylas.com', 'j@nylas.com'): 5,
+        ('g@nylas.com', 'h@nylas.com', 'i@nylas.com'): 2,
+        ('k@nylas.com', 'l@nylas.com'): 3}
+    assert_equivalent(molecule_weights)
+    result = calculate_group_scores_from_molecules(molecule_weights)
+    assert set(result) == {
+        'a@nylas.com, b@nylas.com, c@nylas.com, d@nylas.com',
+        'd@nylas.com, e@nylas.com, f@nylas.com',
+        'g@nylas.com, h@nylas.com, i@nylas.com, j@nylas.com',
+        'k@nylas.com, l@nylas.com'}
+
+
+def test_string_keys():
+    result = calculate_group_scores_from_molecules(
+        {'x@nylas.com, y@nylas.com': 3.0})
+    assert result == {'x@nylas.com, y@nylas.com': 3.0}
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_random_molecules(seed):
+    rng = random.Random(seed)
+    people = ['p{}@example.com'.format(i) for i in range(30)]
+    molecule_weights = defaultdict(float)
+    for _ in range(300):
+        size = rng.randint(MIN_GROUP_SIZE, 6)
+        group = tuple(sorted(rng.sample(people, size)))
+        molecule_weights[group] += rng.uniform(0.01, 1)
+    assert_equivalent(molecule_weights)
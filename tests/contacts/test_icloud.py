@@ -0,0 +1,208 @@
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+import pytest
+import lxml.etree as ET
+from requests.models import Response
+
+from inbox.contacts.remote_sync import ContactSync
+from inbox.models import Contact
+from inbox.models.carddav import CardDavAddressBook
+
+PRINCIPAL = '/1234/principal/'
+HOME_URL = 'https://p01-contacts.icloud.com/1234/carddavhome/'
+CARDS_PATH = '/1234/carddavhome/card/'
+
+VCARD = ('BEGIN:VCARD\r\nVERSION:3.0\r\nUID:{uid}\r\nFN:{name}\r\n'
+         'EMAIL:{email}\r\nEND:VCARD\r\n')
+
+
+class Raw(BytesIO):
+    decode_content = False
+
+
+class CardDavServerStub(object):
+    """
+    Stand-in for requests.Session that implements just enough of an iCloud
+    CardDAV server for contact sync: principal and address book home
+    discovery, sync-collection and addressbook-multiget.
+
+    """
+    def __init__(self):
+        self.headers = {}
+        self.auth = None
+        self.verify = True
+        # href -> (etag, vcard, version the card was last modified in)
+        self.cards = {}
+        # href -> version the card was removed in
+        self.removed = {}
+        self.version = 0
+        self.min_valid_version = 0
+        self.requests = []
+
+    def put(self, uid, name, email):
+        self.version += 1
+        href = CARDS_PATH + uid + '.vcf'
+        self.cards[href] = ('"etag-{}"'.format(self.version),
+                            VCARD.format(uid=uid, name=name, email=email),
+                            self.version)
+        self.removed.pop(href, None)
+
+    def remove(self, uid):
+        self.version += 1
+        href = CARDS_PATH + uid + '.vcf'
+        del self.cards[href]
+        self.removed[href] = self.version
+
+    def expire_sync_tokens(self):
+        self.min_valid_version = self.version + 1
+
+    def request(self, method, url, data=None, headers=None, stream=False):
+        body = ET.XML(data)
+        self.requests.append((method, url, body))
+        if body.tag == '{DAV:}propfind' and url.endswith(PRINCIPAL):
+            return self._multistatus(
+                '<D:response><D:href>{}</D:href><D:propstat><D:prop>'
+                '<C:addressbook-home-set><D:href>{}</D:href>'
+                '</C:addressbook-home-set></D:prop></D:propstat>'
+                '</D:response>'.format(PRINCIPAL, HOME_URL))
+        elif body.tag == '{DAV:}propfind':
+            return self._multistatus(
+                '<D:response><D:href>/</D:href><D:propstat><D:prop>'
+                '<D:current-user-principal><D:href>{}</D:href>'
+                '</D:current-user-principal></D:prop></D:propstat>'
+                '</D:response>'.format(PRINCIPAL))
+        elif body.tag == '{DAV:}sync-collection':
+            return self._sync_collection(body.findtext('{DAV:}sync-token'))
+        else:
+            hrefs = [e.text for e in body.iterfind('{DAV:}href')]
+            return self._multiget(hrefs)
+
+    def _sync_collection(self, sync_token):
+        since = 0
+        if sync_token:
+            since = int(sync_token.split('-')[1])
+            if since < self.min_valid_version:
+                return self._response(
+                    403, '<D:error xmlns:D="DAV:"><D:valid-sync-token/>'
+                         '</D:error>')
+        responses = []
+        for href, (etag, _, version) in self.cards.iteritems():
+            if version > since:
+                responses.append(
+                    '<D:response><D:href>{}</D:href><D:propstat><D:prop>'
+                    '<D:getetag>{}</D:getetag></D:prop>'
+                    '<D:status>HTTP/1.1 200 OK</D:status></D:propstat>'
+                    '</D:response>'.format(href, escape(etag)))
+        if since:
+            for href, version in self.removed.iteritems():
+                if version > since:
+                    responses.append(
+                        '<D:response><D:href>{}</D:href>'
+                        '<D:status>HTTP/1.1 404 Not Found</D:status>'
+                        '</D:response>'.format(href))
+        responses.append('<D:sync-token>token-{}</D:sync-token>'.format(
+            self.version))
+        return self._multistatus(''.join(responses))
+
+    def _multiget(self, hrefs):
+        responses = []
+        for href in hrefs:
+            etag, vcard, _ = self.cards[href]
+            responses.append(
+                '<D:response><D:href>{}</D:href><D:propstat><D:prop>'
+                '<D:getetag>{}</D:getetag>'
+                '<C:address-data>{}</C:address-data></D:prop>'
+                '<D:status>HTTP/1.1 200 OK</D:status></D:propstat>'
+                '</D:response>'.format(href, escape(etag), escape(vcard)))
+        return self._multistatus(''.join(responses))
+
+    def _multistatus(self, content):
+        return self._response(
+            207, '<D:multistatus xmlns:D="DAV:" '
+                 'xmlns:C="urn:ietf:params:xml:ns:carddav">{}'
+                 '</D:multistatus>'.format(content))
+
+    def _response(self, status_code, content):
+        response = Response()
+        response.status_code = status_code
+        response.reason = 'stub'
+        response.raw = Raw(content)
+        return response
+
+    def multiget_hrefs(self):
+        return sorted(e.text for method, url, body in self.requests
+                      for e in body.iterfind('{DAV:}href')
+                      if body.tag.endswith('addressbook-multiget'))
+
+
+@pytest.fixture
+def carddav_server(monkeypatch):
+    server = CardDavServerStub()
+    monkeypatch.setattr('inbox.contacts.carddav.requests.Session',
+                        lambda: server)
+    monkeypatch.setattr('inbox.contacts.icloud.supports_carddav',
+                        lambda url: None)
+    return server
+
+
+@pytest.fixture
+def icloud_contact_sync(db, generic_account, carddav_server):
+    generic_account.provider = 'icloud'
+    db.session.commit()
+    return ContactSync(generic_account.email_address, 'icloud',
+                       generic_account.id, generic_account.namespace.id)
+
+
+def icloud_contacts(db, account):
+    db.session.expire_all()
+    return {c.uid: (c.name, c.email_address) for c in
+            db.session.query(Contact).filter(
+                Contact.namespace_id == account.namespace.id,
+                Contact.provider_name == 'icloud')}
+
+
+def test_incremental_sync(db, generic_account, carddav_server,
+                          icloud_contact_sync):
+    carddav_server.put('alice', 'Alice', 'alice@example.com')
+    carddav_server.put('bob', 'Bob', 'bob@example.com')
+    icloud_contact_sync.sync()
+    assert icloud_contacts(db, generic_account) == {
+        'alice': ('Alice', 'alice@example.com'),
+        'bob': ('Bob', 'bob@example.com')}
+    address_book = db.session.query(CardDavAddressBook).filter(
+        CardDavAddressBook.account_id == generic_account.id).one()
+    assert address_book.home_url == HOME_URL
+    assert address_book.sync_token == 'token-2'
+    assert address_book.cards.count() == 2
+
+    carddav_server.requests = []
+    carddav_server.put('bob', 'Robert', 'robert@example.com')
+    carddav_server.remove('alice')
+    carddav_server.put('carol', 'Carol', 'carol@example.com')
+    icloud_contact_sync.sync()
+    assert icloud_contacts(db, generic_account) == {
+        'bob': ('Robert', 'robert@example.com'),
+        'carol': ('Carol', 'carol@example.com')}
+    # Discovery isn't repeated, and only the changed cards are fetched.
+    assert [method for method, _, _ in carddav_server.requests] == \
+        ['REPORT', 'REPORT']
+    assert carddav_server.multiget_hrefs() == [CARDS_PATH + 'bob.vcf',
+                                               CARDS_PATH + 'carol.vcf']
+
+
+def test_expired_sync_token(db, generic_account, carddav_server,
+                            icloud_contact_sync):
+    carddav_server.put('dave', 'Dave', 'dave@example.com')
+    carddav_server.put('erin', 'Erin', 'erin@example.com')
+    icloud_contact_sync.sync()
+
+    carddav_server.requests = []
+    carddav_server.remove('erin')
+    carddav_server.expire_sync_tokens()
+    icloud_contact_sync.sync()
+    # The address book is listed from scratch; the unchanged card isn't
+    # fetched again, and the card missing from the listing is removed.
+    assert carddav_server.multiget_hrefs() == []
+    assert icloud_contacts(db, generic_account) == {
+        'dave': ('Dave', 'dave@example.com')}
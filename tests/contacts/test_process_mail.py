@@ -1,6 +1,8 @@
 """Sanity-check our logic for updating contact data from message addressees
 during a sync."""
 from inbox.models import Contact
+from inbox.contacts.process_mail import (ContactAddressCache,
+                                         update_contacts_from_messages)
 from tests.util.base import add_fake_message
 
 
@@ -69,3 +71,55 @@ def test_handle_noreply_addresses(db, default_namespace, thread):
         Contact.namespace == default_namespace,
         Contact.email_address == 'alice@example.com').first()
     assert contact.name is not None
+
+
+def test_batch_update_creates_contacts_once(db, default_namespace, thread):
+    messages = [
+        add_fake_message(db.session, default_namespace.id,
+                         from_addr=[('', 'delta@example.com')],
+                         to_addr=[('', 'epsilon@example.com')]),
+        add_fake_message(db.session, default_namespace.id,
+                         from_addr=[('', 'epsilon@example.com')],
+                         to_addr=[('', 'Delta@example.com')])]
+    for message in messages:
+        thread.messages.append(message)
+
+    cache = ContactAddressCache()
+    update_contacts_from_messages(db.session, messages, default_namespace,
+                                  cache)
+    db.session.commit()
+
+    for addr in ('delta@example.com', 'epsilon@example.com'):
+        assert db.session.query(Contact).filter_by(
+            email_address=addr, namespace_id=default_namespace.id).count() == 1
+    assert all(len(message.contacts) == 2 for message in messages)
+    # Contacts created by this batch are only cached once they've been read
+    # back from the database.
+    assert len(cache) == 0
+
+    message = add_fake_message(db.session, default_namespace.id,
+                               from_addr=[('', 'delta@example.com')])
+    thread.messages.append(message)
+    update_contacts_from_messages(db.session, [message], default_namespace,
+                                  cache)
+    db.session.commit()
+    delta = db.session.query(Contact).filter_by(
+        email_address='delta@example.com',
+        namespace_id=default_namespace.id).one()
+    assert cache.get('delta@example.com') == (delta.id, delta.name)
+    assert message.contacts[0].contact == delta
+
+
+def test_contact_address_cache_is_bounded():
+    cache = ContactAddressCache(max_size=2)
+    cache.set('a@example.com', 1, None)
+    cache.set('b@example.com', 2, None)
+    cache.get('a@example.com')
+    cache.set('c@example.com', 3, None)
+
+    assert 'a@example.com' in cache
+    assert 'b@example.com' not in cache
+    assert 'c@example.com' in cache
+
+    cache.invalidate(['a@example.com'])
+    assert 'a@example.com' not in cache
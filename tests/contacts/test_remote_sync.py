@@ -1,3 +1,5 @@
+from datetime import datetime
+
 import pytest
 
 from tests.util.base import (contact_sync, contacts_provider,
@@ -13,6 +15,32 @@ def alternate_contacts_provider():
     return ContactsProviderStub('alternate_provider')
 
 
+class PagedContactsProviderStub(ContactsProviderStub):
+    """
+    Contacts provider stub that returns the contacts it's been fed a page at
+    a time, optionally failing partway through.
+
+    """
+    def __init__(self, provider_name='paged_provider'):
+        ContactsProviderStub.__init__(self, provider_name)
+        self.pages = []
+        self.fail_at_page = None
+        self.requested_from = []
+
+    def end_page(self, checkpoint):
+        self.pages.append((self._contacts, checkpoint))
+        self._contacts = []
+
+    def get_pages(self, sync_from_dt=None):
+        self.requested_from.append(sync_from_dt)
+        for i, (contacts, checkpoint) in enumerate(self.pages):
+            if sync_from_dt is not None and checkpoint <= sync_from_dt:
+                continue
+            if i == self.fail_at_page:
+                raise ValueError('Sync interrupted')
+            yield contacts, checkpoint
+
+
 def test_add_contacts(contacts_provider, contact_sync, db, default_namespace):
     """Test that added contacts get stored."""
     num_original_contacts = db.session.query(Contact). \
@@ -81,3 +109,86 @@ def test_auth_error_handling(contact_sync, default_account, db):
     if not success:
         contact_sync.kill()
     assert success, "contact sync greenlet didn't terminate."
+
+
+def test_deletes_invalidate_mail_contact_cache(contacts_provider,
+                                               contact_sync, db,
+                                               default_namespace):
+    from inbox.contacts.process_mail import get_contact_cache
+
+    contacts_provider.supply_contact('Name', 'name@email.address')
+    contact_sync.provider = contacts_provider
+    contact_sync.sync()
+    contact = db.session.query(Contact).filter_by(
+        namespace_id=default_namespace.id,
+        email_address='name@email.address').one()
+    cache = get_contact_cache(default_namespace.id)
+    cache.set('name@email.address', contact.id, contact.name)
+
+    contacts_provider.__init__()
+    contacts_provider.supply_contact(None, None, deleted=True)
+    contact_sync.sync()
+
+    assert 'name@email.address' not in cache
+
+
+def test_sync_in_batches(contact_sync, db, default_namespace, monkeypatch):
+    monkeypatch.setattr('inbox.contacts.remote_sync.CONTACT_SYNC_BATCH_SIZE',
+                        2)
+    provider = ContactsProviderStub('batch_provider')
+    for i in range(5):
+        provider.supply_contact('Batch Contact {}'.format(i),
+                                'batch{}@email.address'.format(i))
+    # Same address and name as an earlier contact: skipped as a duplicate.
+    provider.supply_contact('Batch Contact 0', 'batch0@email.address')
+    contact_sync.provider = provider
+    contact_sync.sync()
+
+    contacts = db.session.query(Contact).filter(
+        Contact.namespace_id == default_namespace.id,
+        Contact.provider_name == 'batch_provider').all()
+    assert {c.uid for c in contacts} == {'1', '2', '3', '4', '5'}
+
+    # Update one contact and delete another, plus a deletion for a contact
+    # we never knew about, which mustn't be stored.
+    provider.__init__('batch_provider')
+    provider.supply_contact('Renamed Contact', 'batch0@email.address')
+    provider.supply_contact(None, None, deleted=True)
+    provider._next_uid = 100
+    provider.supply_contact(None, None, deleted=True)
+    contact_sync.sync()
+    db.session.expire_all()
+
+    contacts = db.session.query(Contact).filter(
+        Contact.namespace_id == default_namespace.id,
+        Contact.provider_name == 'batch_provider').all()
+    assert {c.uid for c in contacts} == {'1', '3', '4', '5'}
+    assert [c.name for c in contacts if c.uid == '1'] == ['Renamed Contact']
+
+
+def test_interrupted_sync_resumes(contact_sync, db, default_account):
+    default_account.last_synced_contacts = None
+    db.session.commit()
+    provider = PagedContactsProviderStub()
+    provider.supply_contact('Page One', 'page.one@email.address')
+    provider.end_page(datetime(2015, 10, 1))
+    provider.supply_contact('Page Two', 'page.two@email.address')
+    provider.end_page(datetime(2015, 10, 2))
+    provider.fail_at_page = 1
+    contact_sync.provider = provider
+
+    with pytest.raises(ValueError):
+        contact_sync.sync()
+    db.session.expire_all()
+    contacts = db.session.query(Contact).filter(
+        Contact.namespace_id == default_account.namespace.id,
+        Contact.provider_name == 'paged_provider')
+    assert [c.name for c in contacts] == ['Page One']
+    assert default_account.last_synced_contacts == datetime(2015, 10, 1)
+
+    provider.fail_at_page = None
+    contact_sync.sync()
+    db.session.expire_all()
+    assert provider.requested_from[-1] == datetime(2015, 10, 1)
+    assert sorted(c.name for c in contacts) == ['Page One', 'Page Two']
+    assert default_account.last_synced_contacts > datetime(2015, 10, 2)
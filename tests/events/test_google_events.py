@@ -4,6 +4,7 @@ import gevent
 import mock
 import pytest
 import requests
+import time
 from inbox.basicauth import AccessNotEnabledError
 from inbox.events.google import GoogleEventsProvider, parse_event_response
 from inbox.models import Calendar, Event
@@ -327,12 +328,41 @@ def test_pagination():
         'items': ['D', 'E']
     })
 
-    requests.get = mock.Mock(side_effect=[first_response, second_response])
     provider = GoogleEventsProvider(1, 1)
+    provider.session.get = mock.Mock(
+        side_effect=[first_response, second_response])
     provider._get_access_token = mock.Mock(return_value='token')
     items = provider._get_resource_list('https://googleapis.com/testurl')
     assert items == ['A', 'B', 'C', 'D', 'E']
 
+    provider.session.get = mock.Mock(
+        side_effect=[first_response, second_response])
+    pages = provider._iter_resource_pages('https://googleapis.com/testurl')
+    assert [page['items'] for page in pages] == [['A', 'B', 'C'], ['D', 'E']]
+
+
+def test_expired_sync_token():
+    expired_response = requests.Response()
+    expired_response.status_code = 410
+    full_response = requests.Response()
+    full_response.status_code = 200
+    full_response._content = json.dumps({
+        'items': [],
+        'nextSyncToken': 'new_token'
+    })
+
+    provider = GoogleEventsProvider(1, 1)
+    provider.session.get = mock.Mock(
+        side_effect=[expired_response, full_response])
+    provider._get_access_token = mock.Mock(return_value='token')
+    pages = list(provider.sync_event_pages('uid', sync_token='old_token'))
+    assert pages == [([], 'new_token')]
+
+    # The token was sent, then everything was refetched without it.
+    first_call, second_call = provider.session.get.call_args_list
+    assert first_call[1]['params']['syncToken'] == 'old_token'
+    assert 'syncToken' not in second_call[1]['params']
+
 
 def test_handle_http_401():
     first_response = requests.Response()
@@ -344,8 +374,9 @@ def test_handle_http_401():
         'items': ['A', 'B', 'C']
     })
 
-    requests.get = mock.Mock(side_effect=[first_response, second_response])
     provider = GoogleEventsProvider(1, 1)
+    provider.session.get = mock.Mock(
+        side_effect=[first_response, second_response])
     provider._get_access_token = mock.Mock(return_value='token')
     items = provider._get_resource_list('https://googleapis.com/testurl')
     assert items == ['A', 'B', 'C']
@@ -374,14 +405,17 @@ def test_handle_quota_exceeded():
         'items': ['A', 'B', 'C']
     })
 
-    requests.get = mock.Mock(side_effect=[first_response, second_response])
     gevent.sleep = mock.Mock()
     provider = GoogleEventsProvider(1, 1)
+    provider.session.get = mock.Mock(
+        side_effect=[first_response, second_response])
     provider._get_access_token = mock.Mock(return_value='token')
     items = provider._get_resource_list('https://googleapis.com/testurl')
     # Check that we slept, then retried.
     assert gevent.sleep.called
     assert items == ['A', 'B', 'C']
+    # Requests for the account's other calendars are held back too.
+    assert provider._backoff_until > time.time()
 
 
 def test_handle_internal_server_error():
@@ -394,9 +428,10 @@ def test_handle_internal_server_error():
         'items': ['A', 'B', 'C']
     })
 
-    requests.get = mock.Mock(side_effect=[first_response, second_response])
     gevent.sleep = mock.Mock()
     provider = GoogleEventsProvider(1, 1)
+    provider.session.get = mock.Mock(
+        side_effect=[first_response, second_response])
     provider._get_access_token = mock.Mock(return_value='token')
     items = provider._get_resource_list('https://googleapis.com/testurl')
     # Check that we slept, then retried.
@@ -419,8 +454,8 @@ def test_handle_api_not_enabled():
         }
     })
 
-    requests.get = mock.Mock(return_value=response)
     provider = GoogleEventsProvider(1, 1)
+    provider.session.get = mock.Mock(return_value=response)
     provider._get_access_token = mock.Mock(return_value='token')
     with pytest.raises(AccessNotEnabledError):
         provider._get_resource_list('https://googleapis.com/testurl')
@@ -430,16 +465,16 @@ def test_handle_other_errors():
     response = requests.Response()
     response.status_code = 403
     response._content = "This is not the JSON you're looking for"
-    requests.get = mock.Mock(return_value=response)
     provider = GoogleEventsProvider(1, 1)
+    provider.session.get = mock.Mock(return_value=response)
     provider._get_access_token = mock.Mock(return_value='token')
     with pytest.raises(requests.exceptions.HTTPError):
         provider._get_resource_list('https://googleapis.com/testurl')
 
     response = requests.Response()
     response.status_code = 404
-    requests.get = mock.Mock(return_value=response)
     provider = GoogleEventsProvider(1, 1)
+    provider.session.get = mock.Mock(return_value=response)
     provider._get_access_token = mock.Mock(return_value='token')
     with pytest.raises(requests.exceptions.HTTPError):
         provider._get_resource_list('https://googleapis.com/testurl')
@@ -7,7 +7,8 @@ from flanker import mime
 from inbox.models import Message
 from inbox.models.event import Event, RecurringEvent
 from inbox.events.util import MalformedEventError
-from inbox.events.ical import events_from_ics, import_attached_events
+from inbox.events.ical import (events_from_ics, import_attached_events,
+                               import_attached_events_from_messages)
 from tests.util.base import (absolute_path, add_fake_calendar,
                              generic_account, add_fake_msg_with_calendar_part)
 
@@ -442,3 +443,40 @@ def test_truncate_bogus_sequence_numbers(db, default_account):
     # Check that the sequence number got truncated to the biggest possible
     # number.
     assert ev.sequence_number == 2147483647L
+
+
+def test_duplicate_invites_not_reparsed(db, default_account, monkeypatch):
+    parsed = []
+
+    def counting_events_from_ics(namespace, calendar, ics_str):
+        parsed.append(ics_str)
+        return events_from_ics(namespace, calendar, ics_str)
+
+    monkeypatch.setattr('inbox.events.ical.events_from_ics',
+                        counting_events_from_ics)
+
+    with open(absolute_path(FIXTURES + 'gcal_v1.ics')) as fd:
+        ics_v1 = fd.read()
+    with open(absolute_path(FIXTURES + 'gcal_v2.ics')) as fd:
+        ics_v2 = fd.read()
+
+    messages = [add_fake_msg_with_calendar_part(db.session, default_account,
+                                                ics_data)
+                for ics_data in (ics_v1, ics_v1, ics_v2, ics_v2)]
+    import_attached_events_from_messages(db.session, default_account,
+                                         messages)
+    db.session.commit()
+    assert len(parsed) == 2
+
+    # The update later in the batch is merged into the new event.
+    ev = db.session.query(Event).filter(
+        Event.namespace_id == default_account.namespace.id,
+        Event.uid == "jvbroggos139aumnj4p5og9rd0@google.com").one()
+    assert ev.location == (u"Le Zenith, 211 Avenue Jean Jaures, "
+                            "75019 Paris, France")
+
+    msg = add_fake_msg_with_calendar_part(db.session, default_account,
+                                          ics_v1)
+    import_attached_events(db.session, default_account, msg)
+    db.session.commit()
+    assert len(parsed) == 2
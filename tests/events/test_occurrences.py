@@ -0,0 +1,105 @@
+import arrow
+
+from inbox.api.filtering import events
+from inbox.events.occurrences import OccurrenceHorizonService
+from inbox.models.event import RecurringEvent, EventOccurrence
+
+from tests.events.test_recurrence import (recurring_event, recurring_override,
+                                          TEST_EXDATE_RULE)
+
+# TEST_EXDATE_RULE recurs weekly from 2014-08-07 to 2014-09-18, except on
+# 2014-09-04.
+NUM_INSTANCES = 6
+
+
+def occurrences(db, master):
+    return db.session.query(EventOccurrence). \
+        filter(EventOccurrence.master_event_id == master.id). \
+        order_by(EventOccurrence.start).all()
+
+
+def expand(db, namespace_id, **kwargs):
+    args = dict(event_public_id=None, calendar_public_id=None, title=None,
+                description=None, location=None, busy=None,
+                starts_before=None, starts_after=None, ends_before=None,
+                ends_after=None, limit=100, offset=0, view=None,
+                expand_recurring=True, show_cancelled=False)
+    args.update(kwargs)
+    return events(namespace_id=namespace_id, db_session=db.session, **args)
+
+
+def unmaterialize(db):
+    db.session.execute(EventOccurrence.__table__.delete())
+    db.session.execute(RecurringEvent.__table__.update().values(
+        occurrences_until=None))
+    db.session.commit()
+    db.session.expire_all()
+
+
+def test_occurrences_materialized_on_commit(db, default_account, calendar):
+    master = recurring_event(db, default_account, calendar, TEST_EXDATE_RULE)
+    rows = occurrences(db, master)
+    assert [r.start for r in rows] == [e.start for e in master.inflate()]
+    assert all(r.end - r.start == master.length for r in rows)
+    assert all(r.override_event_id is None for r in rows)
+    assert len(rows) == NUM_INSTANCES
+    assert master.occurrences_until is not None
+
+
+def test_occurrences_follow_overrides(db, default_account, calendar):
+    master = recurring_event(db, default_account, calendar, TEST_EXDATE_RULE)
+    original_start = arrow.get(2014, 8, 14, 20, 30, 00)
+    override = recurring_override(db, master, original_start,
+                                  original_start.replace(hours=+1),
+                                  original_start.replace(hours=+2))
+
+    rows = occurrences(db, master)
+    assert len(rows) == NUM_INSTANCES
+    assert original_start not in [r.start for r in rows]
+    moved = [r for r in rows if r.override_event_id == override.id]
+    assert len(moved) == 1
+    assert moved[0].start == override.start
+
+    override.cancelled = True
+    db.session.commit()
+    rows = occurrences(db, master)
+    assert len(rows) == NUM_INSTANCES - 1
+    assert override.id not in [r.override_event_id for r in rows]
+
+
+def test_materialized_expansion_matches_inflation(db, default_account,
+                                                  calendar):
+    master = recurring_event(db, default_account, calendar, TEST_EXDATE_RULE)
+    original_start = arrow.get(2014, 8, 14, 20, 30, 00)
+    recurring_override(db, master, original_start,
+                       original_start.replace(hours=+1),
+                       original_start.replace(hours=+2))
+    namespace_id = default_account.namespace.id
+    ranges = [{},
+              {'starts_after': arrow.get(2014, 8, 10)},
+              {'starts_after': arrow.get(2014, 8, 14, 20, 30, 00),
+               'ends_before': arrow.get(2014, 9, 1)},
+              {'ends_after': arrow.get(2014, 8, 21, 21, 00, 00),
+               'starts_before': arrow.get(2014, 9, 12)},
+              {'limit': 2, 'offset': 1}]
+
+    materialized = [expand(db, namespace_id, **r) for r in ranges]
+    unmaterialize(db)
+    inflated = [expand(db, namespace_id, **r) for r in ranges]
+
+    for m, i in zip(materialized, inflated):
+        assert [e.public_id for e in m] == [e.public_id for e in i]
+        assert [e.start for e in m] == [e.start for e in i]
+    assert expand(db, namespace_id, view='count') == \
+        {'count': len(inflated[0])}
+
+
+def test_horizon_service_backfills(db, default_account, calendar):
+    master = recurring_event(db, default_account, calendar, TEST_EXDATE_RULE)
+    unmaterialize(db)
+    assert occurrences(db, master) == []
+
+    OccurrenceHorizonService().extend_horizon()
+    db.session.expire_all()
+    assert len(occurrences(db, master)) == NUM_INSTANCES
+    assert master.occurrences_until > arrow.utcnow()
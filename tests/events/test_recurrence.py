@@ -3,6 +3,7 @@ import arrow
 from dateutil import tz
 from dateutil.rrule import rrulestr
 from datetime import timedelta
+from itertools import islice
 from inbox.models.event import Event, RecurringEvent, RecurringEventOverride
 from inbox.models.when import Date, Time, DateSpan, TimeSpan
 from inbox.events.remote_sync import handle_event_updates
@@ -357,6 +358,23 @@ def test_override_same_start(db, default_account, calendar):
     assert override in all_events
 
 
+def test_lazy_expansion(db, default_account, calendar):
+    # Occurrences of an unbounded rule are inflated in start order as they
+    # are consumed, with overrides merged in.
+    event = recurring_event(db, default_account, calendar,
+                            ["RRULE:FREQ=DAILY"])
+    override = recurring_override(db, event,
+                                  arrow.get(2014, 8, 9, 20, 30, 00),
+                                  arrow.get(2014, 8, 9, 18, 00, 00),
+                                  arrow.get(2014, 8, 9, 19, 00, 00))
+    first = list(islice(event.iter_events(), 4))
+    assert [e.start for e in first] == [arrow.get(2014, 8, 7, 20, 30, 00),
+                                        arrow.get(2014, 8, 8, 20, 30, 00),
+                                        arrow.get(2014, 8, 9, 18, 00, 00),
+                                        arrow.get(2014, 8, 10, 20, 30, 00)]
+    assert first[2] == override
+
+
 def test_override_updated(db, default_account, calendar):
     # Test that when a recurring event override is created or updated
     # remotely, we update our override links appropriately.
@@ -426,6 +444,44 @@ def test_override_updated(db, default_account, calendar):
     assert find_override.location == 'walk and talk'
 
 
+def test_override_linked_in_same_batch(db, default_account, calendar):
+    # Test that a master and its override arriving in the same page of
+    # results are linked, whichever comes first.
+    master = recurring_event(db, default_account, calendar, TEST_RRULE,
+                             commit=False)
+    master.uid = 'batchuid'
+    override_uid = master.uid + "_20140814T203000Z"
+    override = Event(title='new override from google',
+                     description='',
+                     uid=override_uid,
+                     location='',
+                     busy=False,
+                     read_only=False,
+                     reminders='',
+                     recurrence=None,
+                     start=arrow.get(2014, 8, 14, 22, 30, 00),
+                     end=arrow.get(2014, 8, 14, 23, 30, 00),
+                     all_day=False,
+                     is_owner=False,
+                     participants=[],
+                     provider_name='inbox',
+                     raw_data='',
+                     original_start_tz='America/Los_Angeles',
+                     original_start_time=arrow.get(2014, 8, 14, 21, 30, 00),
+                     master_event_uid=master.uid,
+                     source='local')
+    handle_event_updates(default_account.namespace.id,
+                         calendar.id,
+                         [override, master], log, db.session)
+    db.session.commit()
+
+    find_master = db.session.query(Event).filter_by(
+        uid=master.uid, namespace_id=default_account.namespace.id).one()
+    find_override = db.session.query(Event).filter_by(
+        uid=override_uid, namespace_id=default_account.namespace.id).one()
+    assert find_override.master_event_id == find_master.id
+
+
 def test_override_cancelled(db, default_account, calendar):
     # Test that overrides with status 'cancelled' are appropriately missing
     # from the expanded event.
@@ -1,5 +1,6 @@
 from datetime import datetime
-from inbox.events.remote_sync import EventSync
+from gevent.event import Event as GeventEvent
+from inbox.events.remote_sync import EventSync, GoogleEventSync
 from inbox.events.util import CalendarSyncResponse
 from inbox.models import Calendar, Event, Transaction
 from tests.util.base import new_account
@@ -78,6 +79,14 @@ def event_response_with_delete(calendar_uid, sync_from_time):
                       **default_params)]
 
 
+def paged(event_response):
+    # Serve a mock provider response as a single page of results.
+    def sync_event_pages(calendar_uid, sync_from_time, sync_token=None):
+        yield (event_response(calendar_uid, sync_from_time),
+               'sync_token_' + calendar_uid)
+    return sync_event_pages
+
+
 def test_handle_changes(db, new_account):
     namespace_id = new_account.namespace.id
     event_sync = EventSync(new_account.email_address, 'google', new_account.id,
@@ -85,7 +94,7 @@ def test_handle_changes(db, new_account):
 
     # Sync calendars/events
     event_sync.provider.sync_calendars = calendar_response
-    event_sync.provider.sync_events = event_response
+    event_sync.provider.sync_event_pages = paged(event_response)
     event_sync.sync()
 
     assert db.session.query(Calendar).filter(
@@ -100,9 +109,15 @@ def test_handle_changes(db, new_account):
         Event.namespace_id == namespace_id,
         Calendar.uid == 'second_calendar_uid').count() == 2
 
+    # Check that the next sync token was stored.
+    assert db.session.query(Calendar.sync_token).filter(
+        Calendar.namespace_id == namespace_id,
+        Calendar.uid == 'first_calendar_uid').scalar() == \
+        'sync_token_first_calendar_uid'
+
     # Sync a calendar update
     event_sync.provider.sync_calendars = calendar_response_with_update
-    event_sync.provider.sync_events = event_response
+    event_sync.provider.sync_event_pages = paged(event_response)
     event_sync.sync()
 
     # Check that we have the same number of calendars and events as before
@@ -125,7 +140,7 @@ def test_handle_changes(db, new_account):
     assert first_calendar.name == 'Super Important Meetings'
 
     # Sync an event update
-    event_sync.provider.sync_events = event_response_with_update
+    event_sync.provider.sync_event_pages = paged(event_response_with_update)
     event_sync.sync()
     # Make sure the update was persisted
     first_event = db.session.query(Event).filter(
@@ -135,7 +150,7 @@ def test_handle_changes(db, new_account):
     assert first_event.title == 'Top Secret Plotting Meeting'
 
     # Sync an event delete
-    event_sync.provider.sync_events = event_response_with_delete
+    event_sync.provider.sync_event_pages = paged(event_response_with_delete)
     event_sync.sync()
     # Make sure the delete was persisted.
     first_event = db.session.query(Event).filter(
@@ -169,3 +184,35 @@ def test_handle_changes(db, new_account):
     # calendar still survive.
     assert db.session.query(Event).filter(
         Event.namespace_id == namespace_id).count() == 2
+
+
+def test_calendars_synced_concurrently(db, gmail_account, monkeypatch):
+    monkeypatch.setattr('inbox.events.remote_sync.CALENDAR_SYNC_CONCURRENCY',
+                        2)
+    namespace_id = gmail_account.namespace.id
+    event_sync = GoogleEventSync(gmail_account.email_address, 'gmail',
+                                 gmail_account.id, namespace_id)
+    event_sync.provider.sync_calendars = calendar_response
+
+    # Each calendar's sync waits until another one has started, so this only
+    # finishes if they run concurrently.
+    started = []
+    both_started = GeventEvent()
+
+    def sync_event_pages(calendar_uid, sync_from_time, sync_token=None):
+        started.append(calendar_uid)
+        if len(started) >= 2:
+            both_started.set()
+        assert both_started.wait(timeout=10)
+        yield event_response(calendar_uid, sync_from_time), None
+
+    event_sync.provider.sync_event_pages = sync_event_pages
+    event_sync._sync_data()
+
+    assert db.session.query(Event).join(Calendar).filter(
+        Event.namespace_id == namespace_id,
+        Calendar.uid == 'first_calendar_uid').count() == 3
+
+    assert db.session.query(Event).join(Calendar).filter(
+        Event.namespace_id == namespace_id,
+        Calendar.uid == 'second_calendar_uid').count() == 2
@@ -0,0 +1,87 @@
+from hashlib import sha256
+
+import gevent
+from gevent.event import Event
+
+from inbox.config import config
+from inbox.models import Block
+from inbox.util.blob_upload import BlobSpool
+
+
+class FakeS3(object):
+    """ Stand-in for S3, on the local filesystem. """
+    def __init__(self, directory, failures=0):
+        self.directory = directory
+        self.failures = failures
+        self.release = Event()
+        self.release.set()
+
+    def upload(self, data_sha256, path):
+        self.release.wait()
+        if self.failures:
+            self.failures -= 1
+            raise IOError('Upload failed')
+        with open(path, 'rb') as f:
+            self.directory.join(data_sha256).write(f.read(), 'wb')
+
+
+def test_spooled_blobs_uploaded_with_retries(tmpdir, monkeypatch):
+    monkeypatch.setattr('inbox.util.blob_upload.UPLOAD_RETRY_DELAY', 0)
+    s3 = FakeS3(tmpdir.mkdir('s3'), failures=2)
+    spool = BlobSpool(str(tmpdir.mkdir('spool')), upload=s3.upload,
+                      concurrency=2)
+    blobs = {sha256(data).hexdigest(): data
+             for data in ('first blob', 'second blob', 'third blob')}
+    for data_sha256, data in blobs.items():
+        spool.add(data_sha256, data)
+    spool.join(timeout=5)
+
+    for data_sha256, data in blobs.items():
+        assert s3.directory.join(data_sha256).read('rb') == data
+        assert spool.get(data_sha256) is None
+    spool.stop()
+
+
+def test_leftover_blobs_uploaded(tmpdir):
+    s3 = FakeS3(tmpdir.mkdir('s3'))
+    spool_dir = tmpdir.mkdir('spool')
+    leftover_sha256 = sha256('left over').hexdigest()
+    corrupted_sha256 = sha256('corrupted').hexdigest()
+    spool_dir.join(leftover_sha256).write('left over')
+    spool_dir.join(corrupted_sha256).write('corrupt')
+    spool_dir.join('def456.tmp').write('partially written')
+    spool = BlobSpool(str(spool_dir), upload=s3.upload)
+    spool.start()
+    gevent.sleep(0)
+    spool.join(timeout=5)
+    assert s3.directory.join(leftover_sha256).read() == 'left over'
+    assert not s3.directory.join('def456.tmp').check()
+
+    # Data that doesn't match its sha256 isn't uploaded.
+    assert not s3.directory.join(corrupted_sha256).check()
+    assert not spool_dir.join(corrupted_sha256).check()
+    assert spool_dir.join('quarantine', corrupted_sha256).read() == 'corrupt'
+    spool.stop()
+
+
+def test_blob_read_from_spool_until_uploaded(tmpdir, monkeypatch):
+    for key in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY',
+                'MESSAGE_STORE_BUCKET_NAME'):
+        monkeypatch.setitem(config, key, 'test')
+    s3 = FakeS3(tmpdir.mkdir('s3'))
+    s3.release.clear()
+    spool = BlobSpool(str(tmpdir.mkdir('spool')), upload=s3.upload)
+    monkeypatch.setattr('inbox.util.blob_upload._blob_spool', spool)
+    monkeypatch.setattr('inbox.models.roles.STORE_MSG_ON_S3', True)
+
+    block = Block()
+    block.data = 'Some spooled data'
+    del block._data
+    gevent.sleep(0)
+    assert block.data == 'Some spooled data'
+    assert ''.join(block.iter_data(chunk_size=4)) == 'Some spooled data'
+
+    s3.release.set()
+    spool.join(timeout=5)
+    assert s3.directory.join(block.data_sha256).read() == 'Some spooled data'
+    spool.stop()
@@ -1,7 +1,13 @@
+import time
 import smtplib
 import pytest
 import mock
-from inbox.sendmail.smtp.postel import SMTPConnection
+from inbox.sendmail.smtp import postel
+from inbox.sendmail.smtp.postel import (SMTPConnection, SMTPConnectionPool,
+                                        SMTP_CONNECTION_IDLE_TIMEOUT,
+                                        SMTP_MAX_MESSAGES_PER_CONNECTION,
+                                        smtp_connection_pool,
+                                        sweep_connection_pools)
 from nylas.logging import get_logger
 
 
@@ -42,3 +48,117 @@ def test_handle_disconnect(monkeypatch, smtp_port):
                           log=get_logger())
     with pytest.raises(smtplib.SMTPSenderRefused):
         conn.sendmail(['test@example.com'], 'hello there')
+
+
+class FakeSMTPConnection(object):
+    def __init__(self):
+        self.messages_sent = 0
+        self.healthy = True
+        self.closed = False
+
+    def is_healthy(self):
+        return self.healthy
+
+    def close(self):
+        self.closed = True
+
+
+def test_connection_pool(monkeypatch):
+    pool = SMTPConnectionPool()
+    with pool.get(FakeSMTPConnection) as conn:
+        pass
+    with pool.get(FakeSMTPConnection) as reused:
+        assert reused is conn
+
+    # Connections that fail the health check, have been idle for too long or
+    # have sent too many messages are closed rather than reused.
+    conn.healthy = False
+    with pool.get(FakeSMTPConnection) as new_conn:
+        assert new_conn is not conn and conn.closed
+
+    later = time.time() + SMTP_CONNECTION_IDLE_TIMEOUT
+    monkeypatch.setattr('inbox.sendmail.smtp.postel.time.time', lambda: later)
+    with pool.get(FakeSMTPConnection) as conn:
+        assert conn is not new_conn and new_conn.closed
+        conn.messages_sent = SMTP_MAX_MESSAGES_PER_CONNECTION
+    assert conn.closed
+
+    # So are connections that raised an error.
+    with pytest.raises(smtplib.SMTPServerDisconnected):
+        with pool.get(FakeSMTPConnection) as conn:
+            raise smtplib.SMTPServerDisconnected()
+    assert conn.closed
+    with pool.get(FakeSMTPConnection) as new_conn:
+        assert new_conn is not conn
+
+
+def test_connection_pool_sweep(monkeypatch):
+    monkeypatch.setattr(postel, '_connection_pools', {})
+    pool = smtp_connection_pool(1, ('smtp.example.com', 587))
+    with pool.get(FakeSMTPConnection) as conn:
+        pass
+
+    sweep_connection_pools()
+    assert not conn.closed
+    assert smtp_connection_pool(1, ('smtp.example.com', 587)) is pool
+
+    later = time.time() + SMTP_CONNECTION_IDLE_TIMEOUT
+    monkeypatch.setattr('inbox.sendmail.smtp.postel.time.time', lambda: later)
+    in_use_pool = smtp_connection_pool(2, ('smtp.example.com', 587))
+
+    def connect_during_sweep():
+        sweep_connection_pools()
+        return FakeSMTPConnection()
+
+    with in_use_pool.get(connect_during_sweep):
+        sweep_connection_pools()
+    assert conn.closed
+    # The pool with a connection being established or in use is kept, the
+    # other one is dropped.
+    assert postel._connection_pools.values() == [in_use_pool]
+
+
+class FakeSMTP(object):
+    def __init__(self):
+        self.sent = []
+
+    def ehlo_or_helo_if_needed(self):
+        pass
+
+    def mail(self, sender):
+        return 250, 'OK'
+
+    def rcpt(self, recipient):
+        if recipient == 'nobody@example.com':
+            return 550, 'No such user'
+        return 250, 'OK'
+
+    def docmd(self, cmd):
+        assert cmd == 'data'
+        return 354, 'Go ahead'
+
+    def send(self, data):
+        self.sent.append(data)
+
+    def getreply(self):
+        return 250, 'Queued'
+
+
+def test_streamed_sendmail(monkeypatch):
+    def setup(self):
+        self.connection = FakeSMTP()
+    monkeypatch.setattr(SMTPConnection, 'setup', setup)
+    conn = SMTPConnection(account_id=1,
+                          email_address='inboxapptest@gmail.com',
+                          auth_type='password',
+                          auth_token='secret_password',
+                          smtp_endpoint=('smtp.gmail.com', 587),
+                          log=get_logger())
+    # Lines starting with a dot are dot-stuffed, and line endings normalized,
+    # even when they're split across chunks.
+    chunks = ['Subject: Hi\r\n\r\n.Leading', ' dot\r', '\n..Two\nend']
+    failures = conn.sendmail(['alice@example.com', 'nobody@example.com'],
+                             iter(chunks))
+    assert failures == {'nobody@example.com': (550, 'No such user')}
+    assert ''.join(conn.connection.sent) == \
+        'Subject: Hi\r\n\r\n..Leading dot\r\n...Two\r\nend\r\n.\r\n'
@@ -1,5 +1,10 @@
+from datetime import datetime, timedelta
+
 from inbox.crispin import GmailFlags
 from inbox.mailsync.backends.imap.common import update_metadata
+from inbox.models import ActionLog
+from inbox.models.action_log import schedule_action, schedule_bulk_action
+from tests.util.base import add_fake_category, add_fake_message
 
 
 def test_gmail_label_sync(db, default_account, message, folder,
@@ -17,3 +22,34 @@ def test_gmail_label_sync(db, default_account, message, folder,
     category_display_names = {c.display_name for c in message.categories}
     assert 'important' in category_canonical_names
     assert {'foo', '42'}.issubset(category_display_names)
+
+
+def test_bulk_action_only_blocks_its_own_messages(db, default_namespace,
+                                                  thread):
+    from inbox.mailsync.backends.imap.common import _update_categories
+    covered = add_fake_message(db.session, default_namespace.id, thread)
+    other = add_fake_message(db.session, default_namespace.id, thread)
+    label = add_fake_category(db.session, default_namespace.id, 'foo')
+
+    # The other message's own label change was synced back a while ago,
+    # and a newer bulk label change of the first message is pending.
+    schedule_action('change_labels', other, default_namespace.id,
+                    db.session, added_labels=['foo'], removed_labels=[])
+    db.session.flush()
+    own_action = db.session.query(ActionLog).filter(
+        ActionLog.record_id == other.id).one()
+    own_action.status = 'successful'
+    own_action.updated_at = datetime.utcnow() - timedelta(minutes=5)
+    schedule_bulk_action('bulk_change_labels', 'message', [covered.id],
+                         default_namespace.id, db.session,
+                         added_labels=['foo'], removed_labels=[])
+    covered.categories_changes = other.categories_changes = True
+    db.session.commit()
+
+    _update_categories(db.session, covered, {label})
+    assert covered.categories_changes
+    assert label not in covered.categories
+
+    _update_categories(db.session, other, {label})
+    assert not other.categories_changes
+    assert other.categories == {label}
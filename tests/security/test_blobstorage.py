@@ -1,6 +1,8 @@
 import zlib
 import hypothesis
-from inbox.security.blobstorage import encode_blob, decode_blob
+import pytest
+from inbox.security.blobstorage import (encode_blob, decode_blob,
+                                        train_dictionary)
 
 
 # This will run the test for a bunch of randomly-chosen values of sample_input.
@@ -32,3 +34,32 @@ def test_message_body_storage(config, message, sample_input, encrypt):
     assert message._compacted_body.startswith(
         chr(encrypt) + '\x00\x00\x00\x00')
     assert message.body == sample_input
+
+
+NOTIFICATION = ('<html><body><table class="notification"><tr><td>'
+                'Hi {}, you have a new follower!</td></tr>\n<tr><td>'
+                '<a href="https://example.com/settings">Unsubscribe</a>'
+                '</td></tr></table></body></html>\n')
+
+
+@pytest.mark.parametrize('encrypt', [False, True])
+def test_dictionary_compression(config, tmpdir, monkeypatch, encrypt):
+    monkeypatch.setattr('inbox.security.blobstorage._dictionaries', {})
+    config['ENCRYPT_SECRETS'] = encrypt
+    sample = NOTIFICATION.format('Alice')
+    zlib_encoded = encode_blob(sample)
+
+    dictionary = train_dictionary(
+        [NOTIFICATION.format(name) for name in ('Bob', 'Carol', 'Dave')])
+    path = tmpdir.join('dictionary')
+    path.write(dictionary, 'wb')
+    monkeypatch.setitem(config, 'BLOB_COMPRESSION_DICTIONARIES',
+                        {'3': str(path)})
+    monkeypatch.setitem(config, 'BLOB_COMPRESSION_DICTIONARY_ID', 3)
+    encoded = encode_blob(sample)
+    assert encoded.startswith(chr(encrypt) + '\x00\x00\x01\x03')
+    assert decode_blob(encoded) == sample
+    if not encrypt:
+        assert len(encoded) < len(zlib_encoded)
+    # Blobs compressed without a dictionary still decode.
+    assert decode_blob(zlib_encoded) == sample
@@ -0,0 +1,89 @@
+import json
+
+import pytest
+from sqlalchemy import asc
+
+from inbox.models import Transaction
+from inbox.models.search import ContactSearchIndexCursor
+from inbox.transactions.search import ContactSearchIndexService
+
+from tests.util.base import add_fake_contact
+
+
+class FakeDocService(object):
+    def __init__(self):
+        self.uploads = []
+
+    def upload_documents(self, documents, contentType):
+        self.uploads.append(json.loads(documents))
+
+
+@pytest.fixture
+def doc_service(monkeypatch):
+    service = FakeDocService()
+    monkeypatch.setattr('inbox.transactions.search.get_doc_service',
+                        lambda: service)
+    return service
+
+
+def contact_transactions(db_session):
+    return db_session.query(Transaction).filter(
+        Transaction.object_type == 'contact').order_by(
+            asc(Transaction.id)).all()
+
+
+def test_transactions_collapsed_per_contact(db, default_namespace,
+                                            doc_service):
+    alpha = add_fake_contact(db.session, default_namespace.id, name='Alpha',
+                             email_address='alpha@example.com', uid='a')
+    beta = add_fake_contact(db.session, default_namespace.id, name='Beta',
+                            email_address='beta@example.com', uid='b')
+    alpha.name = 'Alpha Prime'
+    db.session.commit()
+    beta_id = beta.id
+    db.session.delete(beta)
+    db.session.commit()
+
+    transactions = contact_transactions(db.session)
+    service = ContactSearchIndexService(batch_size=100)
+    service.index(transactions, db.session)
+
+    assert len(doc_service.uploads) == 1
+    docs = {doc['id']: doc for doc in doc_service.uploads[0]}
+    assert docs[alpha.id]['type'] == 'add'
+    assert docs[alpha.id]['fields']['name'] == 'Alpha Prime'
+    assert docs[beta_id] == {'type': 'delete', 'id': beta_id}
+
+
+def test_pointer_advances_per_batch(db, default_namespace, doc_service):
+    for i in range(3):
+        add_fake_contact(db.session, default_namespace.id,
+                         email_address='c{}@example.com'.format(i),
+                         uid=str(i))
+
+    transactions = contact_transactions(db.session)
+    service = ContactSearchIndexService(batch_size=1)
+    service.index(transactions, db.session)
+
+    assert len(doc_service.uploads) == len(transactions)
+    assert all(len(upload) == 1 for upload in doc_service.uploads)
+    cursor = db.session.query(ContactSearchIndexCursor).one()
+    assert cursor.transaction_id == transactions[-1].id
+
+
+def test_pointer_not_advanced_on_failed_upload(db, default_namespace,
+                                               monkeypatch):
+    class FailingDocService(object):
+        def upload_documents(self, documents, contentType):
+            raise ValueError('upload failed')
+
+    monkeypatch.setattr('inbox.transactions.search.get_doc_service',
+                        FailingDocService)
+    add_fake_contact(db.session, default_namespace.id)
+    transactions = contact_transactions(db.session)
+
+    service = ContactSearchIndexService()
+    service.transaction_pointer = 0
+    with pytest.raises(ValueError):
+        service.index(transactions, db.session)
+    assert service.transaction_pointer == 0